@@ -30,15 +30,12 @@ if __name__ == '__main__':
 
     documents = filenames_file_to_filenames(args.file_list)
 
-    ivecs = []
+    contents = []
     for doc in documents:
         with open(doc) as f:
-            content = f.read()
+            contents.append(f.read())
 
-        complete_ivec = ivec_extractor(content)
-        ivecs.append(complete_ivec)
-
-    ivecs = torch.stack(ivecs)
+    ivecs = ivec_extractor.extract_batch(contents)
     print(ivecs)
 
     with open(args.output, 'w') as f:
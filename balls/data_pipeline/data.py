@@ -1,28 +1,195 @@
+import json
+import struct
+
+import numpy as np
 import torch
 
+from language_models.vocab import encode_words, vocab_fingerprint, vocab_max_index
 
-def tokens_from_file(f, vocab, randomize, regime='words'):
-    ids = []
 
+CORPUS_MAGIC = b'BRNOTOK1'
+HEADER_ALIGNMENT = 64
+
+
+def write_binary_header(f, magic, header):
+    """ Writes magic, length-prefixed JSON header and pads to HEADER_ALIGNMENT.
+
+        Returns the offset at which the payload starts.
+    """
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix_len = len(magic) + 8
+    payload_offset = prefix_len + len(header_bytes)
+    payload_offset += (-payload_offset) % HEADER_ALIGNMENT
+    header_bytes += b' ' * (payload_offset - prefix_len - len(header_bytes))
+
+    f.write(magic)
+    f.write(struct.pack('<Q', len(header_bytes)))
+    f.write(header_bytes)
+
+    return payload_offset
+
+
+def read_binary_header(f, magic):
+    """ Counterpart of write_binary_header, returns (header, payload_offset).
+    """
+    file_magic = f.read(len(magic))
+    if file_magic != magic:
+        raise ValueError("Not a compiled file, expected magic {}, got {}".format(magic, file_magic))
+
+    header_len, = struct.unpack('<Q', f.read(8))
+    header = json.loads(f.read(header_len).decode('utf-8'))
+
+    return header, len(magic) + 8 + header_len
+
+
+def has_magic(fn, magic):
+    with open(fn, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+
+def token_dtype(vocab):
+    """ Narrowest signed type which holds all indices of the vocabulary.
+    """
+    max_index = vocab_max_index(vocab)
+    if max_index < 2**15:
+        return np.int16
+    else:
+        return np.int32
+
+
+def split_line(line, regime):
+    if regime == 'words':
+        return line.split()
+    elif regime == 'chars':
+        return line
+    else:
+        raise ValueError("unsupported regime {}".format(regime))
+
+
+def tokens_from_file(f, vocab, randomize, regime='words'):
     lines = f.read().split('\n')
 
     if randomize:
         import random
         random.shuffle(lines)
 
+    elements = []
     for line in lines:
-        if regime == 'words':
-            elements = line.split()
-        elif regime == 'chars':
-            elements = line
-        else:
-            raise ValueError("unsupported regime {}".format(regime))
-
-        ids.extend([vocab[e] for e in elements])
+        elements.extend(split_line(line, regime))
 
-    return torch.LongTensor(ids)
+    return encode_words(vocab, elements)
 
 
 def tokens_from_fn(fn, vocab, randomize, regime='words'):
+    if has_magic(fn, CORPUS_MAGIC):
+        if randomize:
+            raise ValueError("Lines of a compiled corpus {} cannot be shuffled".format(fn))
+        return tokens_from_compiled(fn, vocab, regime)
+
     with open(fn, 'r') as f:
         return tokens_from_file(f, vocab, randomize, regime)
+
+
+def compile_corpus(f, vocab, out_f, regime='words', chunk_size=1000000):
+    """ Translates a text corpus into a binary file of token indices.
+
+        The corpus is streamed, so memory usage is bounded by `chunk_size`
+        tokens. The output is meant to be read by `tokens_from_compiled()`.
+
+        Args:
+            f (file): Text corpus, processed line by line.
+            vocab (Vocabulary): Vocabulary for translation word -> index
+            out_f (file): Binary file to write the compiled corpus into.
+    """
+    dtype = token_dtype(vocab)
+    header = {
+        'dtype': np.dtype(dtype).name,
+        'regime': regime,
+        'vocab_size': len(vocab),
+        'vocab_fingerprint': vocab_fingerprint(vocab),
+    }
+    write_binary_header(out_f, CORPUS_MAGIC, header)
+
+    elements = []
+    nb_tokens = 0
+    for line in f:
+        if line.endswith('\n'):
+            line = line[:-1]
+        elements.extend(split_line(line, regime))
+
+        if len(elements) >= chunk_size:
+            out_f.write(encode_words(vocab, elements).numpy().astype(dtype).tobytes())
+            nb_tokens += len(elements)
+            elements = []
+
+    out_f.write(encode_words(vocab, elements).numpy().astype(dtype).tobytes())
+    nb_tokens += len(elements)
+
+    return nb_tokens
+
+
+def tokens_from_compiled(fn, vocab=None, regime=None):
+    """ Maps a compiled corpus into memory, without reading it.
+
+        The returned tensor shares memory with the page cache; it is
+        copy-on-write, so writes to it never reach the file. Indices are kept
+        in the narrow on-disk type, `TemporalSplits` converts the slices it
+        produces to LongTensors.
+
+        Args:
+            vocab (Vocabulary): If given, it has to be the one the corpus was compiled with.
+            regime (str): If given, it has to be the one the corpus was compiled with.
+    """
+    with open(fn, 'rb') as f:
+        header, offset = read_binary_header(f, CORPUS_MAGIC)
+        f.seek(0, 2)
+        data_size = f.tell() - offset
+
+    if vocab is not None and header['vocab_fingerprint'] != vocab_fingerprint(vocab):
+        raise ValueError("Corpus {} was compiled with a different vocabulary".format(fn))
+    if regime is not None and header['regime'] != regime:
+        raise ValueError("Corpus {} was compiled in regime '{}', requested '{}'".format(
+            fn, header['regime'], regime
+        ))
+
+    dtype = np.dtype(header['dtype'])
+    if data_size % dtype.itemsize != 0:
+        raise ValueError("Corpus {} is truncated".format(fn))
+
+    nb_tokens = data_size // dtype.itemsize
+    if nb_tokens == 0:
+        return torch.LongTensor()
+
+    ids = np.memmap(fn, dtype=dtype, mode='c', offset=offset, shape=(nb_tokens,))
+    return torch.from_numpy(ids)
+
+
+def remap_compiled_corpus(fn, vocab, remapping, out_f, chunk_size=1000000):
+    """ Rewrites a compiled corpus into the indices of a `VocabularyRemapping`.
+
+        The new header records `remapping.remap_vocab(vocab)`, so the result
+        is read with the remapped vocabulary.
+
+        Args:
+            fn (str): Compiled corpus.
+            vocab (Vocabulary): Vocabulary the corpus was compiled with.
+            out_f (file): Binary file to write the remapped corpus into.
+    """
+    with open(fn, 'rb') as f:
+        header, _ = read_binary_header(f, CORPUS_MAGIC)
+    tokens = tokens_from_compiled(fn, vocab).numpy()
+    vocab = remapping.remap_vocab(vocab)
+
+    dtype = token_dtype(vocab)
+    header = dict(header, **{
+        'dtype': np.dtype(dtype).name,
+        'vocab_size': len(vocab),
+        'vocab_fingerprint': vocab_fingerprint(vocab),
+    })
+    write_binary_header(out_f, CORPUS_MAGIC, header)
+
+    for start in range(0, len(tokens), chunk_size):
+        new_ids = remapping(tokens[start:start+chunk_size].astype(np.int64))
+        out_f.write(new_ids.astype(dtype).tobytes())
+
+    return len(tokens)
@@ -0,0 +1,133 @@
+import random
+
+import numpy as np
+import torch
+
+from data_pipeline.data import write_binary_header, read_binary_header, has_magic, token_dtype
+from language_models.vocab import encode_words, vocab_fingerprint
+
+
+STORE_MAGIC = b'BRNODOC1'
+
+
+def is_document_store(fn):
+    return has_magic(fn, STORE_MAGIC)
+
+
+def compile_document_store(filenames, vocab, out_f):
+    """ Packs a list of text documents into a single binary file.
+
+        Tokens of all documents are concatenated, followed by an index of
+        document boundaries. Filenames are kept as document keys.
+
+        Args:
+            filenames (list of str): Documents, tokenized the same way as by `TokenizedSplitFFBase`.
+            vocab (Vocabulary): Vocabulary for translation word -> index
+            out_f (file): Binary file to write the store into.
+    """
+    dtype = token_dtype(vocab)
+    header = {
+        'dtype': np.dtype(dtype).name,
+        'vocab_size': len(vocab),
+        'vocab_fingerprint': vocab_fingerprint(vocab),
+        'nb_documents': len(filenames),
+        'keys': list(filenames),
+    }
+    payload_offset = write_binary_header(out_f, STORE_MAGIC, header)
+
+    offsets = [0]
+    for fn in filenames:
+        with open(fn, 'r') as f:
+            ids = encode_words(vocab, f.read().split()).numpy().astype(dtype)
+        out_f.write(ids.tobytes())
+        offsets.append(offsets[-1] + len(ids))
+
+    tokens_size = offsets[-1] * np.dtype(dtype).itemsize
+    out_f.write(b'\0' * ((-(payload_offset + tokens_size)) % 8))  # align the index
+    out_f.write(np.asarray(offsets, dtype=np.int64).tobytes())
+
+
+class DocumentStore():
+    def __init__(self, fn, vocab=None):
+        """ Memory-mapped view of a file produced by `compile_document_store()`.
+
+            Args:
+                fn (str): Path to the store.
+                vocab (Vocabulary): If given, it has to be the one the store was compiled with.
+                    Needed for `words()`.
+        """
+        with open(fn, 'rb') as f:
+            header, payload_offset = read_binary_header(f, STORE_MAGIC)
+            f.seek(0, 2)
+            file_size = f.tell()
+
+        if vocab is not None and header['vocab_fingerprint'] != vocab_fingerprint(vocab):
+            raise ValueError("Document store {} was compiled with a different vocabulary".format(fn))
+
+        nb_documents = header['nb_documents']
+        index_offset = file_size - (nb_documents + 1) * 8
+        self._offsets = np.fromfile(fn, dtype=np.int64, count=nb_documents+1, offset=index_offset)
+
+        nb_tokens = int(self._offsets[-1])
+        if nb_tokens > 0:
+            tokens = np.memmap(fn, dtype=np.dtype(header['dtype']), mode='c',
+                               offset=payload_offset, shape=(nb_tokens,))
+            self._tokens = torch.from_numpy(tokens)
+        else:
+            self._tokens = torch.LongTensor()
+
+        self.keys = header['keys']
+        self._vocab = vocab
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return self._tokens[int(self._offsets[i]):int(self._offsets[i+1])]
+
+    def tokens(self):
+        """ All tokens of all documents, concatenated.
+        """
+        return self._tokens
+
+    def offsets(self):
+        """ Document boundaries in `tokens()`, document i spans [offsets[i], offsets[i+1]).
+        """
+        return self._offsets
+
+    def words(self, i):
+        """ Text of the i-th document, reconstructed through the vocabulary.
+
+            Words outside the vocabulary come back as its unk word.
+        """
+        if self._vocab is None:
+            raise ValueError("DocumentStore has to be constructed with a vocabulary to provide words")
+        return " ".join(self._vocab.i2w(int(t)) for t in self[i])
+
+
+class DocumentStoreSplits():
+    def __init__(self, store, stream_builder):
+        """ Per-document streams over a DocumentStore, built only when accessed.
+
+            Args:
+                store (DocumentStore): Source of documents.
+                stream_builder (callable): Called as stream_builder(tokens, document_index),
+                    e.g. to wrap the tokens into TemporalSplits.
+        """
+        self.store = store
+        self._stream_builder = stream_builder
+        self.order = list(range(len(store)))
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        doc_index = self.order[i]
+        return self._stream_builder(self.store[doc_index], doc_index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def shuffle(self):
+        random.shuffle(self.order)
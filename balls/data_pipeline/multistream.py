@@ -9,17 +9,22 @@ def batchify(data, bsz, cuda):
     # Trim off any extra elements that wouldn't cleanly fit (remainders).
     data = data.narrow(0, 0, nbatch * bsz)
     # Evenly divide the data across the bsz batches.
-    data = data.view(bsz, -1).t().contiguous()
+    # This stays a view, so that memory-mapped corpora are not read in here.
+    data = data.view(bsz, -1).t()
     if cuda:
         data = data.cuda()
     return data
 
 
 class BatchBuilder():
-    def __init__(self, streams, max_batch_size, discard_h=True):
+    def __init__(self, streams, max_batch_size, discard_h=True, start_step=0):
         """ For complex combination of different lenghts sources.
+
+            The first `start_step` batches are only stepped over, without
+            being assembled, e.g. to continue an interrupted epoch.
         """
         self._streams = streams
+        self._start_step = start_step
 
         if max_batch_size <= 0:
             raise ValueError("BatchBuilder must be constructed"
@@ -29,9 +34,10 @@ class BatchBuilder():
         self._discard_h = discard_h
 
     def __iter__(self):
-        streams = [iter(s) for s in self._streams]
+        # streams are only instantiated when they are needed to fill the batch
+        reserve_streams = (iter(s) for s in self._streams)
         active_streams = []
-        reserve_streams = streams
+        step = 0
 
         while True:
             batch = []
@@ -47,12 +53,11 @@ class BatchBuilder():
             active_streams = [active_streams[i] for i in streams_continued]
 
             # refill the batch (of active streams)
-            while len(reserve_streams) > 0:
-                if len(batch) == self._max_bsz:
+            while len(batch) < self._max_bsz:
+                stream = next(reserve_streams, None)
+                if stream is None:
                     break
 
-                stream = reserve_streams[0]
-                del reserve_streams[0]
                 try:
                     batch.append(next(stream))
                     active_streams.append(stream)
@@ -60,7 +65,11 @@ class BatchBuilder():
                     pass
 
             if len(batch) == 0:
-                raise StopIteration
+                return
+
+            step += 1
+            if step <= self._start_step:
+                continue
 
             if self._discard_h:
                 hs_passed_on = streams_continued
@@ -70,3 +79,105 @@ class BatchBuilder():
             parts = zip(*batch)
             parts = [torch.stack(part) for part in parts]
             yield tuple(parts) + (torch.LongTensor(hs_passed_on), )
+
+
+def nb_temporal_splits(doc_len, nb_inputs_necessary, nb_targets_parallel):
+    """ Number of items TemporalSplits produces over a sequence of given length.
+    """
+    nb_targets = max(doc_len - nb_inputs_necessary - nb_targets_parallel + 1, 0)
+    return (nb_targets + nb_targets_parallel - 1) // nb_targets_parallel
+
+
+class PlannedBatchBuilder():
+    def __init__(self, tokens, offsets, nb_inputs_necessary, nb_targets_parallel,
+                 max_batch_size, discard_h=True, order=None, start_step=0):
+        """ Produces the same batches as BatchBuilder over TemporalSplits of documents.
+
+            Documents are given as spans of a single flat token tensor, e.g.
+            of a DocumentStore. Which documents and offsets occupy the slots
+            of each batch is computed upfront, every batch is then a single
+            gather from the token tensor.
+
+            Args:
+                tokens (Tensor): Tokens of all documents, concatenated.
+                offsets (sequence of int): Document i spans tokens[offsets[i]:offsets[i+1]].
+                order (list of int): Order in which documents enter the batches,
+                    defaults to the order of `offsets`.
+                start_step (int): Number of initial batches to leave out.
+        """
+        if max_batch_size <= 0:
+            raise ValueError("PlannedBatchBuilder must be constructed"
+                "with a positive batch size, (got {})".format(max_batch_size)
+            )
+
+        self._tokens = tokens
+        self._window = torch.arange(0, nb_inputs_necessary + nb_targets_parallel).long()
+        self._nb_inputs_necessary = nb_inputs_necessary
+        self._nb_targets_parallel = nb_targets_parallel
+        self._max_bsz = max_batch_size
+        self._discard_h = discard_h
+        self._start_step = start_step
+
+        if order is None:
+            order = range(len(offsets) - 1)
+        self._make_plan([int(offsets[i]) for i in order],
+                        [int(offsets[i+1] - offsets[i]) for i in order])
+
+    def _make_plan(self, starts, lengths):
+        reserve = (
+            (start, nb_temporal_splits(length, self._nb_inputs_necessary, self._nb_targets_parallel))
+            for start, length in zip(starts, lengths)
+        )
+
+        self._starts = []
+        self._masks = []
+        step_boundaries = [0]
+        active = []  # [position of the next window, number of remaining windows]
+        while True:
+            still_active = []
+            streams_continued = []
+            streams_ended = []
+            for i, (position, nb_remaining) in enumerate(active):
+                if nb_remaining > 0:
+                    self._starts.append(position)
+                    still_active.append((position + self._nb_targets_parallel, nb_remaining - 1))
+                    streams_continued.append(i)
+                else:
+                    streams_ended.append(i)
+
+            while len(still_active) < self._max_bsz:
+                position, nb_splits = next(reserve, (None, None))
+                if position is None:
+                    break
+                if nb_splits > 0:
+                    self._starts.append(position)
+                    still_active.append((position + self._nb_targets_parallel, nb_splits - 1))
+
+            if len(still_active) == 0:
+                break
+
+            if self._discard_h:
+                hs_passed_on = streams_continued
+            else:
+                hs_passed_on = (streams_continued + streams_ended)[:len(still_active)]
+
+            self._masks.append(torch.LongTensor(hs_passed_on))
+            step_boundaries.append(len(self._starts))
+            active = still_active
+
+        self._starts = torch.LongTensor(self._starts)
+        self._step_boundaries = step_boundaries
+
+    def __len__(self):
+        return len(self._masks)
+
+    def __iter__(self):
+        window_len = len(self._window)
+        for step in range(self._start_step, len(self)):
+            starts = self._starts[self._step_boundaries[step]:self._step_boundaries[step+1]]
+            positions = (starts.view(-1, 1) + self._window.view(1, -1)).view(-1)
+            windows = self._tokens.index_select(0, positions).view(-1, window_len).long()
+
+            X = windows[:, :-1].contiguous()
+            T = windows[:, self._nb_inputs_necessary:].contiguous()
+            yield X, T, self._masks[step]
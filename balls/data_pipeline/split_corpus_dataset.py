@@ -1,6 +1,5 @@
-import torch
-
 from data_pipeline.temporal_splitting import TemporalSplits
+from language_models.vocab import encode_words
 
 
 class TokenizedSplitFFBase():
@@ -12,7 +11,7 @@ class TokenizedSplitFFBase():
         """
         sentence = f.read()
         self._words = sentence.split()
-        self._tokens = torch.LongTensor([vocab[w] for w in self._words])
+        self._tokens = encode_words(vocab, self._words)
 
         self._temp_splits = temporal_split_builder(self._tokens)
 
@@ -68,7 +67,7 @@ class DomainAdaptationSplitFFBase:
 
         nb_domain_words = int(len(words)*end_portion-0.01)
 
-        self._tokens = torch.LongTensor([vocab[w] for w in words[:-nb_domain_words]])
+        self._tokens = encode_words(vocab, words[:-nb_domain_words])
         self._domain_string = " ".join(words[len(words)-nb_domain_words:])
 
         self._temp_splitter = ts_builder(self._tokens)
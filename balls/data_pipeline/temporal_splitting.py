@@ -6,9 +6,10 @@ class TemporalSplits():
 
     def __iter__(self):
         for lend, rend in self.ranges():
+            # compiled corpora store narrower types, models need LongTensors
             yield (
-                self._seq[lend:rend],
-                self._seq[lend+self._nb_inputs_necessary:rend+1]
+                self._seq[lend:rend].long(),
+                self._seq[lend+self._nb_inputs_necessary:rend+1].long()
             )
 
     def __len__(self):
@@ -19,3 +20,15 @@ class TemporalSplits():
             lend = i
             rend = i + self._nb_inputs_necessary + self._nb_target_parallel - 1
             yield lend, rend
+
+
+def temporal_splits_from(seq, nb_batches_done, nb_inputs_necessary, nb_targets_parallel):
+    """ TemporalSplits of `seq` continuing after its first `nb_batches_done` batches.
+
+        Batches are consecutive windows, so skipping is just cutting the beginning.
+    """
+    return TemporalSplits(
+        seq[nb_batches_done*nb_targets_parallel:],
+        nb_inputs_necessary=nb_inputs_necessary,
+        nb_targets_parallel=nb_targets_parallel
+    )
@@ -35,8 +35,7 @@ if __name__ == '__main__':
             texts.append(f.read())
 
     print("computing iVectors...")
-    ivecs = [ivec_extractor(t) for t in texts]
-    ivecs = torch.stack(ivecs)
+    ivecs = ivec_extractor.extract_batch(texts)
 
     print("Elements mean:\t", ivecs.mean())
     print("Elements var:\t", ivecs.var())
@@ -0,0 +1,448 @@
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from language_models.quantization import QuantizedLinear
+
+
+VOCAB_BLOCK_SIZE = 8192
+
+
+def unigram_counts(tokens, ntoken):
+    """ Number of occurrences of each word index in `tokens`, as a np.ndarray of length `ntoken`.
+    """
+    tokens = np.asarray(tokens.numpy() if torch.is_tensor(tokens) else tokens, dtype=np.int64)
+    return np.bincount(tokens, minlength=ntoken)
+
+
+def uniform_classes(ntoken, nb_classes):
+    """ Assigns consecutive word indices to classes of (nearly) equal size.
+    """
+    return np.arange(ntoken, dtype=np.int64) * nb_classes // ntoken
+
+
+def frequency_classes(counts, nb_classes):
+    """ Frequency binning: each class takes roughly 1/nb_classes of the total word mass.
+
+        Words are taken from the most frequent one, so frequent words end up
+        in small classes and the rare ones share the large last classes.
+        No class is left empty as long as there are enough words.
+
+        Args:
+            counts (np.ndarray): Number of occurrences of each word.
+            nb_classes (int): Number of classes to produce.
+
+        Returns:
+            np.ndarray: Class of each word.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    if nb_classes > len(counts):
+        raise ValueError("Cannot bin {} words into {} classes".format(len(counts), nb_classes))
+
+    total = counts.sum()
+    order = np.argsort(-counts, kind='mergesort')
+
+    classes = np.empty(len(counts), dtype=np.int64)
+    current = 0
+    mass = 0.0
+    for i, w in enumerate(order):
+        if i > 0 and current < nb_classes - 1:
+            class_full = mass >= total * (current + 1) / nb_classes
+            words_needed = len(order) - i <= nb_classes - 1 - current
+            if class_full or words_needed:
+                current += 1
+        classes[w] = current
+        mass += counts[w]
+
+    return classes
+
+
+def bin_classes_by_frequency(decoder, tokens, ntoken):
+    """ Assigns words to the classes of `decoder` by `frequency_classes()` of their counts in `tokens`.
+
+        Args:
+            ntoken (int): Number of words of the model, see `model_ntoken()`.
+    """
+    if not hasattr(decoder, 'set_classes'):
+        raise ValueError("Frequency binning needs a class decoder, got {}".format(decoder.__class__.__name__))
+
+    decoder.set_classes(frequency_classes(unigram_counts(tokens, ntoken), decoder.nb_classes))
+
+
+class ClassSoftmaxDecoder(nn.Module):
+    def __init__(self, in_size, ntoken, nb_classes):
+        """ Two-level softmax, log p(w|h) = log p(c(w)|h) + log p(w|c(w),h).
+
+            Words are assigned to classes by `set_classes()`, initially
+            consecutive indices form a class. The assignment is held in
+            buffers, so it is stored along with the parameters.
+
+            Calling the decoder produces the full distribution over words,
+            `target_log_probs()` only evaluates the classes of the targets.
+        """
+        super().__init__()
+        if nb_classes <= 0 or nb_classes > ntoken:
+            raise ValueError("Number of classes has to be in [1, {}], got {}".format(ntoken, nb_classes))
+
+        self.class_proj = nn.Linear(in_size, nb_classes)
+        self.word_proj = nn.Linear(in_size, ntoken)
+
+        self.ntoken = ntoken
+        self.nb_classes = nb_classes
+
+        self.register_buffer('word2class', torch.LongTensor(ntoken))
+        self.register_buffer('order', torch.LongTensor(ntoken))
+        self.register_buffer('class_starts', torch.LongTensor(nb_classes + 1))
+        self.register_buffer('in_class_index', torch.LongTensor(ntoken))
+        self.set_classes(uniform_classes(ntoken, nb_classes))
+
+    def init_weights(self, initrange):
+        for proj in [self.class_proj, self.word_proj]:
+            proj.bias.data.fill_(0)
+            proj.weight.data.uniform_(-initrange, initrange)
+
+    def set_classes(self, word_classes):
+        """ Sets the class of each word, e.g. from `frequency_classes()`.
+        """
+        word_classes = np.asarray(word_classes, dtype=np.int64)
+        if word_classes.shape != (self.ntoken,):
+            raise ValueError("Expected classes of {} words, got shape {}".format(self.ntoken, word_classes.shape))
+        if word_classes.min() < 0 or word_classes.max() >= self.nb_classes:
+            raise ValueError("Classes have to be in [0, {})".format(self.nb_classes))
+
+        order = np.argsort(word_classes, kind='mergesort')
+        class_starts = np.zeros(self.nb_classes + 1, dtype=np.int64)
+        class_starts[1:] = np.cumsum(np.bincount(word_classes, minlength=self.nb_classes))
+        in_class_index = np.empty(self.ntoken, dtype=np.int64)
+        in_class_index[order] = np.arange(self.ntoken) - class_starts[word_classes[order]]
+
+        for name, values in [
+            ('word2class', word_classes), ('order', order),
+            ('class_starts', class_starts), ('in_class_index', in_class_index),
+        ]:
+            getattr(self, name).copy_(torch.from_numpy(values))
+
+    def _class_members(self):
+        starts = self.class_starts.cpu().numpy()
+        for c in range(self.nb_classes):
+            if starts[c] < starts[c+1]:
+                yield c, self.order[starts[c]:starts[c+1]]
+
+    def _class_logits(self, x, members):
+        weight = self.word_proj.weight.index_select(0, members)
+        bias = self.word_proj.bias.index_select(0, members)
+        return F.linear(x, weight, bias)
+
+    def forward(self, x):
+        """ Log-probabilities of all words, [..., in_size] -> [..., ntoken].
+        """
+        lead_shape = x.size()[:-1]
+        x = x.contiguous().view(-1, x.size(-1))
+        class_log_probs = F.log_softmax(self.class_proj(x), dim=-1)
+
+        parts = []
+        for c, members in self._class_members():
+            in_class = F.log_softmax(self._class_logits(x, members), dim=-1)
+            parts.append(in_class + class_log_probs[:, c:c+1])
+
+        # parts follow self.order, move each word back to its index
+        positions = self.class_starts.index_select(0, self.word2class) + self.in_class_index
+        log_probs = torch.cat(parts, dim=1).index_select(1, positions)
+        return log_probs.view(*(tuple(lead_shape) + (self.ntoken,)))
+
+    def target_log_probs(self, x, targets):
+        """ Log-probabilities of `targets` only, evaluating just their classes.
+
+            Args:
+                x: [N, in_size] inputs of the decoder.
+                targets: [N] word indices.
+
+            Returns:
+                [N] log p(target|x).
+        """
+        targets_data = targets.data if hasattr(targets, 'data') else targets
+        classes = self.word2class.index_select(0, targets_data)
+        class_log_probs = F.log_softmax(self.class_proj(x), dim=-1)
+        class_part = class_log_probs.gather(1, _like(targets, classes.unsqueeze(1))).squeeze(1)
+
+        sorted_classes, permutation = classes.sort()
+        sorted_classes = sorted_classes.cpu().numpy()
+        starts = self.class_starts.cpu().numpy()
+        boundaries = np.flatnonzero(np.diff(sorted_classes)) + 1
+        boundaries = [0] + boundaries.tolist() + [len(sorted_classes)]
+
+        parts = []
+        for begin, end in zip(boundaries[:-1], boundaries[1:]):
+            c = sorted_classes[begin]
+            rows = permutation[begin:end]
+            members = self.order[starts[c]:starts[c+1]]
+            logits = self._class_logits(x.index_select(0, _like(targets, rows)), members)
+            within = self.in_class_index.index_select(0, targets_data.index_select(0, rows))
+            parts.append(F.log_softmax(logits, dim=-1).gather(1, _like(targets, within.unsqueeze(1))).squeeze(1))
+
+        inverse = permutation.sort()[1]
+        word_part = torch.cat(parts).index_select(0, _like(targets, inverse))
+        return class_part + word_part
+
+
+class AdaptiveSoftmaxDecoder(nn.Module):
+    def __init__(self, in_size, ntoken, cutoffs, div_value=4.0):
+        """ Adaptive softmax: frequent words in a head, rare ones in tail clusters of reduced dimension.
+
+            Word indices are expected to be sorted by decreasing frequency.
+            The head scores words below cutoffs[0] and one entry per
+            cluster; cluster i holds words [cutoffs[i], cutoffs[i+1]), the
+            last one up to `ntoken`. Cluster i projects the input to
+            in_size / div_value**(i+1) dimensions first.
+        """
+        super().__init__()
+        cutoffs = list(cutoffs)
+        if len(cutoffs) == 0 or cutoffs != sorted(set(cutoffs)) or cutoffs[0] <= 0 or cutoffs[-1] >= ntoken:
+            raise ValueError("Cutoffs have to be increasing values in (0, {}), got {}".format(ntoken, cutoffs))
+
+        self.ntoken = ntoken
+        self.cutoffs = cutoffs
+        self.head = nn.Linear(in_size, cutoffs[0] + len(cutoffs))
+
+        bounds = cutoffs + [ntoken]
+        self.tails = nn.ModuleList()
+        for i in range(len(cutoffs)):
+            proj_size = max(1, int(in_size // (div_value ** (i + 1))))
+            self.tails.append(nn.Sequential(
+                nn.Linear(in_size, proj_size, bias=False),
+                nn.Linear(proj_size, bounds[i+1] - bounds[i]),
+            ))
+
+    def init_weights(self, initrange):
+        self.head.bias.data.fill_(0)
+        self.head.weight.data.uniform_(-initrange, initrange)
+        for tail in self.tails:
+            tail[0].weight.data.uniform_(-initrange, initrange)
+            tail[1].bias.data.fill_(0)
+            tail[1].weight.data.uniform_(-initrange, initrange)
+
+    def _clusters(self):
+        bounds = self.cutoffs + [self.ntoken]
+        for i, tail in enumerate(self.tails):
+            yield self.cutoffs[0] + i, bounds[i], bounds[i+1], tail
+
+    def forward(self, x):
+        """ Log-probabilities of all words, [..., in_size] -> [..., ntoken].
+        """
+        lead_shape = x.size()[:-1]
+        x = x.contiguous().view(-1, x.size(-1))
+        head_log_probs = F.log_softmax(self.head(x), dim=-1)
+
+        parts = [head_log_probs[:, :self.cutoffs[0]]]
+        for head_index, _, _, tail in self._clusters():
+            parts.append(F.log_softmax(tail(x), dim=-1) + head_log_probs[:, head_index:head_index+1])
+
+        log_probs = torch.cat(parts, dim=1)
+        return log_probs.view(*(tuple(lead_shape) + (self.ntoken,)))
+
+    def target_log_probs(self, x, targets):
+        """ Log-probabilities of `targets`, running each tail only for the targets in its cluster.
+
+            Args:
+                x: [N, in_size] inputs of the decoder.
+                targets: [N] word indices.
+
+            Returns:
+                [N] log p(target|x).
+        """
+        targets_data = targets.data if hasattr(targets, 'data') else targets
+        head_targets = targets_data.clone()
+        head_log_probs = F.log_softmax(self.head(x), dim=-1)
+
+        tail_parts = []
+        for head_index, begin, end, tail in self._clusters():
+            in_cluster = (targets_data >= begin) & (targets_data < end)
+            if int(in_cluster.long().sum()) == 0:
+                continue
+            rows = in_cluster.nonzero().view(-1)
+            head_targets.masked_fill_(in_cluster, head_index)
+
+            tail_log_probs = F.log_softmax(tail(x.index_select(0, _like(targets, rows))), dim=-1)
+            within = targets_data.index_select(0, rows) - begin
+            tail_parts.append((rows, tail_log_probs.gather(1, _like(targets, within.unsqueeze(1))).squeeze(1)))
+
+        log_probs = head_log_probs.gather(1, _like(targets, head_targets.unsqueeze(1))).squeeze(1)
+        for rows, part in tail_parts:
+            log_probs = log_probs.index_add(0, _like(targets, rows), part)
+
+        return log_probs
+
+
+def _like(reference, tensor):
+    """ Wraps `tensor` into a Variable if `reference` is one (PyTorch 0.3).
+    """
+    if torch.is_tensor(reference) or not hasattr(reference, 'data'):
+        return tensor
+    return torch.autograd.Variable(tensor)
+
+
+def build_decoder(spec, in_size, ntoken):
+    """ Output layer described by `spec`.
+
+        Args:
+            spec (str): 'full' for a Linear layer to be followed by LogSoftmax,
+                'class:N' for a `ClassSoftmaxDecoder` with N classes,
+                'adaptive:C1,C2,...[:D]' for an `AdaptiveSoftmaxDecoder`
+                with cutoffs C1, C2, ... and optionally div_value D.
+    """
+    if spec == 'full':
+        return nn.Linear(in_size, ntoken)
+
+    kind, _, arg = spec.partition(':')
+    if kind == 'class':
+        try:
+            nb_classes = int(arg)
+        except ValueError:
+            raise ValueError("Class decoder needs a number of classes, got '{}'".format(spec))
+        return ClassSoftmaxDecoder(in_size, ntoken, nb_classes)
+    elif kind == 'adaptive':
+        cutoffs, _, div_value = arg.partition(':')
+        try:
+            cutoffs = [int(c) for c in cutoffs.split(',')]
+            div_value = float(div_value) if div_value else 4.0
+        except ValueError:
+            raise ValueError("Adaptive decoder needs comma-separated cutoffs, got '{}'".format(spec))
+        return AdaptiveSoftmaxDecoder(in_size, ntoken, cutoffs, div_value)
+
+    raise ValueError("Unknown decoder '{}'".format(spec))
+
+
+def init_decoder_weights(decoder, initrange):
+    if isinstance(decoder, nn.Linear):
+        decoder.bias.data.fill_(0)
+        decoder.weight.data.uniform_(-initrange, initrange)
+    else:
+        decoder.init_weights(initrange)
+
+
+def tie_decoder_weights(decoder, encoder):
+    """ Shares the word embeddings of `encoder` with the output word vectors of `decoder`.
+    """
+    if isinstance(decoder, nn.Linear):
+        decoder.weight = encoder.weight
+    elif isinstance(decoder, ClassSoftmaxDecoder):
+        decoder.word_proj.weight = encoder.weight
+    else:
+        raise ValueError("Weights of a {} cannot be tied to the embeddings".format(decoder.__class__.__name__))
+
+
+def decode(decoder, x):
+    """ Log-probabilities of all words.
+    """
+    if isinstance(decoder, (nn.Linear, QuantizedLinear)):
+        return F.log_softmax(decoder(x), dim=-1)
+    return decoder(x)
+
+
+def is_factorized(decoder):
+    """ Whether `decoder` can evaluate targets without the full distribution.
+    """
+    return hasattr(decoder, 'target_log_probs')
+
+
+def model_ntoken(model):
+    """ Number of words `model` gives probabilities of, which may exceed the size of a sparse vocabulary.
+    """
+    if is_factorized(model.decoder):
+        return model.decoder.ntoken
+    return model.decoder.out_features
+
+
+def output_rows(model, indices):
+    """ Weights and biases producing the logits of words `indices` from `model.features()`.
+
+        Models whose logits come from more than their `decoder` provide
+        their own `output_rows()`.
+    """
+    if hasattr(model, 'output_rows'):
+        return model.output_rows(indices)
+
+    if isinstance(model.decoder, QuantizedLinear):
+        return model.decoder.rows(indices)
+    if not isinstance(model.decoder, nn.Linear):
+        raise ValueError("Output rows need a full decoder, got {}".format(model.decoder.__class__.__name__))
+    return model.decoder.weight.index_select(0, indices), model.decoder.bias.index_select(0, indices)
+
+
+def output_block(model, start, end):
+    """ Weights and biases producing the logits of words [start, end) from `model.features()`.
+    """
+    if hasattr(model, 'output_rows'):
+        indices = torch.arange(start, end).long()
+        if model.decoder.weight.is_cuda:
+            indices = indices.cuda()
+        return model.output_rows(_like(model.decoder.weight, indices))
+
+    if isinstance(model.decoder, QuantizedLinear):
+        return model.decoder.block(start, end)
+    return model.decoder.weight[start:end], model.decoder.bias[start:end]
+
+
+def _logsumexp(logits):
+    if hasattr(torch, 'logsumexp'):  # fused from PyTorch 0.4 on
+        return torch.logsumexp(logits, 1)
+
+    logits_max = logits.max(1, keepdim=True)[0]
+    return logits_max.squeeze(1) + (logits - logits_max).exp().sum(1).log()
+
+
+def _block_logits(model, features, start, end):
+    if isinstance(model.decoder, QuantizedLinear) and not hasattr(model, 'output_rows'):
+        return model.decoder.block_logits(features, start, end)
+
+    weight, bias = output_block(model, start, end)
+    return features.matmul(weight.t()) + bias
+
+
+def blocked_logsumexp(model, features, block_size=VOCAB_BLOCK_SIZE):
+    """ Log-normalizer of the logits of all words, computed `block_size` words at a time.
+
+        Only [N, block_size] logits exist at once, regardless of the vocabulary size.
+
+        Args:
+            features: [N, F] outputs of `model.features()`.
+
+        Returns:
+            [N] log of the sum of exponentiated logits.
+    """
+    ntoken = model.decoder.out_features
+    lse = None
+    for start in range(0, ntoken, block_size):
+        logits = _block_logits(model, features, start, min(start + block_size, ntoken))
+        block_lse = _logsumexp(logits)
+
+        if lse is None:
+            lse = block_lse
+        else:
+            shift = torch.max(lse, block_lse)
+            lse = shift + ((lse - shift).exp() + (block_lse - shift).exp()).log()
+
+    return lse
+
+
+def target_log_probs(model, features, targets, block_size=VOCAB_BLOCK_SIZE):
+    """ Log-probabilities of `targets` without materializing the distribution over all words.
+
+        A full decoder gives the logit of the target as a dot product, from
+        which the `blocked_logsumexp()` is subtracted. Factorized decoders
+        evaluate their targets themselves.
+
+        Args:
+            features: [N, F] outputs of `model.features()`.
+            targets: [N] word indices.
+
+        Returns:
+            [N] log p(target).
+    """
+    if is_factorized(model.decoder):
+        return model.decoder.target_log_probs(features, targets)
+
+    weight, bias = output_rows(model, targets)
+    target_logits = (features * weight).sum(1) + bias
+    return target_logits - blocked_logsumexp(model, features, block_size)
@@ -3,16 +3,20 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
 
+from language_models.decoders import build_decoder, decode, init_decoder_weights
+from language_models.language_model import registered_model
 
+
+@registered_model
 class BengioModel(nn.Module):
     """Container module with an encoder, a recurrent module, and a decoder."""
 
-    def __init__(self, ntoken, emb_size, in_len, nb_hidden, dropout=0.5):
+    def __init__(self, ntoken, emb_size, in_len, nb_hidden, dropout=0.5, decoder='full'):
         super().__init__()
         self.drop = nn.Dropout(dropout)
         self.encoder = nn.Embedding(ntoken, emb_size)
         self.emb2h = nn.ModuleList([nn.Linear(emb_size, nb_hidden) for _ in range(in_len)])
-        self.decoder = nn.Linear(nb_hidden, ntoken)
+        self.decoder = build_decoder(decoder, nb_hidden, ntoken)
 
         self.init_weights()
 
@@ -27,16 +31,20 @@ class BengioModel(nn.Module):
         self.encoder.weight.data.uniform_(-initrange, initrange)
         for e2h in self.emb2h:
             e2h.weight.data.uniform_(-initrange, initrange)
-        self.decoder.bias.data.fill_(0)
-        self.decoder.weight.data.uniform_(-initrange, initrange)
+        init_decoder_weights(self.decoder, initrange)
 
-    def forward(self, input, hidden):
+    def features(self, input, hidden):
+        """ Inputs of the decoder, [B, T, nb_hidden], and the unchanged hidden state.
+        """
         emb = self.drop(self.encoder(input))
         projections = [proj(emb[:, i:emb.size(1)-(self.in_len-i)+1]) for i, proj in enumerate(self.emb2h)]
         projections = torch.stack(projections, dim=-1)
         output = F.tanh(torch.sum(projections, dim=-1))
-        output = self.drop(output)
-        decoded = nn.LogSoftmax(dim=-1)(self.decoder(output))
+        return self.drop(output), hidden
+
+    def forward(self, input, hidden):
+        output, hidden = self.features(input, hidden)
+        decoded = decode(self.decoder, output)
         return decoded, hidden
 
     def init_hidden(self, bsz):
@@ -45,16 +53,17 @@ class BengioModel(nn.Module):
         return (Variable(weight.new(1, bsz, self.nb_hidden).zero_()))
 
 
+@registered_model
 class BengioModelIvecInput(nn.Module):
     """Container module with an encoder, a recurrent module, and a decoder."""
 
-    def __init__(self, ntoken, emb_size, in_len, nb_hidden, dropout, ivec_dim):
+    def __init__(self, ntoken, emb_size, in_len, nb_hidden, dropout, ivec_dim, decoder='full'):
         super().__init__()
         self.drop = nn.Dropout(dropout)
         self.encoder = nn.Embedding(ntoken, emb_size)
         self.emb2h = nn.ModuleList([nn.Linear(emb_size, nb_hidden) for _ in range(in_len)])
         self.ivec2h = nn.Linear(ivec_dim, nb_hidden)
-        self.decoder = nn.Linear(nb_hidden, ntoken)
+        self.decoder = build_decoder(decoder, nb_hidden, ntoken)
 
         self.init_weights()
 
@@ -69,10 +78,11 @@ class BengioModelIvecInput(nn.Module):
         self.encoder.weight.data.uniform_(-initrange, initrange)
         for e2h in self.emb2h:
             e2h.weight.data.uniform_(-initrange, initrange)
-        self.decoder.bias.data.fill_(0)
-        self.decoder.weight.data.uniform_(-initrange, initrange)
+        init_decoder_weights(self.decoder, initrange)
 
-    def forward(self, input, hidden, ivec):
+    def features(self, input, hidden, ivec):
+        """ Inputs of the decoder, [B, T, nb_hidden], and the unchanged hidden state.
+        """
         if len(ivec.size()) == 1:
             ivec = ivec.unsqueeze(0)
         emb = self.drop(self.encoder(input))
@@ -81,8 +91,11 @@ class BengioModelIvecInput(nn.Module):
         projected_ivec = self.ivec2h(ivec).unsqueeze(dim=-2).expand(-1, nb_timesteps, -1)
         projections = torch.stack(projections + [projected_ivec], dim=-1)
         output = F.tanh(torch.sum(projections, dim=-1))
-        output = self.drop(output)
-        decoded = nn.LogSoftmax(dim=-1)(self.decoder(output))
+        return self.drop(output), hidden
+
+    def forward(self, input, hidden, ivec):
+        output, hidden = self.features(input, hidden, ivec)
+        decoded = decode(self.decoder, output)
         return decoded, hidden
 
     def init_hidden(self, bsz):
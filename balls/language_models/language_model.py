@@ -1,8 +1,130 @@
+import contextlib
+import functools
+import inspect
 import io
+import os
 import pickle
 import tempfile
+
+import numpy as np
 import torch
 
+from data_pipeline.data import write_binary_header, read_binary_header
+from language_models.quantization import is_quantized, quantize_model
+from language_models.vocab import CompactVocabulary, load_compact_vocabulary
+
+
+CHECKPOINT_MAGIC = b'BRNOLM01'
+CHECKPOINT_VERSION = 2  # 2 adds quantized models
+TENSOR_ALIGNMENT = 64
+
+MODEL_CLASSES = {}
+
+
+def registered_model(cls):
+    """ Class decorator making a model loadable from a checkpoint by its name.
+
+        Arguments of the construction are recorded in `init_kwargs`, so
+        that the checkpoint can rebuild the model without pickling it.
+    """
+    signature = inspect.signature(cls.__init__)
+    original_init = cls.__init__
+
+    @functools.wraps(original_init)
+    def __init__(self, *args, **kwargs):
+        original_init(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        self.init_kwargs = dict(list(bound.arguments.items())[1:])
+
+    cls.__init__ = __init__
+    MODEL_CLASSES[cls.__name__] = cls
+    return cls
+
+
+def _align(offset):
+    return offset + (-offset) % TENSOR_ALIGNMENT
+
+
+def checkpoint_tensors(model):
+    """ (name, tensor) pairs to be stored for `model`, tied tensors only once.
+    """
+    tensors = []
+    seen = set()
+    for name, tensor in model.state_dict().items():
+        # the same memory viewed the same way, views into a tensor are different tensors
+        key = (tensor.data_ptr(), tensor.type(), tuple(tensor.size()), tuple(tensor.stride()))
+        if tensor.numel() > 0 and key in seen:  # tied weights are restored by the constructor
+            continue
+        seen.add(key)
+        tensors.append((name, tensor))
+
+    return tensors
+
+
+def checkpoint_description(model):
+    """ Arguments of `write_checkpoint()` describing `model`, apart from its tensors and vocabulary.
+    """
+    return {
+        'model_class': model.__class__.__name__,
+        'model_kwargs': dict(model.init_kwargs),
+        'quantization': 'int8' if is_quantized(model) else None,
+    }
+
+
+def checkpoint_vocab_bytes(vocab):
+    if not isinstance(vocab, CompactVocabulary):
+        vocab = CompactVocabulary.from_mapping(vocab)
+    vocab_bytes = io.BytesIO()
+    vocab.save(vocab_bytes)
+    return vocab_bytes.getvalue()
+
+
+def write_checkpoint(f, model_class, model_kwargs, vocab_bytes, tensors, quantization=None):
+    """ Writes the checkpoint container.
+
+        Args:
+            model_class (str): Name of a `registered_model` class.
+            model_kwargs (dict): Arguments to construct the model with.
+            vocab_bytes (bytes): Vocabulary, as produced by `checkpoint_vocab_bytes()`.
+            tensors (list): (name, np.ndarray) pairs, as named in the state_dict.
+            quantization (str): 'int8' for a model converted by `quantize_model()`.
+    """
+    # The header size affects all offsets, hence a first pass with placeholder offsets
+    header = {
+        # float models stay readable by older versions
+        'version': CHECKPOINT_VERSION if quantization else 1,
+        'model_class': model_class,
+        'model_kwargs': model_kwargs,
+        'quantization': quantization,
+        'vocab_offset': 0,
+        'tensors': [[name, array.dtype.str, list(array.shape), 0] for name, array in tensors],
+    }
+    payload_offset = write_binary_header(io.BytesIO(), CHECKPOINT_MAGIC, header)
+    while True:
+        position = _align(payload_offset)
+        header['vocab_offset'] = position
+        position = _align(position + len(vocab_bytes))
+        for entry, (name, array) in zip(header['tensors'], tensors):
+            entry[3] = position
+            position = _align(position + array.nbytes)
+
+        new_payload_offset = write_binary_header(io.BytesIO(), CHECKPOINT_MAGIC, header)
+        if new_payload_offset == payload_offset:
+            break
+        payload_offset = new_payload_offset
+
+    start = f.tell()
+    write_binary_header(f, CHECKPOINT_MAGIC, header)
+
+    def pad_to(offset):
+        f.write(b'\0' * (start + offset - f.tell()))
+
+    pad_to(header['vocab_offset'])
+    f.write(vocab_bytes)
+    for entry, (name, array) in zip(header['tensors'], tensors):
+        pad_to(entry[3])
+        f.write(np.ascontiguousarray(array).tobytes())
 
 
 class LanguageModel():
@@ -11,6 +133,36 @@ class LanguageModel():
         self.vocab = vocab
 
     def save(self, f):
+        """ Writes the model in the checkpoint format, see `load()`.
+
+            Models not constructed through a `registered_model` class, or
+            with a vocabulary lacking the unk word, are pickled as before.
+        """
+        if not self.checkpointable():
+            self._save_pickled(f)
+            return
+
+        tensors = [(name, t.cpu().contiguous().numpy()) for name, t in checkpoint_tensors(self.model)]
+        write_checkpoint(
+            f, vocab_bytes=checkpoint_vocab_bytes(self.vocab), tensors=tensors,
+            **checkpoint_description(self.model)
+        )
+
+    def quantize(self):
+        """ Converts the model to int8 weights for inference, in place.
+
+            See `language_models.quantization.quantize_model()`.
+        """
+        quantize_model(self.model)
+
+    def checkpointable(self):
+        return (
+            self.model.__class__.__name__ in MODEL_CLASSES and
+            hasattr(self.model, 'init_kwargs') and
+            hasattr(self.vocab, 'unk_word_')
+        )
+
+    def _save_pickled(self, f):
         tmp_f = tempfile.TemporaryFile()
         was_on_cuda = next(self.model.parameters()).is_cuda
         self.model.cpu()
@@ -27,7 +179,106 @@ class LanguageModel():
         pickle.dump(complete_lm, f)
 
 
-def load(f):
+def _set_tensor(model, name, tensor):
+    *path, attr = name.split('.')
+    module = model
+    for part in path:
+        module = getattr(module, part)
+
+    if attr in module._parameters:
+        current = module._parameters[attr]
+    elif attr in module._buffers:
+        current = module._buffers[attr]
+    else:
+        raise ValueError("Checkpoint tensor {} is not part of the model".format(name))
+
+    if current.size() != tensor.size():
+        raise ValueError("Checkpoint tensor {} has shape {}, model expects {}".format(
+            name, tuple(tensor.size()), tuple(current.size())
+        ))
+
+    # tensors are shared by tying in the constructor, see `quantize_model()`
+    if attr in module._parameters:
+        parameter = torch.nn.Parameter(tensor, requires_grad=current.requires_grad)
+        for other in model.modules():
+            for key, other_param in list(other._parameters.items()):
+                if other_param is current:
+                    setattr(other, key, parameter)  # through setattr, so that e.g. nn.LSTM sees it
+    else:
+        for other in model.modules():
+            for key, buffer in other._buffers.items():
+                if buffer is current:
+                    other._buffers[key] = tensor
+
+
+def _model_skeleton(model_class, model_kwargs, quantization):
+    """ Model to be filled with the tensors of a checkpoint.
+
+        Where PyTorch supports it, the model is built on the meta device, so
+        no memory is allocated or initialized for weights which the checkpoint
+        replaces anyway.
+    """
+    device = torch.device('meta') if hasattr(torch.device, '__enter__') else contextlib.nullcontext()
+    with device:
+        model = model_class(**model_kwargs)
+        if quantization == 'int8':
+            quantize_model(model)
+
+    return model
+
+
+def _read_checkpoint_header(fn, offset):
+    with open(fn, 'rb') as f:
+        f.seek(offset)
+        header, _ = read_binary_header(f, CHECKPOINT_MAGIC)
+
+    if header['version'] > CHECKPOINT_VERSION:
+        raise ValueError("Checkpoint {} has version {}, newest supported is {}".format(
+            fn, header['version'], CHECKPOINT_VERSION
+        ))
+
+    return header
+
+
+def load_checkpoint(fn, offset=0, mmap=True):
+    """ Maps a checkpoint written by `LanguageModel.save()` into memory.
+
+        With `mmap`, parameters of the model are copy-on-write views of the
+        file, so nothing is read until the parameters are used, and moving
+        the model to GPU reads them exactly once. The file must then not be
+        overwritten while the model is in use; models which are going to be
+        saved to where they came from should be loaded without `mmap`.
+    """
+    header = _read_checkpoint_header(fn, offset)
+
+    try:
+        model_class = MODEL_CLASSES[header['model_class']]
+    except KeyError:
+        raise ValueError("Checkpoint {} holds unknown model class {}".format(fn, header['model_class']))
+
+    if header.get('quantization') not in [None, 'int8']:
+        raise ValueError("Checkpoint {} has unknown quantization {}".format(fn, header['quantization']))
+    model = _model_skeleton(model_class, header['model_kwargs'], header.get('quantization'))
+
+    for name, dtype, shape, tensor_offset in header['tensors']:
+        dtype = np.dtype(dtype)
+        if mmap:
+            array = np.memmap(fn, dtype=dtype, mode='c', offset=offset + tensor_offset, shape=tuple(shape))
+        else:
+            array = np.fromfile(fn, dtype=dtype, count=int(np.prod(shape)), offset=offset + tensor_offset)
+            array = array.reshape(shape)
+        _set_tensor(model, name, torch.from_numpy(array))
+
+    for name, tensor in model.state_dict().items():
+        if getattr(tensor, 'is_meta', False):
+            raise ValueError("Checkpoint {} misses tensor {}".format(fn, name))
+
+    vocab = load_compact_vocabulary(fn, offset + header['vocab_offset'], mmap)
+
+    return LanguageModel(model, vocab)
+
+
+def _load_pickled(f):
     complete_lm = pickle.load(f)
 
     model_bytes = complete_lm['model']
@@ -41,3 +292,44 @@ def load(f):
     vocab = pickle.load(vocab_bytes)
 
     return LanguageModel(model, vocab)
+
+
+def load(f, mmap=True):
+    """ Loads a LanguageModel, either from a checkpoint or from the older pickled format.
+
+        Args:
+            mmap (bool): Map parameters of a checkpoint instead of reading them, see `load_checkpoint()`.
+    """
+    # make sure all model classes are registered
+    from language_models import ffnn_models, lstm_model, smm_lstm_models  # noqa: F401
+
+    start = f.tell()
+    magic = f.read(len(CHECKPOINT_MAGIC))
+    f.seek(start)
+    if magic != CHECKPOINT_MAGIC:
+        return _load_pickled(f)
+
+    fn = getattr(f, 'name', None)
+    if isinstance(fn, str) and os.path.isfile(fn):
+        return load_checkpoint(fn, start, mmap)
+
+    # not backed by a file, the mapping outlives the temporary one
+    with tempfile.NamedTemporaryFile() as tmp_f:
+        tmp_f.write(f.read())
+        tmp_f.flush()
+        return load_checkpoint(tmp_f.name, mmap=mmap)
+
+
+def load_vocab(fn):
+    """ Vocabulary of the LanguageModel stored in `fn`.
+
+        The model of a checkpoint is not constructed, pickled models are
+        loaded in full.
+    """
+    with open(fn, 'rb') as f:
+        if f.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+            f.seek(0)
+            return load(f).vocab
+
+    header = _read_checkpoint_header(fn, 0)
+    return load_compact_vocabulary(fn, header['vocab_offset'])
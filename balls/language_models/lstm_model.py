@@ -1,21 +1,25 @@
 import torch.nn as nn
 from torch.autograd import Variable
 
+from language_models.decoders import build_decoder, decode, init_decoder_weights, tie_decoder_weights
+from language_models.language_model import registered_model
 
+
+@registered_model
 class LSTMLanguageModel(nn.Module):
     """Container module with an encoder, a recurrent module, and a decoder."""
 
-    def __init__(self, ntoken, ninp, nhid, nlayers, dropout=0.5, tie_weights=False):
+    def __init__(self, ntoken, ninp, nhid, nlayers, dropout=0.5, tie_weights=False, decoder='full'):
         super(LSTMLanguageModel, self).__init__()
         self.drop = nn.Dropout(dropout)
         self.encoder = nn.Embedding(ntoken, ninp)
         self.rnn = nn.LSTM(ninp, nhid, nlayers, dropout=dropout)
-        self.decoder = nn.Linear(nhid, ntoken)
+        self.decoder = build_decoder(decoder, nhid, ntoken)
 
         if tie_weights:
             if nhid != ninp:
                 raise ValueError('When using the tied flag, nhid must be equal to emsize')
-            self.decoder.weight = self.encoder.weight
+            tie_decoder_weights(self.decoder, self.encoder)
 
         self.init_weights()
 
@@ -28,14 +32,18 @@ class LSTMLanguageModel(nn.Module):
     def init_weights(self):
         initrange = 0.1
         self.encoder.weight.data.uniform_(-initrange, initrange)
-        self.decoder.bias.data.fill_(0)
-        self.decoder.weight.data.uniform_(-initrange, initrange)
+        init_decoder_weights(self.decoder, initrange)
 
-    def forward(self, input, hidden):
+    def features(self, input, hidden):
+        """ Inputs of the decoder, [T, B, nhid], and the new hidden state.
+        """
         emb = self.drop(self.encoder(input))
         output, hidden = self.rnn(emb, hidden)
-        output = self.drop(output)
-        decoded = nn.LogSoftmax(dim=2)(self.decoder(output))
+        return self.drop(output), hidden
+
+    def forward(self, input, hidden):
+        output, hidden = self.features(input, hidden)
+        decoded = decode(self.decoder, output)
         return decoded, hidden
 
     def output_expected_embs(self, input):
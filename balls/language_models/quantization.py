@@ -0,0 +1,275 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.autograd import Variable
+
+
+QUANTIZABLE_MODELS = ('LSTMLanguageModel', 'BengioModel')
+
+
+def quantize_per_channel(weight):
+    """ Symmetric int8 quantization of `weight` with a scale per row.
+
+        Returns:
+            (CharTensor, scales) such that weight ~ int8 * scales[:, None],
+            scales in the type of `weight`.
+    """
+    weight = weight.contiguous()
+    scale = weight.abs().max(1)[0] / 127.0
+    scale[scale == 0] = 1.0  # all-zero rows stay zero for any scale
+    quantized = torch.round(weight / scale.unsqueeze(1)).clamp(-127, 127).char()
+    return quantized, scale
+
+
+_int8_kernels = None
+
+
+def int8_kernels_available():
+    """ Whether PyTorch has CPU kernels multiplying float activations with int8 weights.
+    """
+    global _int8_kernels
+    if _int8_kernels is None:
+        engines = getattr(getattr(torch.backends, 'quantized', None), 'supported_engines', [])
+        _int8_kernels = any(engine in engines for engine in ('x86', 'fbgemm', 'qnnpack'))
+    return _int8_kernels
+
+
+def _uses_kernels(x):
+    # the kernels take plain float32 CPU tensors, anything else goes through dequantized weights
+    return torch.is_tensor(x) and not x.is_cuda and x.dtype == torch.float32 and int8_kernels_available()
+
+
+def _pack(quantized, scale, bias):
+    """ Int8 weights with their scales and a bias, prepared for `torch.ops.quantized.linear_dynamic`.
+    """
+    zero_points = torch.zeros(scale.size(0), dtype=torch.long)
+    # q * scale / scale rounds back to q, the kernels see exactly the stored values
+    weight = torch.quantize_per_channel(
+        quantized.float() * scale.float().unsqueeze(1), scale.double(), zero_points, 0, torch.qint8
+    )
+    return torch.ops.quantized.linear_prepack(weight, bias.detach().float().contiguous())
+
+
+def dequantize(reference, quantized, scale):
+    """ Rows of a weight matrix from their int8 values, a Variable if `reference` is one (PyTorch 0.3).
+    """
+    weight = quantized.type_as(scale) * scale.unsqueeze(1)
+    if torch.is_tensor(reference) or not hasattr(reference, 'data'):
+        return weight
+    return Variable(weight)
+
+
+class QuantizedLinear(nn.Module):
+    """ Inference-only Linear layer holding int8 weights with a scale per output unit.
+
+        The bias stays in floating point. Where `int8_kernels_available()`,
+        float32 CPU inputs are multiplied by the int8 weights directly,
+        packed for the kernels at first use. Otherwise, and for `rows()`
+        and `block()`, weights are dequantized.
+    """
+    def __init__(self, in_features, out_features, bias=None):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.register_buffer('weight_int8', torch.zeros(out_features, in_features).char())
+        self.register_buffer('weight_scale', torch.ones(out_features))
+        self.bias = bias
+        self._packed = {}  # (start, end) -> (weight_int8 packed from, packed rows)
+
+    @classmethod
+    def from_float(cls, linear):
+        quantized = cls(linear.in_features, linear.out_features, linear.bias)
+        quantized.weight_int8, quantized.weight_scale = quantize_per_channel(linear.weight.data)
+        return quantized
+
+    def _packed_rows(self, start, end):
+        # weights replaced since packing, e.g. by loading a checkpoint, are packed again
+        packed = self._packed.get((start, end))
+        if packed is None or packed[0] is not self.weight_int8:
+            packed = (self.weight_int8, _pack(
+                self.weight_int8[start:end], self.weight_scale[start:end], self.bias.data[start:end]
+            ))
+            self._packed[(start, end)] = packed
+        return packed[1]
+
+    def forward(self, x):
+        if _uses_kernels(x):
+            return torch.ops.quantized.linear_dynamic(x, self._packed_rows(0, self.out_features), True)
+        return F.linear(x, dequantize(x, self.weight_int8, self.weight_scale), self.bias)
+
+    def block_logits(self, x, start, end):
+        """ Outputs [start, end) of the layer for `x`.
+        """
+        if _uses_kernels(x):
+            return torch.ops.quantized.linear_dynamic(x, self._packed_rows(start, end), True)
+        weight, bias = self.block(start, end)
+        return x.matmul(weight.t()) + bias
+
+    def rows(self, indices):
+        """ Dequantized weights and biases of output units `indices`.
+        """
+        index = indices.data if hasattr(indices, 'data') and not torch.is_tensor(indices) else indices
+        weight = dequantize(indices, self.weight_int8.index_select(0, index), self.weight_scale.index_select(0, index))
+        return weight, self.bias.index_select(0, indices)
+
+    def block(self, start, end):
+        """ Dequantized weights and biases of output units [start, end).
+        """
+        weight = dequantize(self.bias, self.weight_int8[start:end], self.weight_scale[start:end])
+        return weight, self.bias[start:end]
+
+
+class QuantizedEmbedding(nn.Module):
+    """ Inference-only Embedding holding int8 vectors with a scale per word.
+    """
+    def __init__(self, num_embeddings, embedding_dim):
+        super().__init__()
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.register_buffer('weight_int8', torch.zeros(num_embeddings, embedding_dim).char())
+        self.register_buffer('weight_scale', torch.ones(num_embeddings))
+
+    @classmethod
+    def from_float(cls, embedding):
+        quantized = cls(embedding.num_embeddings, embedding.embedding_dim)
+        quantized.weight_int8, quantized.weight_scale = quantize_per_channel(embedding.weight.data)
+        return quantized
+
+    def forward(self, input):
+        index = input.data if hasattr(input, 'data') and not torch.is_tensor(input) else input
+        index = index.contiguous().view(-1)
+        emb = dequantize(input, self.weight_int8.index_select(0, index), self.weight_scale.index_select(0, index))
+        return emb.view(*(tuple(input.size()) + (self.embedding_dim,)))
+
+
+class QuantizedLSTM(nn.Module):
+    """ Inference-only unidirectional LSTM holding int8 weights with a scale per gate unit.
+
+        Takes and returns the same as a sequence-first `nn.LSTM`, dropout
+        between layers is not applied. Float32 CPU inputs run through the
+        fused int8 LSTM of PyTorch where `int8_kernels_available()`, other
+        inputs through dequantized weights, one timestep at a time.
+    """
+    def __init__(self, input_size, hidden_size, num_layers, biases):
+        super().__init__()
+        self.input_size = input_size
+        self.hidden_size = hidden_size
+        self.num_layers = num_layers
+
+        for layer in range(num_layers):
+            layer_input_size = input_size if layer == 0 else hidden_size
+            for kind, in_size in [('ih', layer_input_size), ('hh', hidden_size)]:
+                name = 'weight_{}_l{}'.format(kind, layer)
+                self.register_buffer(name + '_int8', torch.zeros(4 * hidden_size, in_size).char())
+                self.register_buffer(name + '_scale', torch.ones(4 * hidden_size))
+                setattr(self, 'bias_{}_l{}'.format(kind, layer), biases['bias_{}_l{}'.format(kind, layer)])
+
+        self._packed = None  # (weight_ih_l0_int8 packed from, cell parameters of all layers)
+
+    @classmethod
+    def from_float(cls, lstm):
+        if lstm.batch_first or lstm.bidirectional or not lstm.bias:
+            raise ValueError("Only sequence-first unidirectional LSTMs with biases can be quantized")
+
+        biases = {name: param for name, param in lstm.named_parameters() if name.startswith('bias')}
+        quantized = cls(lstm.input_size, lstm.hidden_size, lstm.num_layers, biases)
+        for name, param in lstm.named_parameters():
+            if name.startswith('weight'):
+                weight_int8, weight_scale = quantize_per_channel(param.data)
+                setattr(quantized, name + '_int8', weight_int8)
+                setattr(quantized, name + '_scale', weight_scale)
+        return quantized
+
+    def _weight(self, reference, kind, layer):
+        name = 'weight_{}_l{}'.format(kind, layer)
+        return dequantize(reference, getattr(self, name + '_int8'), getattr(self, name + '_scale'))
+
+    def _cell_params(self):
+        if self._packed is None or self._packed[0] is not self.weight_ih_l0_int8:
+            cell_params = []
+            for layer in range(self.num_layers):
+                biases = [getattr(self, 'bias_{}_l{}'.format(kind, layer)).data for kind in ['ih', 'hh']]
+                packed = [
+                    _pack(getattr(self, name + '_int8'), getattr(self, name + '_scale'), bias)
+                    for name, bias in zip(['weight_ih_l{}'.format(layer), 'weight_hh_l{}'.format(layer)], biases)
+                ]
+                cell_params.append(torch.ops.quantized.make_quantized_cell_params_dynamic(
+                    packed[0], packed[1], biases[0], biases[1], True
+                ))
+            self._packed = (self.weight_ih_l0_int8, cell_params)
+        return self._packed[1]
+
+    def forward(self, input, hidden):
+        if _uses_kernels(input) and _uses_kernels(hidden[0]):
+            output, h_n, c_n = torch.quantized_lstm(
+                input, hidden, self._cell_params(), True, self.num_layers, 0.0, False, False, False,
+                dtype=torch.qint8, use_dynamic=True
+            )
+            return output, (h_n, c_n)
+
+        h_0, c_0 = hidden
+        output = input
+        h_n, c_n = [], []
+        for layer in range(self.num_layers):
+            w_hh = self._weight(input, 'hh', layer)
+            bias = getattr(self, 'bias_ih_l{}'.format(layer)) + getattr(self, 'bias_hh_l{}'.format(layer))
+            # input projections of all timesteps at once, only the recurrence is sequential
+            projected = F.linear(output, self._weight(input, 'ih', layer), bias)
+
+            h, c = h_0[layer], c_0[layer]
+            outputs = []
+            for t in range(projected.size(0)):
+                i, f, g, o = (projected[t] + h.matmul(w_hh.t())).chunk(4, 1)
+                c = torch.sigmoid(f) * c + torch.sigmoid(i) * torch.tanh(g)
+                h = torch.sigmoid(o) * torch.tanh(c)
+                outputs.append(h)
+
+            output = torch.stack(outputs)
+            h_n.append(h)
+            c_n.append(c)
+
+        return output, (torch.stack(h_n), torch.stack(c_n))
+
+
+QUANTIZED_MODULES = {
+    nn.Linear: QuantizedLinear,
+    nn.Embedding: QuantizedEmbedding,
+    nn.LSTM: QuantizedLSTM,
+}
+
+
+def _quantize_children(module):
+    for name, child in module.named_children():
+        if type(child) in QUANTIZED_MODULES:
+            setattr(module, name, QUANTIZED_MODULES[type(child)].from_float(child))
+        elif isinstance(child, (nn.ModuleList, nn.Sequential)):
+            _quantize_children(child)
+
+
+def quantize_model(model):
+    """ Replaces embeddings, LSTMs and Linear layers of `model` by int8 ones, in place.
+
+        Factorized decoders stay in floating point. Output word vectors
+        tied to the embeddings remain shared in their quantized form.
+    """
+    if model.__class__.__name__ not in QUANTIZABLE_MODELS:
+        raise ValueError("Quantization supports {}, got {}".format(
+            ', '.join(QUANTIZABLE_MODELS), model.__class__.__name__
+        ))
+    if is_quantized(model):
+        raise ValueError("Model is already quantized")
+
+    decoder = getattr(model, 'decoder', None)
+    tied = isinstance(decoder, nn.Linear) and decoder.weight is model.encoder.weight
+
+    _quantize_children(model)
+
+    if tied:
+        model.decoder.weight_int8 = model.encoder.weight_int8
+        model.decoder.weight_scale = model.encoder.weight_scale
+
+    return model
+
+
+def is_quantized(model):
+    return any(type(m) in QUANTIZED_MODULES.values() for m in model.modules())
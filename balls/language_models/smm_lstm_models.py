@@ -3,22 +3,36 @@ import torch.nn as nn
 from torch.autograd import Variable
 import torch.nn.functional as F
 
+from language_models.decoders import build_decoder, decode, init_decoder_weights, is_factorized, tie_decoder_weights
+from language_models.language_model import registered_model
 
+
+@registered_model
 class OutputEnhancedLM(nn.Module):
-    """Container module with an encoder, a recurrent module, and a decoder."""
+    """Container module with an encoder, a recurrent module, and a decoder.
 
-    def __init__(self, ntoken, ninp, nhid, nlayers, ivec_dim, dropout=0.5, dropout_ivec=0.0, ivec_amplification=1.0, tie_weights=False):
+    With a full decoder, the projected i-vector is added to the output logits.
+    A factorized decoder gets the i-vector appended to the LSTM output instead,
+    so that both its levels are adapted.
+    """
+
+    def __init__(self, ntoken, ninp, nhid, nlayers, ivec_dim, dropout=0.5, dropout_ivec=0.0, ivec_amplification=1.0, tie_weights=False, decoder='full'):
         super().__init__()
         self.drop = nn.Dropout(dropout)
         self.drop_ivec = nn.Dropout(dropout_ivec)
         self.encoder = nn.Embedding(ntoken, ninp)
         self.rnn = nn.LSTM(ninp, nhid, nlayers, dropout=dropout)
-        self.decoder = nn.Linear(nhid, ntoken)
-        self.ivec_proj = nn.Linear(ivec_dim, ntoken)
+        if decoder == 'full':
+            self.decoder = nn.Linear(nhid, ntoken)
+            self.ivec_proj = nn.Linear(ivec_dim, ntoken)
+        else:
+            self.decoder = build_decoder(decoder, nhid + ivec_dim, ntoken)
 
         if tie_weights:
             if nhid != ninp:
                 raise ValueError('When using the tied flag, nhid must be equal to emsize')
+            if decoder != 'full':
+                raise ValueError('Weights of a {} decoder cannot be tied, its input includes the i-vector'.format(decoder))
             self.decoder.weight = self.encoder.weight
 
         self.init_weights()
@@ -33,11 +47,11 @@ class OutputEnhancedLM(nn.Module):
     def init_weights(self):
         initrange = 0.1
         self.encoder.weight.data.uniform_(-initrange, initrange)
-        self.decoder.bias.data.fill_(0)
-        self.decoder.weight.data.uniform_(-initrange, initrange)
-        self.ivec_proj.weight.data.uniform_(-initrange, initrange)
+        init_decoder_weights(self.decoder, initrange)
+        if not is_factorized(self.decoder):
+            self.ivec_proj.weight.data.uniform_(-initrange, initrange)
 
-    def forward(self, input, hidden, ivec):
+    def _lstm_and_ivec(self, input, hidden, ivec):
         emb = self.drop(self.encoder(input))
         output, hidden = self.rnn(emb, hidden)
         output = self.drop(output)
@@ -46,16 +60,44 @@ class OutputEnhancedLM(nn.Module):
         except AttributeError:
             ivec = self.drop_ivec(ivec)
 
+        return output, ivec, hidden
+
+    def features(self, input, hidden, ivec):
+        """ LSTM outputs with the i-vector appended, [T, B, nhid + ivec_dim], and the new hidden state.
+        """
+        output, ivec, hidden = self._lstm_and_ivec(input, hidden, ivec)
+        if ivec.dim() < output.dim():
+            ivec = ivec.unsqueeze(0)
+        ivec = ivec.expand(*(tuple(output.size()[:-1]) + (ivec.size(-1),)))
+        return torch.cat([output, ivec], dim=-1), hidden
+
+    def forward(self, input, hidden, ivec):
+        if is_factorized(self.decoder):
+            features, hidden = self.features(input, hidden, ivec)
+            return decode(self.decoder, features), hidden
+
+        output, ivec, hidden = self._lstm_and_ivec(input, hidden, ivec)
         decoded = nn.LogSoftmax(dim=2)(self.decoder(output) + self.ivec_proj(ivec))
 
         return decoded, hidden
 
+    def output_rows(self, indices):
+        """ Weights and biases producing the logits of words `indices` from `features()`.
+        """
+        if is_factorized(self.decoder):
+            raise ValueError("Output rows need a full decoder, got {}".format(self.decoder.__class__.__name__))
+
+        weight = torch.cat([self.decoder.weight.index_select(0, indices), self.ivec_proj.weight.index_select(0, indices)], dim=1)
+        bias = self.decoder.bias.index_select(0, indices) + self.ivec_proj.bias.index_select(0, indices)
+        return weight, bias
+
     def init_hidden(self, bsz):
         weight = next(self.parameters()).data
         return (Variable(weight.new(self.nlayers, bsz, self.nhid).zero_()),
                 Variable(weight.new(self.nlayers, bsz, self.nhid).zero_()))
 
 
+@registered_model
 class OutputLinearBottleneckLM(nn.Module):
     """Container module with an encoder, a recurrent module, and a decoder."""
 
@@ -109,10 +151,11 @@ class OutputLinearBottleneckLM(nn.Module):
                 Variable(weight.new(self.nlayers, bsz, self.nhid).zero_()))
 
 
+@registered_model
 class OutputBottleneckLM(nn.Module):
     """Container module with an encoder, a recurrent module, and a decoder."""
 
-    def __init__(self, ntoken, ninp, nhid, nlayers, ivec_dim, dropout=0.5, dropout_ivec=0.0, ivec_amplification=1.0, tie_weights=False):
+    def __init__(self, ntoken, ninp, nhid, nlayers, ivec_dim, dropout=0.5, dropout_ivec=0.0, ivec_amplification=1.0, tie_weights=False, decoder='full'):
         super().__init__()
         self.drop = nn.Dropout(dropout)
         self.drop_ivec = nn.Dropout(dropout_ivec)
@@ -120,12 +163,12 @@ class OutputBottleneckLM(nn.Module):
         self.rnn = nn.LSTM(ninp, nhid, nlayers, dropout=dropout)
         self.bn_proj_lstm = nn.Linear(nhid, nhid)
         self.bn_proj_ivec = nn.Linear(ivec_dim, nhid)
-        self.decoder = nn.Linear(nhid, ntoken)
+        self.decoder = build_decoder(decoder, nhid, ntoken)
 
         if tie_weights:
             if nhid != ninp:
                 raise ValueError('When using the tied flag, nhid must be equal to emsize')
-            self.decoder.weight = self.encoder.weight
+            tie_decoder_weights(self.decoder, self.encoder)
 
         self.init_weights()
 
@@ -139,20 +182,24 @@ class OutputBottleneckLM(nn.Module):
     def init_weights(self):
         initrange = 0.1
         self.encoder.weight.data.uniform_(-initrange, initrange)
-        self.decoder.bias.data.fill_(0)
-        self.decoder.weight.data.uniform_(-initrange, initrange)
+        init_decoder_weights(self.decoder, initrange)
         self.bn_proj_lstm.weight.data.uniform_(-initrange, initrange)
         self.bn_proj_ivec.weight.data.uniform_(-initrange, initrange)
         self.bn_proj_ivec.bias.data.fill_(0)
 
-    def forward(self, input, hidden, ivec):
+    def features(self, input, hidden, ivec):
+        """ Bottleneck outputs, [T, B, nhid], and the new hidden state.
+        """
         emb = self.drop(self.encoder(input))
         output, hidden = self.rnn(emb, hidden)
         output = self.drop(output)
         ivec = self.drop_ivec(self._ivec_amplification * ivec)
         bn = self.bn_proj_lstm(output) + self.bn_proj_ivec(ivec)
-        bn = self.drop(F.tanh(bn))
-        decoded = nn.LogSoftmax(dim=2)(self.decoder(bn))
+        return self.drop(F.tanh(bn)), hidden
+
+    def forward(self, input, hidden, ivec):
+        bn, hidden = self.features(input, hidden, ivec)
+        decoded = decode(self.decoder, bn)
 
         return decoded, hidden
 
@@ -173,6 +220,7 @@ class GatedLinearUnit(nn.Module):
         return t * g
 
 
+@registered_model
 class OutputGLULM(nn.Module):
     """Container module with an encoder, a recurrent module, and a decoder."""
 
@@ -218,6 +266,7 @@ class OutputGLULM(nn.Module):
                 Variable(weight.new(self.nlayers, bsz, self.nhid).zero_()))
 
 
+@registered_model
 class OutputMultiplicativeLM(nn.Module):
     """Container module with an encoder, a recurrent module, and a decoder."""
 
@@ -261,6 +310,7 @@ class OutputMultiplicativeLM(nn.Module):
                 Variable(weight.new(self.nlayers, bsz, self.nhid).zero_()))
 
 
+@registered_model
 class InputEnhancedLM(nn.Module):
     """Container module with an encoder, a recurrent module, and a decoder."""
 
@@ -304,6 +354,7 @@ class InputEnhancedLM(nn.Module):
                 Variable(weight.new(self.nlayers, bsz, self.nhid).zero_()))
 
 
+@registered_model
 class IvecOnlyLM(nn.Module):
     """Container module with an encoder, a recurrent module, and a decoder."""
 
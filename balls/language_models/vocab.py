@@ -1,6 +1,10 @@
-from collections import Mapping
+from collections.abc import Mapping
+import hashlib
 import re
 
+import numpy as np
+import torch
+
 
 class IndexGenerator():
     def __init__(self, assigned):
@@ -55,8 +59,265 @@ class Vocabulary(Mapping):
         return iter(self.w2i_)
 
 
+VOCAB_MAGIC = b'BRNOVOC1'
+
+
+class CompactVocabulary(Mapping):
+    def __init__(self, sorted_words, sorted_indices, index_words, unk_word, unk_index):
+        """ Read-only vocabulary backed by numpy arrays instead of dicts.
+
+            Use `CompactVocabulary.from_words()` or `load_compact_vocabulary()`
+            to construct one.
+
+            Args:
+                sorted_words (np.ndarray): UTF-8 encoded words, sorted, dtype 'S'.
+                sorted_indices (np.ndarray): Index of each of `sorted_words`.
+                index_words (np.ndarray): Word of each index, b'' for unused indices.
+        """
+        self._sorted_words = sorted_words
+        self._sorted_indices = sorted_indices
+        self._index_words = index_words
+        self.unk_word_ = unk_word
+        self.unk_index_ = unk_index
+        self._fingerprint = None
+
+    @classmethod
+    def from_words(cls, words, indices, unk_word):
+        """ Builds the vocabulary from parallel lists of words and their indices.
+
+            Later occurrences of a word override earlier ones.
+        """
+        encoded = np.asarray([w.encode('utf-8') for w in words] + [b''])[:-1]
+        indices = np.asarray(indices, dtype=np.int64)
+
+        # np.unique keeps the first occurrence, reversing makes it the last one
+        sorted_words, last_occurrences = np.unique(encoded[::-1], return_index=True)
+        sorted_indices = indices[::-1][last_occurrences]
+
+        index_words = np.zeros(indices.max() + 1 if len(indices) > 0 else 0, dtype=encoded.dtype)
+        index_words[sorted_indices] = sorted_words
+
+        unk_position = np.searchsorted(sorted_words, unk_word.encode('utf-8'))
+        if unk_position == len(sorted_words) or sorted_words[unk_position] != unk_word.encode('utf-8'):
+            raise ValueError("Unk word {} not present in the vocabulary!".format(unk_word))
+
+        return cls(sorted_words, sorted_indices, index_words, unk_word, int(sorted_indices[unk_position]))
+
+    @classmethod
+    def from_mapping(cls, vocab):
+        words = list(vocab)
+        return cls.from_words(words, [vocab[w] for w in words], vocab.unk_word_)
+
+    def _lookup(self, encoded):
+        """ Indices of an array of encoded words, -1 for unknown ones """
+        positions = np.searchsorted(self._sorted_words, encoded)
+        positions = np.minimum(positions, len(self._sorted_words) - 1)
+        found = self._sorted_words[positions] == encoded
+        return np.where(found, self._sorted_indices[positions], -1)
+
+    def w2i(self, word):
+        index = self._lookup(np.asarray([word.encode('utf-8')]))[0]
+        return int(index) if index >= 0 else self.unk_index_
+
+    def __getitem__(self, idx):
+        return self.w2i(idx)
+
+    def encode(self, words):
+        """ Translates a list of words into a LongTensor of indices in one go.
+        """
+        if len(words) == 0:
+            return torch.LongTensor()
+
+        indices = self._lookup(np.asarray([w.encode('utf-8') for w in words]))
+        indices[indices < 0] = self.unk_index_
+        return torch.from_numpy(indices)
+
+    def i2w(self, index):
+        if index < 0 or index >= len(self._index_words) or len(self._index_words[index]) == 0:
+            raise KeyError(index)
+        return self._index_words[index].decode('utf-8')
+
+    def max_index(self):
+        return int(self._sorted_indices.max()) if len(self._sorted_indices) > 0 else -1
+
+    def fingerprint(self):
+        """ `vocab_fingerprint()` of the vocabulary, computed once as it never changes.
+        """
+        if self._fingerprint is None:
+            # words are sorted already, a stable sort by index gives the order of `vocab_fingerprint()`
+            order = np.argsort(self._sorted_indices, kind='mergesort')
+            self._fingerprint = _fingerprint(
+                (int(i), w.decode('utf-8')) for i, w in zip(self._sorted_indices[order], self._sorted_words[order])
+            )
+        return self._fingerprint
+
+    def __len__(self):
+        return len(self._sorted_words)
+
+    def __iter__(self):
+        for position in np.argsort(self._sorted_indices, kind='mergesort'):
+            yield self._sorted_words[position].decode('utf-8')
+
+    def save(self, f):
+        """ Writes the vocabulary in a binary format, see `load_compact_vocabulary()`.
+        """
+        from data_pipeline.data import write_binary_header
+
+        header = {
+            'unk_word': self.unk_word_,
+            'unk_index': self.unk_index_,
+            'nb_words': len(self._sorted_words),
+            'nb_indices': len(self._index_words),
+            'word_dtype': self._sorted_words.dtype.str,
+        }
+        payload_offset = write_binary_header(f, VOCAB_MAGIC, header)
+        for array in [self._sorted_indices, self._sorted_words, self._index_words]:
+            data = np.ascontiguousarray(array).tobytes()
+            f.write(data)
+            f.write(b'\0' * ((-len(data)) % 8))
+
+
+def load_compact_vocabulary(fn, offset=0, mmap=True):
+    """ Maps a vocabulary written by `CompactVocabulary.save()` into memory.
+
+        Args:
+            offset (int): Position of the vocabulary in the file.
+            mmap (bool): If False, the arrays are read instead.
+    """
+    from data_pipeline.data import read_binary_header
+
+    with open(fn, 'rb') as f:
+        f.seek(offset)
+        header, payload_offset = read_binary_header(f, VOCAB_MAGIC)
+    position = offset + payload_offset
+
+    arrays = []
+    for dtype, length in [(np.int64, header['nb_words']),
+                          (np.dtype(header['word_dtype']), header['nb_words']),
+                          (np.dtype(header['word_dtype']), header['nb_indices'])]:
+        dtype = np.dtype(dtype)
+        if length > 0 and mmap:
+            arrays.append(np.memmap(fn, dtype=dtype, mode='r', offset=position, shape=(length,)))
+        elif length > 0:
+            arrays.append(np.fromfile(fn, dtype=dtype, count=length, offset=position))
+        else:
+            arrays.append(np.zeros(0, dtype=dtype))
+        size = length * dtype.itemsize
+        position += size + (-size) % 8
+
+    sorted_indices, sorted_words, index_words = arrays
+    return CompactVocabulary(sorted_words, sorted_indices, index_words,
+                             header['unk_word'], header['unk_index'])
+
+
+class VocabularyRemapping():
+    def __init__(self, old2new):
+        """ Invertible renumbering of word indices.
+
+            Args:
+                old2new (np.ndarray): New index of each old index, -1 for
+                    old indices without a word. New indices are distinct.
+        """
+        old2new = np.asarray(old2new, dtype=np.int64)
+        used = old2new[old2new >= 0]
+        if len(np.unique(used)) != len(used):
+            raise ValueError("Remapping has to be one-to-one")
+
+        self.old2new = old2new
+        self.new2old = np.full(used.max() + 1 if len(used) > 0 else 0, -1, dtype=np.int64)
+        self.new2old[used] = np.flatnonzero(old2new >= 0)
+
+    @classmethod
+    def by_frequency(cls, vocab, counts):
+        """ Renumbers the words of `vocab` densely, the most frequent one getting 0.
+
+            Ties keep the original order.
+
+            Args:
+                counts (np.ndarray): Number of occurrences of each old index.
+        """
+        indices = np.asarray(sorted(vocab[w] for w in vocab), dtype=np.int64)
+        counts = np.asarray(counts)
+        word_counts = np.where(indices < len(counts), counts[np.minimum(indices, len(counts) - 1)], 0)
+
+        order = indices[np.argsort(-word_counts, kind='mergesort')]
+        old2new = np.full(indices.max() + 1 if len(indices) > 0 else 0, -1, dtype=np.int64)
+        old2new[order] = np.arange(len(order))
+        return cls(old2new)
+
+    def inverse(self):
+        return VocabularyRemapping(self.new2old)
+
+    def __call__(self, indices):
+        """ New indices of old `indices`, a np.ndarray or a tensor.
+        """
+        if torch.is_tensor(indices):
+            return torch.from_numpy(self.old2new).index_select(0, indices.long())
+        return self.old2new[np.asarray(indices)]
+
+    def remap_vocab(self, vocab):
+        """ CompactVocabulary with the words of `vocab` under their new indices.
+        """
+        words = list(vocab)
+        new_indices = self.old2new[[vocab[w] for w in words]]
+        if (new_indices < 0).any():
+            raise ValueError("Remapping does not cover all words of the vocabulary")
+        return CompactVocabulary.from_words(words, new_indices, vocab.unk_word_)
+
+    def save(self, f):
+        """ Writes 'old new' lines, see `load_vocabulary_remapping()`.
+        """
+        for old, new in enumerate(self.old2new):
+            if new >= 0:
+                f.write("{} {}\n".format(old, new))
+
+
+def load_vocabulary_remapping(f):
+    pairs = [tuple(int(i) for i in line.split()) for line in f if line.strip()]
+    if not pairs:
+        return VocabularyRemapping([])
+
+    olds, news = zip(*pairs)
+    old2new = np.full(max(olds) + 1, -1, dtype=np.int64)
+    old2new[list(olds)] = news
+    return VocabularyRemapping(old2new)
+
+
+def encode_words(vocab, words):
+    """ LongTensor of indices of `words`, looked up all at once in a CompactVocabulary.
+    """
+    if isinstance(vocab, CompactVocabulary):
+        return vocab.encode(words)
+    return torch.LongTensor([vocab[w] for w in words])
+
+
+def vocab_max_index(vocab):
+    """ Largest index of the vocabulary, without a lookup per word where possible.
+    """
+    if isinstance(vocab, CompactVocabulary):
+        return vocab.max_index()
+    return max(vocab[w] for w in vocab)
+
+
+def vocab_fingerprint(vocab):
+    """ Identifies the word -> index mapping, independently of its implementation.
+    """
+    if isinstance(vocab, CompactVocabulary):
+        return vocab.fingerprint()
+    return _fingerprint(sorted((vocab[w], w) for w in vocab))
+
+
+def _fingerprint(pairs):
+    digest = hashlib.sha1()
+    for i, w in pairs:
+        digest.update("{} {}\n".format(w, i).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
 def vocab_from_kaldi_wordlist_base(f, unk_word, word_re, remove_quotes):
-    d = {}
+    words = []
+    indices = []
     line_re = re.compile('\s*(?P<word>' + word_re + ')\s+(?P<ind>[0-9]+)\s*\n?')
     for i, line in enumerate(f):
         m = line_re.fullmatch(line)
@@ -68,26 +329,38 @@ def vocab_from_kaldi_wordlist_base(f, unk_word, word_re, remove_quotes):
         if remove_quotes:
             assert w[0] == w[-1] == "'"
             w = w[1:-1]
-        i = int(m.group('ind'))
-        assert i >= 0
-        d[w] = i
+        words.append(w)
+        indices.append(int(m.group('ind')))
+
+    return kaldi_vocab(words, indices, unk_word)
+
+
+def write_kaldi_wordlist(vocab, f):
+    """ Writes 'word index' lines ordered by index, as read by `vocab_from_kaldi_wordlist()`.
+    """
+    for i, w in sorted((vocab[w], w) for w in vocab):
+        f.write("{} {}\n".format(w, i))
+
 
+def kaldi_vocab(words, indices, unk_word):
     try:
-        vocab = Vocabulary(unk_word, d[unk_word])
-    except KeyError:
+        return CompactVocabulary.from_words(words, indices, unk_word)
+    except ValueError:
         raise ValueError("Unk word {} not present in the kaldi wordlist!".format(unk_word))
-    vocab.ind_gen_ = None
-    vocab.w2i_ = d
-    for w in d:
-        vocab.i2w_[d[w]] = w
 
-    vocab.size_ = max(d.values()) + 1
 
-    return vocab
+def vocab_from_kaldi_wordlist(f, unk_word='<unk>'):
+    words = []
+    indices = []
+    for i, line in enumerate(f):
+        fields = line.split()
+        if len(fields) != 2 or not fields[1].isdigit():
+            raise ValueError("Weird line {}: '{}'".format(i, line))
 
+        words.append(fields[0])
+        indices.append(int(fields[1]))
 
-def vocab_from_kaldi_wordlist(f, unk_word='<unk>'):
-    return vocab_from_kaldi_wordlist_base(f, unk_word, word_re='\S+', remove_quotes=False)
+    return kaldi_vocab(words, indices, unk_word)
 
 
 def quoted_vocab_from_kaldi_wordlist(f, unk_word='<unk>'):
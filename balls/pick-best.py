@@ -1,63 +1,23 @@
 import argparse
 import sys
 
-def read_latt(f):
-    line = f.readline()
-    while line == '\n':
-        line = f.readline()
+from runtime.lattice_picking import pick_indexed, pick_sequential
 
-    if line == '':
-       return None, None, None
-
-    fields = line.strip().split('-')
-    segment_id = '-'.join(fields[:-1])
-    trans_id = fields[-1]
-
-    content = ""
-    line = f.readline()
-    while line != '\n':
-        content += line
-        line = f.readline()
-
-    return segment_id, trans_id, content
-
-def read_pick(f):
-    return tuple(f.readline().split())
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('pick_file')
+    parser.add_argument('--latts', type=str,
+                        help='text archive of lattices to index and pick from in any order; '
+                             'without it, lattices are read from stdin in the order of the picks')
 
     args = parser.parse_args()
 
-
-    tot_printed = 0
-    unserved = 0
-
     with open(args.pick_file, 'r') as p_f:
-        segment, best_trans = read_pick(p_f)
-        served = False
-
-        while True:
-            seg_id, trans_id, latt = read_latt(sys.stdin)
-            if not seg_id:
-                if p_f.readline() == '':  # both files ended
-                    break
-                else:
-                    raise ValueError("Latts file (stdin) ended sooner than picks file")
-
-            if seg_id != segment:
-                if not served:
-                    sys.stderr.write("Unserved picks of segment " + segment + ", wanted " + best_trans + "-th transcription \n")
-                    unserved += 1
-
-                segment, best_trans = read_pick(p_f)
-                served = False
-
-            if trans_id == best_trans:
-                print(segment + "\n" + latt + "\n")
-                tot_printed += 1
-                served = True
+        if args.latts:
+            unserved = pick_indexed(p_f, args.latts, sys.stdout.buffer)
+        else:
+            unserved = pick_sequential(p_f, sys.stdin, sys.stdout)
 
     if unserved > 0:
         sys.stderr.write("ERROR: Unserved " + str(unserved) + " picks \n")
@@ -1,145 +1,164 @@
 import argparse
-import torch
-import torch.nn as nn
-from torch.autograd import Variable
 
-import model
-import vocab
+from language_models import language_model
+from language_models.vocab import encode_words, vocab_from_kaldi_wordlist
+from runtime.rescoring import trie_seqs_logprob, padded_seqs_logprob, stream_rescore
+from runtime.parallel_rescoring import ParallelRescorer
 
 import kaldi_itf
 
 
-def max_len(seqs):
-    return max([len(seq) for seq in seqs])
+def tokens_to_pythlm(toks, vocab):
+    return encode_words(vocab, ['<s>'] + list(toks) + ['</s>']).tolist()
 
 
-def pick_ys(y, seq_x):
-    seqs_ys = []
-    for seq_n, seq in enumerate(seq_x):
-        seq_ys = [1.0] # hard 1.0 for the 'sure' <s>
-        for w_n, w in enumerate(seq[1:]): # skipping the initial element ^^^
-            seq_ys.append(y[w_n, seq_n, w])
-        seqs_ys.append(seq_ys)
+def dict_to_list(utts_map):
+    list_of_lists = []
+    rev_map = {}
+    for key in utts_map:
+        rev_map[len(list_of_lists)] = key
+        list_of_lists.append(utts_map[key])
 
-    return seqs_ys
+    return list_of_lists, rev_map
 
 
-def seqs_to_tensor(seqs):
-    batch_size = len(seqs)
-    maxlen = max_len(seqs)
-    ids = torch.LongTensor(batch_size, maxlen).zero_()
-    for seq_n, seq in enumerate(seqs):
-        for word_n, word in enumerate(seq):
-            ids[seq_n, word_n] = word
+def translate_latt_to_model(word_ids, latt_vocab, model_vocab):
+    words = [latt_vocab.i2w(i) for i in word_ids]
+    return tokens_to_pythlm(words, model_vocab)
 
-    # indexing is X[time][batch], thus we transpose
-    data = ids.t().contiguous()
-    return data, batch_size
 
+def read_nbest(f, latt_vocab, model_vocab):
+    for line in f:
+        fields = line.split()
+        word_ids = [int(wi) for wi in fields[1:]]
+        yield fields[0], translate_latt_to_model(word_ids, latt_vocab, model_vocab)
 
-def seqs_logprob(seqs, model):
-    ''' Sequence as a list of integers
-    '''
-    data, batch_size = seqs_to_tensor(seqs)
 
-    if args.cuda:
-        data = data.cuda()
+def write_segment_scores(segment_utts, segment, model, seqs_logprob, cuda, out_f):
+    X, rev_map = dict_to_list(segment_utts) # reform the word sequences
+    y = seqs_logprob(model, X, cuda) # score
 
-    X = Variable(data)
-    h0 = model.init_hidden(batch_size)
+    for i, log_p in enumerate(y):
+        out_f.write(segment + '-' + rev_map[i] + ' ' + str(-log_p) + '\n')
 
-    y, _ = model(X, h0)
-    y = y.data # extract the Tensor out of the Variable
 
-    word_log_scores = pick_ys(y, seqs)
-    seq_log_scores = [sum(seq) for seq in word_log_scores]
+def read_segments(hyps):
+    """ Groups consecutive hypotheses into (segment, {trans_id: ids}) pairs. """
+    curr_seg = None
+    segment_utts = {}
 
-    return seq_log_scores
+    for key, ids in hyps:
+        segment, trans_id = kaldi_itf.split_nbest_key(key)
 
+        if not curr_seg:
+            curr_seg = segment
 
-def tokens_to_pythlm(toks, vocab):
-    return [vocab.w2i('<s>')] + [vocab.w2i(tok) for tok in toks] + [vocab.w2i("</s>")]
+        if segment != curr_seg:
+            yield curr_seg, segment_utts
+            curr_seg = segment
+            segment_utts = {}
 
+        segment_utts[trans_id] = ids
 
-def dict_to_list(utts_map):
-    list_of_lists = []
-    rev_map = {}
-    for key in utts_map:
-        rev_map[len(list_of_lists)] = key
-        list_of_lists.append(utts_map[key])
+    # Last segment:
+    if segment_utts:
+        yield curr_seg, segment_utts
 
-    return list_of_lists, rev_map
 
+def rescore_by_segments(hyps, model, seqs_logprob, cuda, out_f):
+    for segment, segment_utts in read_segments(hyps):
+        write_segment_scores(segment_utts, segment, model, seqs_logprob, cuda, out_f)
+
+
+def group_segments(segments, group_size):
+    group = []
+    for segment in segments:
+        group.append(segment)
+        if len(group) == group_size:
+            yield group
+            group = []
+
+    if group:
+        yield group
 
-def translate_latt_to_model(words, latt_vocab, model_vocab):
-    words = [latt_vocab.i2w(i) for i in word_ids]
-    return tokens_to_pythlm(words, model_vocab)
-     
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='PyTorch RNN/LSTM Language Model')
     parser.add_argument('--latt-vocab', type=str, required=True,
                         help='word -> int map; Kaldi style "words.txt"')
-    parser.add_argument('--model-vocab', type=str, required=True,
-                        help='word -> int map; Kaldi style "words.txt"')
+    parser.add_argument('--model-vocab', type=str,
+                        help='word -> int map; Kaldi style "words.txt", defaults to the vocabulary of the model')
     parser.add_argument('--batch_size', type=int, default=1, metavar='N',
                         help='batch size')
     parser.add_argument('--cuda', action='store_true',
                         help='use CUDA')
     parser.add_argument('--model-from', type=str, required=True,
                         help='where to load the model from')
+    parser.add_argument('--quantize', action='store_true',
+                        help='score with int8 weights; for --jobs, save a quantized model with model_building/quantize.py instead')
+    parser.add_argument('--engine', choices=['trie', 'padded', 'bucketed'], default='trie',
+                        help='score shared prefixes of hypotheses once (trie), all hypotheses of a segment in full (padded), '
+                             'or hypotheses of many segments grouped by length (bucketed)')
+    parser.add_argument('--token-budget', type=int, default=20000, metavar='N',
+                        help='bucketed: at most N tokens, padding included, per forward pass')
+    parser.add_argument('--bucket-window', type=int, default=10000, metavar='N',
+                        help='bucketed: number of hypotheses sorted into buckets at a time')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help='score in N worker processes, sharing the memory-mapped model')
+    parser.add_argument('--segments-per-job', type=int, default=20, metavar='N',
+                        help='jobs: number of segments sent to a worker at once')
     parser.add_argument('in_filename', help='second output of nbest-to-linear, textual')
     parser.add_argument('out_filename', help='where to put the LM scores')
     args = parser.parse_args()
 
     print(args)
 
+    if args.jobs > 1 and args.cuda:
+        raise ValueError("Parallel rescoring (--jobs) works on CPU only")
+    if args.jobs > 1 and args.quantize:
+        raise ValueError("Workers of parallel rescoring (--jobs) load the model themselves, quantize it beforehand")
+
     print("reading vocabs...")
     with open(args.latt_vocab, 'r') as f:
-        latt_vocab = vocab.vocab_from_kaldi_wordlist(f, unk_word='<unk>')
-
-    with open(args.model_vocab, 'r') as f:
-        model_vocab = vocab.vocab_from_kaldi_wordlist(f)
-
-    print("reading model...")
-    with open(args.model_from, 'rb') as f:
-        model = torch.load(f)
-    if args.cuda:
-        model.cuda()
-    model.eval()
+        latt_vocab = vocab_from_kaldi_wordlist(f, unk_word='<unk>')
+
+    if args.jobs > 1:
+        # the workers load the model themselves
+        model = None
+        if not args.model_vocab:
+            model_vocab = language_model.load_vocab(args.model_from)
+    else:
+        print("reading model...")
+        with open(args.model_from, 'rb') as f:
+            lm = language_model.load(f)
+        if args.quantize:
+            lm.quantize()
+        model = lm.model
+        if args.cuda:
+            model.cuda()
+        model.eval()
+        model_vocab = lm.vocab
+
+    if args.model_vocab:
+        with open(args.model_vocab, 'r') as f:
+            model_vocab = vocab_from_kaldi_wordlist(f)
+
+    if args.engine == 'trie':
+        seqs_logprob = trie_seqs_logprob
+    else:
+        seqs_logprob = padded_seqs_logprob
 
     print("scoring...")
-    curr_seg = None
-    segment_utts = {}
-
     with open(args.in_filename) as in_f, open(args.out_filename, 'w') as out_f:
-        for line in in_f:
-            fields = line.split()
-            segment, trans_id = kaldi_itf.split_nbest_key(fields[0])
-
-            word_ids = [int(wi) for wi in fields[1:]]
-            ids = translate_latt_to_model(word_ids, latt_vocab, model_vocab)
-
-            if not curr_seg:
-                curr_seg = segment
-
-            if segment != curr_seg:
-                X, rev_map = dict_to_list(segment_utts) # reform the word sequences
-                y = seqs_logprob(X, model) # score
-
-                # write
-                for i, log_p in enumerate(y):
-                    out_f.write(curr_seg + '-' + rev_map[i] + ' ' + str(-log_p) + '\n')
-
-                curr_seg = segment
-                segment_utts = {}
-
-            segment_utts[trans_id] = ids
-
-        # Last segment:
-        X, rev_map = dict_to_list(segment_utts) # reform the word sequences
-        y = seqs_logprob(X, model) # score
-
-        # write
-        for i, log_p in enumerate(y):
-            out_f.write(curr_seg + '-' + rev_map[i] + ' ' + str(-log_p) + '\n')
+        hyps = read_nbest(in_f, latt_vocab, model_vocab)
+        if args.jobs > 1:
+            rescorer = ParallelRescorer(args.model_from, args.jobs, args.engine, args.token_budget)
+            segment_groups = group_segments(read_segments(hyps), args.segments_per_job)
+            for key, log_p in rescorer(segment_groups):
+                out_f.write(key + ' ' + str(-log_p) + '\n')
+            rescorer.report()
+        elif args.engine == 'bucketed':
+            for key, log_p in stream_rescore(model, hyps, args.token_budget, args.bucket_window, args.cuda):
+                out_f.write(key + ' ' + str(-log_p) + '\n')
+        else:
+            rescore_by_segments(hyps, model, seqs_logprob, args.cuda, out_f)
@@ -1,58 +1,65 @@
 import argparse
+import itertools
 
-import kaldi_itf
+import numpy as np
 
-def dict_argmin(dict):
-    return min(dict, key=dict.get)
+from runtime.score_combination import load_nbest_scores, best_picks
+
+
+def write_picks(nbest, picks, out_f):
+    for segment, pick in zip(nbest.segments, picks):
+        out_f.write(segment + ' ' + nbest.trans_ids[pick] + '\n')
+
+
+def weight_list(spec):
+    """ Comma separated weights, each either a number or an inclusive range start:stop:step. """
+    weights = []
+    for part in spec.split(','):
+        if ':' in part:
+            start, stop, step = [float(x) for x in part.split(':')]
+            if step <= 0:
+                raise argparse.ArgumentTypeError("step of {} has to be positive".format(part))
+            nb_steps = int(round((stop - start) / step))
+            weights.extend(start + i * step for i in range(nb_steps + 1))
+        else:
+            weights.append(float(part))
+
+    return weights
+
+
+def setting_filename(out_filename, ac_scale, gr_scale, lm_scale):
+    return '{}.ac{:g}-gr{:g}-lm{:g}'.format(out_filename, ac_scale, gr_scale, lm_scale)
 
-def write_best(scores, key, out_f):
-    best = dict_argmin(scores)
-    out_f.write(key + ' ' + best + '\n')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='PyTorch RNN/LSTM Language Model')
-    parser.add_argument('--ac-scale', type=float, default=1.0, help='weight of acoustic score')
-    parser.add_argument('--gr-scale', type=float, required=True, help='weight of graph scores')
-    parser.add_argument('--lm-scale', type=float, required=True, help='weight of rnnlm scores')
+    parser.add_argument('--ac-scale', type=weight_list, default=[1.0],
+                        help='weight of acoustic score; several as "0.1,0.2" or "0.1:1.0:0.1"')
+    parser.add_argument('--gr-scale', type=weight_list, required=True,
+                        help='weight of graph scores; several as "0.1,0.2" or "0.1:1.0:0.1"')
+    parser.add_argument('--lm-scale', type=weight_list, required=True,
+                        help='weight of rnnlm scores; several as "0.1,0.2" or "0.1:1.0:0.1"')
     parser.add_argument('acoustic_scores', help='file with acoustic scores')
     parser.add_argument('graph_scores', help='file with graph scores')
     parser.add_argument('rnnlm_scores', help='file with rnnlm scores')
-    parser.add_argument('out_filename', help='where to put the best picked transcripts')
+    parser.add_argument('out_filename', help='where to put the best picked transcripts; '
+                        'with several weight settings, one file per setting, suffixed by the weights')
     args = parser.parse_args()
 
     print(args)
 
-    curr_seg = None
-    segment_utts_scores = {}
-
     with open(args.acoustic_scores, 'r') as ac_f, \
          open(args.graph_scores, 'r') as gr_f, \
-         open(args.rnnlm_scores, 'r') as lm_f, \
-         open(args.out_filename, 'w') as out_f:
-
-        for ac_line, gr_line, lm_line in zip(ac_f, gr_f, lm_f):
-            ac_fields = ac_line.split()
-            gr_fields = gr_line.split()
-            lm_fields = lm_line.split()
-
-            assert ac_fields[0] == gr_fields[0] and gr_fields[0] == lm_fields[0]
-            segment, trans_id = kaldi_itf.split_nbest_key(ac_fields[0])
-
-            if not curr_seg:
-                curr_seg = segment
-
-            if segment != curr_seg:
-                write_best(segment_utts_scores, curr_seg, out_f)
-
-                curr_seg = segment
-                segment_utts_scores = {}
-
-            ac_s = float(ac_fields[1])
-            gr_s = float(gr_fields[1])
-            lm_s = float(lm_fields[1])
+         open(args.rnnlm_scores, 'r') as lm_f:
+        nbest = load_nbest_scores([ac_f, gr_f, lm_f])
 
-            segment_utts_scores[trans_id] = args.ac_scale * ac_s + \
-                                            args.gr_scale * gr_s + \
-                                            args.lm_scale * lm_s
+    settings = list(itertools.product(args.ac_scale, args.gr_scale, args.lm_scale))
+    picks = best_picks(nbest, np.asarray(settings))
 
-        write_best(segment_utts_scores, curr_seg, out_f)
+    if len(settings) == 1:
+        with open(args.out_filename, 'w') as out_f:
+            write_picks(nbest, picks[0], out_f)
+    else:
+        for setting, setting_picks in zip(settings, picks):
+            with open(setting_filename(args.out_filename, *setting), 'w') as out_f:
+                write_picks(nbest, setting_picks, out_f)
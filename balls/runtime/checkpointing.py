@@ -0,0 +1,126 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from language_models.language_model import checkpoint_description, checkpoint_tensors, checkpoint_vocab_bytes, write_checkpoint
+
+
+def rotated_name(path, generation):
+    return path if generation == 0 else '{}.{}'.format(path, generation)
+
+
+class AsyncCheckpointWriter():
+    def __init__(self, path, keep=1, output_file=sys.stdout):
+        """ Saves LanguageModels to `path` without blocking the training.
+
+            `save()` copies the parameters into host buffers, which are
+            allocated once (pinned for CUDA models) and reused, and writes
+            the checkpoint in a background thread. The file is written
+            aside and renamed over `path`, so `path` always holds a complete
+            model. Previous checkpoints are kept as `path.1`, ...,
+            `path.{keep-1}`.
+
+            Errors of the background write are raised by the next `save()`
+            or by `close()`, which has to be called before exiting.
+        """
+        if keep < 1:
+            raise ValueError("AsyncCheckpointWriter has to keep at least 1 checkpoint, got {}".format(keep))
+
+        self._path = path
+        self._keep = keep
+        self._of = output_file
+
+        umask = os.umask(0)
+        os.umask(umask)
+        self._file_mode = 0o666 & ~umask  # as if created by open()
+
+        self._buffers = {}
+        self._vocab_bytes = None
+        self._vocab = None
+        self._thread = None
+        self._error = None
+
+    def _wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _snapshot(self, model):
+        tensors = []
+        for name, tensor in checkpoint_tensors(model):
+            buffer = self._buffers.get(name)
+            if buffer is None or buffer.size() != tensor.size():
+                buffer = tensor.cpu().clone()
+                if tensor.is_cuda:
+                    buffer = buffer.pin_memory()
+                self._buffers[name] = buffer
+            else:
+                buffer.copy_(tensor)
+            tensors.append((name, buffer.numpy()))
+
+        return tensors
+
+    def save(self, lm):
+        self._wait()
+
+        if not lm.checkpointable():
+            start = time.time()
+            self._write_file(lm.save)
+            self._of.write("checkpoint {} saved synchronously | write {:.2f}s\n".format(
+                self._path, time.time() - start
+            ))
+            return
+
+        start = time.time()
+        if lm.vocab is not self._vocab:
+            self._vocab_bytes = checkpoint_vocab_bytes(lm.vocab)
+            self._vocab = lm.vocab
+        tensors = self._snapshot(lm.model)
+        snapshot_time = time.time() - start
+
+        description = checkpoint_description(lm.model)
+        vocab_bytes = self._vocab_bytes
+
+        def write(f):
+            write_checkpoint(f, vocab_bytes=vocab_bytes, tensors=tensors, **description)
+
+        self._thread = threading.Thread(target=self._write_in_background, args=(write, snapshot_time))
+        self._thread.start()
+
+    def _write_in_background(self, write, snapshot_time):
+        try:
+            start = time.time()
+            self._write_file(write)
+            self._of.write("checkpoint {} saved | snapshot {:.2f}s | write {:.2f}s\n".format(
+                self._path, snapshot_time, time.time() - start
+            ))
+        except Exception as e:
+            self._error = e
+
+    def _write_file(self, write):
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.checkpoint-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, self._file_mode)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        for generation in reversed(range(1, self._keep)):
+            if os.path.exists(rotated_name(self._path, generation - 1)):
+                os.replace(rotated_name(self._path, generation - 1), rotated_name(self._path, generation))
+        os.replace(tmp_path, self._path)
+
+    def close(self):
+        """ Waits for the last checkpoint to be written. """
+        self._wait()
@@ -0,0 +1,136 @@
+import mmap
+import os
+import sys
+
+import kaldi_itf
+
+
+COPY_CHUNK = 2**20
+
+
+def read_latt(f):
+    line = f.readline()
+    while line == '\n':
+        line = f.readline()
+
+    if line == '':
+       return None, None, None
+
+    segment_id, trans_id = kaldi_itf.split_nbest_key(line.strip())
+
+    content = []
+    line = f.readline()
+    while line != '\n' and line != '':
+        content.append(line)
+        line = f.readline()
+
+    return segment_id, trans_id, ''.join(content)
+
+
+def read_pick(f):
+    return tuple(f.readline().split())
+
+
+def index_latts(mm):
+    """ Maps (segment, trans_id) to the byte span of the lattice content in the archive.
+
+        Lattices are a key line followed by content lines, terminated by
+        an empty line. Only offsets are kept, the archive itself is
+        mapped and never read into memory as a whole.
+    """
+    index = {}
+    pos = 0
+    size = len(mm)
+    while pos < size:
+        if mm[pos:pos+1] == b'\n':  # empty lines between lattices
+            pos += 1
+            continue
+
+        key_end = mm.find(b'\n', pos)
+        if key_end == -1:
+            key_end = size
+        key = mm[pos:key_end].strip().decode('utf-8')
+
+        block_end = mm.find(b'\n\n', key_end)
+        content_end = size if block_end == -1 else block_end + 1
+        content_start = min(key_end + 1, content_end)
+
+        index.setdefault(kaldi_itf.split_nbest_key(key), (content_start, content_end))
+        pos = content_end
+
+    return index
+
+
+def copy_span(mm, start, end, out_f):
+    for chunk_start in range(start, end, COPY_CHUNK):
+        out_f.write(mm[chunk_start:min(chunk_start + COPY_CHUNK, end)])
+
+
+def pick_indexed(p_f, latts_filename, out_f):
+    """ Writes the picked lattices of `latts_filename` to binary `out_f`, in the order of the picks.
+
+        Picks and lattices do not need to share their order. Returns the
+        number of picks without a lattice.
+    """
+    if os.path.getsize(latts_filename) == 0:  # empty files cannot be mapped
+        mm = b''
+    else:
+        with open(latts_filename, 'rb') as l_f:
+            mm = mmap.mmap(l_f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        index = index_latts(mm)
+
+        unserved = 0
+        for line in p_f:
+            if not line.strip():
+                continue
+            segment, best_trans = line.split()
+
+            span = index.get((segment, best_trans))
+            if span is None:
+                sys.stderr.write("Unserved picks of segment " + segment + ", wanted " + best_trans + "-th transcription \n")
+                unserved += 1
+                continue
+
+            out_f.write(segment.encode('utf-8') + b'\n')
+            copy_span(mm, span[0], span[1], out_f)
+            out_f.write(b'\n\n')
+    finally:
+        if isinstance(mm, mmap.mmap):
+            mm.close()
+
+    return unserved
+
+
+def pick_sequential(p_f, latts_f, out_f):
+    """ Writes the picked lattices to text `out_f`, reading `latts_f` once.
+
+        Lattices have to come in the order of the picks. Returns the
+        number of picks without a lattice.
+    """
+    unserved = 0
+    segment, best_trans = read_pick(p_f)
+    served = False
+
+    while True:
+        seg_id, trans_id, latt = read_latt(latts_f)
+        if not seg_id:
+            if p_f.readline() == '':  # both files ended
+                break
+            else:
+                raise ValueError("Latts file (stdin) ended sooner than picks file")
+
+        if seg_id != segment:
+            if not served:
+                sys.stderr.write("Unserved picks of segment " + segment + ", wanted " + best_trans + "-th transcription \n")
+                unserved += 1
+
+            segment, best_trans = read_pick(p_f)
+            served = False
+
+        if trans_id == best_trans:
+            out_f.write(segment + "\n" + latt + "\n\n")
+            served = True
+
+    return unserved
@@ -0,0 +1,166 @@
+import collections
+import concurrent.futures
+import os
+import sys
+import time
+
+import torch
+from concurrent.futures.process import BrokenProcessPool
+
+from .rescoring import trie_seqs_logprob, padded_seqs_logprob, bucketed_seqs_logprob
+
+
+def score_segments(model, segments, engine, token_budget, cuda=False):
+    """ Scores hypotheses of segments, returns (key, log-probability) pairs in input order.
+
+        Args:
+            segments (list): (segment, {trans_id: sequence}) pairs, keys
+                are then 'segment-trans_id'.
+            engine (str): 'trie' or 'padded' score each segment on its own,
+                'bucketed' scores all hypotheses in length buckets.
+    """
+    keys = []
+    seqs = []
+    for segment, utts in segments:
+        for trans_id, seq in utts.items():
+            keys.append(segment + '-' + trans_id)
+            seqs.append(seq)
+
+    if engine == 'bucketed':
+        return list(zip(keys, bucketed_seqs_logprob(model, seqs, token_budget, cuda)))
+
+    if engine == 'trie':
+        seqs_logprob = trie_seqs_logprob
+    elif engine == 'padded':
+        seqs_logprob = padded_seqs_logprob
+    else:
+        raise ValueError("Unknown rescoring engine {}".format(engine))
+
+    scores = []
+    for segment, utts in segments:
+        scores.extend(seqs_logprob(model, list(utts.values()), cuda))
+
+    return list(zip(keys, scores))
+
+
+_worker = {}
+
+
+def _init_worker(model_fn, engine, token_budget):
+    from language_models import language_model
+
+    # mapped parameters are shared with the other workers through the page cache
+    with open(model_fn, 'rb') as f:
+        lm = language_model.load(f, mmap=True)
+    lm.model.eval()
+    torch.set_num_threads(1)
+
+    _worker['model'] = lm.model
+    _worker['engine'] = engine
+    _worker['token_budget'] = token_budget
+
+
+def _score_in_worker(segments):
+    start = time.time()
+    scores = score_segments(_worker['model'], segments, _worker['engine'], _worker['token_budget'])
+    nb_tokens = sum(len(seq) for segment, utts in segments for seq in utts.values())
+    return os.getpid(), scores, nb_tokens, time.time() - start
+
+
+class ParallelRescorer():
+    def __init__(self, model_fn, jobs, engine, token_budget, max_attempts=2, report_file=sys.stderr):
+        """ Scores groups of segments in `jobs` worker processes.
+
+            Every worker maps the model from `model_fn`. Results come in the
+            order the groups were given. If a worker dies, the pool is
+            restarted and the oldest unfinished group is scored alone,
+            before the others are resubmitted. Only crashes of a group
+            scored alone count against it; a group doing so
+            `max_attempts` times is an error.
+        """
+        if jobs <= 0:
+            raise ValueError("ParallelRescorer needs a positive number of jobs, got {}".format(jobs))
+
+        self._model_fn = model_fn
+        self._jobs = jobs
+        self._engine = engine
+        self._token_budget = token_budget
+        self._max_attempts = max_attempts
+        self._of = report_file
+
+        self._pool = None
+        self._worker_stats = collections.defaultdict(lambda: [0, 0, 0, 0.0])  # groups, hyps, tokens, seconds
+
+    def _start_pool(self):
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            self._jobs,
+            initializer=_init_worker,
+            initargs=(self._model_fn, self._engine, self._token_budget)
+        )
+
+    def _restart_pool(self):
+        self._pool.shutdown(wait=True)
+        self._start_pool()
+
+    def _score_alone(self, entry):
+        """ Scores the group of `entry` with no other work in the pool, so that a crash is its own. """
+        while True:
+            try:
+                return self._pool.submit(_score_in_worker, entry[0]).result()
+            except BrokenProcessPool:
+                entry[2] += 1
+                if entry[2] >= self._max_attempts:
+                    raise RuntimeError("Rescoring of segments starting with {} crashed {} workers".format(
+                        entry[0][0][0], entry[2]
+                    ))
+                self._of.write("WARNING: segments starting with {} crashed a worker, retrying\n".format(
+                    entry[0][0][0]
+                ))
+                self._restart_pool()
+
+    def _recover(self, pending):
+        """ Result of the oldest pending group after a worker died, other unfinished groups resubmitted. """
+        self._restart_pool()
+        result = self._score_alone(pending[0])
+        for entry in list(pending)[1:]:
+            if not entry[1].done() or entry[1].exception() is not None:
+                entry[1] = self._pool.submit(_score_in_worker, entry[0])
+        return result
+
+    def __call__(self, segment_groups):
+        """ Yields (key, log-probability) pairs of all groups, in input order. """
+        self._start_pool()
+        pending = collections.deque()  # [group, future, crashes when scored alone]
+        groups = iter(segment_groups)
+        try:
+            while True:
+                while len(pending) < 2 * self._jobs:
+                    group = next(groups, None)
+                    if group is None:
+                        break
+                    pending.append([group, self._pool.submit(_score_in_worker, group), 0])
+
+                if not pending:
+                    break
+
+                try:
+                    pid, scores, nb_tokens, elapsed = pending[0][1].result()
+                except BrokenProcessPool:
+                    self._of.write("WARNING: a rescoring worker died, restarting the pool\n")
+                    pid, scores, nb_tokens, elapsed = self._recover(pending)
+
+                pending.popleft()
+                stats = self._worker_stats[pid]
+                stats[0] += 1
+                stats[1] += len(scores)
+                stats[2] += nb_tokens
+                stats[3] += elapsed
+                yield from scores
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def report(self):
+        for pid, (nb_groups, nb_hyps, nb_tokens, elapsed) in sorted(self._worker_stats.items()):
+            self._of.write("worker {} | {} groups | {} hyps | {:.1f} hyps/s | {:.1f} tokens/s\n".format(
+                pid, nb_groups, nb_hyps, nb_hyps / max(elapsed, 1e-9), nb_tokens / max(elapsed, 1e-9)
+            ))
@@ -0,0 +1,288 @@
+import torch
+from torch.autograd import Variable
+
+from language_models.decoders import target_log_probs
+
+
+def _detach_hidden(h):
+    if isinstance(h, tuple):
+        return tuple(_detach_hidden(v) for v in h)
+    else:
+        return Variable(h.data)
+
+
+def _select_hidden(h, index):
+    """ Picks sequences `index` of a hidden state, sequences being the second dimension.
+    """
+    if isinstance(h, tuple):
+        return tuple(_select_hidden(v, index) for v in h)
+    else:
+        return Variable(h.data.index_select(1, index))
+
+
+@torch.no_grad()
+def _target_log_probs(model, X, hidden, sources, targets):
+    """ Log-probabilities of `targets` following the outputs `sources`, and the new hidden state.
+
+        Models providing `features()` never materialize the distribution
+        over all words, see `language_models.decoders.target_log_probs()`.
+        All scoring goes through here, with autograd off, so no graph is
+        recorded for the scored batches.
+
+        Args:
+            sources (LongTensor): Position of each target's output among the flattened outputs for `X`.
+            targets (LongTensor): Word indices, on the device of the model.
+    """
+    if hasattr(model, 'features'):
+        features, hidden = model.features(X, hidden)
+        features = features.view(-1, features.size(-1)).index_select(0, Variable(sources))
+        return target_log_probs(model, features, Variable(targets)).data, hidden
+
+    y, hidden = model(X, hidden)
+    positions = sources * y.size(-1) + targets
+    return y.data.view(-1).index_select(0, positions), hidden
+
+
+def check_rescoring_model(model):
+    if model.in_len != 1 or model.batch_first:
+        raise ValueError("Rescoring requires a recurrent model taking one word at a time, got {}".format(
+            model.__class__.__name__
+        ))
+
+
+class PrefixTrie():
+    def __init__(self, seqs):
+        """ Distinct prefixes of word sequences, organized by length.
+
+            A node stands for a prefix and is identified by its position
+            within its level, level d holding the prefixes of d+1 words.
+            The first word of all sequences is expected to be the same,
+            e.g. <s>, so that level 0 holds a single node.
+
+            Attributes:
+                tokens (list of LongTensor): Last word of each node, per level.
+                parents (list of LongTensor): Node in the previous level
+                    each node extends, per level; parents[0] is empty.
+                inner (list of LongTensor): Nodes extended by some other
+                    node, per level. These are the ones to run a model over.
+                inner_parents (list of LongTensor): For each inner node,
+                    position of its parent among the inner nodes of the
+                    previous level.
+                child_sources (list of LongTensor): For each node, position
+                    of its parent among the inner nodes of the previous level.
+                ends (list of (int, int)): Level and node of each sequence.
+        """
+        if len(seqs) == 0:
+            raise ValueError("PrefixTrie needs at least one sequence")
+        if len(set(seq[0] for seq in seqs)) != 1:
+            raise ValueError("All sequences of a PrefixTrie have to start with the same word")
+
+        levels = [{(None, seqs[0][0]): 0}]  # (parent, word) -> node
+        self.ends = []
+        for seq in seqs:
+            node = 0
+            for depth, word in enumerate(seq[1:], start=1):
+                if depth == len(levels):
+                    levels.append({})
+                node = levels[depth].setdefault((node, word), len(levels[depth]))
+            self.ends.append((len(seq) - 1, node))
+
+        self.tokens = []
+        self.parents = []
+        self.inner = []
+        self.inner_parents = []
+        self.child_sources = []
+
+        inner_positions = {}
+        for depth, level in enumerate(levels):
+            keys = sorted(level, key=level.get)
+            parents = [parent for parent, word in keys]
+
+            self.tokens.append(torch.LongTensor([word for parent, word in keys]))
+            self.parents.append(torch.LongTensor(parents[1:] if depth == 0 else parents))
+            self.child_sources.append(torch.LongTensor([inner_positions[p] for p in parents if p is not None]))
+
+            if depth + 1 < len(levels):
+                inner = sorted(set(parent for parent, word in levels[depth + 1]))
+            else:
+                inner = []
+            self.inner.append(torch.LongTensor(inner))
+            self.inner_parents.append(torch.LongTensor([inner_positions[parents[n]] for n in inner if depth > 0]))
+            inner_positions = {n: i for i, n in enumerate(inner)}
+
+    def nb_nodes(self):
+        return sum(len(tokens) for tokens in self.tokens)
+
+    def nb_inner_nodes(self):
+        return sum(len(inner) for inner in self.inner)
+
+
+def _to_device(tensor, cuda):
+    return tensor.cuda() if cuda else tensor
+
+
+def trie_seqs_logprob(model, seqs, cuda=False):
+    """ Log-probabilities of word sequences, computing every shared prefix once.
+
+        The model runs over the levels of a PrefixTrie, all inner nodes of
+        a level in one batch, each continuing from the hidden state of its
+        parent. The first word of each sequence is given, only the
+        following ones are scored.
+
+        Args:
+            seqs (list of list of int): Sequences, all starting with the same word.
+    """
+    check_rescoring_model(model)
+    trie = PrefixTrie(seqs)
+
+    node_scores = [torch.zeros(1)]
+    hidden = model.init_hidden(1)
+    for depth in range(len(trie.tokens) - 1):
+        if depth > 0:
+            hidden = _select_hidden(hidden, _to_device(trie.inner_parents[depth], cuda))
+
+        inputs = trie.tokens[depth].index_select(0, trie.inner[depth])
+        X = Variable(_to_device(inputs.view(1, -1), cuda))
+
+        # log-probabilities of the children, picked on the device
+        sources = _to_device(trie.child_sources[depth+1], cuda)
+        targets = _to_device(trie.tokens[depth+1], cuda)
+        log_probs, hidden = _target_log_probs(model, X, hidden, sources, targets)
+        log_probs = log_probs.cpu()
+        hidden = _detach_hidden(hidden)
+
+        parent_scores = node_scores[depth].index_select(0, trie.parents[depth+1])
+        node_scores.append(parent_scores + log_probs)
+
+    return [float(node_scores[depth][node]) for depth, node in trie.ends]
+
+
+def seqs_to_tensor(seqs):
+    """ Pads sequences into a [time, batch] LongTensor, returns it with the lengths.
+    """
+    lengths = torch.LongTensor([len(seq) for seq in seqs])
+    maxlen = int(lengths.max())
+    flat = torch.LongTensor([word for seq in seqs for word in seq])
+
+    # row-major over [batch, time], the mask takes the words sequence by sequence
+    mask = torch.arange(0, maxlen).long().view(1, -1) < lengths.view(-1, 1)
+    ids = torch.LongTensor(len(seqs), maxlen).zero_()
+    ids.masked_scatter_(mask, flat)
+
+    # indexing is X[time][batch], thus we transpose
+    return ids.t().contiguous(), lengths
+
+
+def _padded_target_logprobs(model, seqs, cuda):
+    """ [time, batch] log-probabilities of all words but the first, zero in padding.
+
+        Only the log-probabilities of the targets are picked from the
+        output, on its device, and masked by the lengths of the sequences.
+    """
+    check_rescoring_model(model)
+    data, lengths = seqs_to_tensor(seqs)
+    if data.size(0) < 2:  # nothing but the given first words
+        return torch.zeros(0, len(seqs)), lengths
+
+    # the last word of the longest sequence is never an input
+    X = Variable(_to_device(data[:-1], cuda))
+    targets = _to_device(data[1:], cuda)
+    h0 = model.init_hidden(len(seqs))
+
+    sources = _to_device(torch.arange(0, targets.numel()).long(), cuda)
+    target_log_probs, _ = _target_log_probs(model, X, h0, sources, targets.view(-1))
+    target_log_probs = target_log_probs.view(targets.size()).cpu()
+
+    nb_targets = lengths - 1
+    mask = torch.arange(0, data.size(0) - 1).long().view(-1, 1) < nb_targets.view(1, -1)
+    return target_log_probs * mask.float(), lengths
+
+
+def padded_seqs_logprob(model, seqs, cuda=False):
+    """ Log-probabilities of word sequences, running the model over all of them padded.
+    """
+    target_log_probs, _ = _padded_target_logprobs(model, seqs, cuda)
+    if target_log_probs.size(0) == 0:
+        return [0.0] * len(seqs)
+
+    return [float(log_p) for log_p in target_log_probs.sum(0)]
+
+
+def padded_word_logprobs(model, seqs, cuda=False):
+    """ Log-probabilities of each word but the first, per sequence.
+    """
+    target_log_probs, lengths = _padded_target_logprobs(model, seqs, cuda)
+    columns = target_log_probs.t().tolist()
+    return [columns[i][:length-1] if length > 1 else [] for i, length in enumerate(lengths.tolist())]
+
+
+def length_buckets(lengths, token_budget):
+    """ Groups sequences of similar length, each group padding to at most `token_budget` tokens.
+
+        Returns lists of indices into `lengths`, from the shortest sequences
+        to the longest. A sequence longer than the budget gets a group of
+        its own.
+    """
+    if token_budget <= 0:
+        raise ValueError("Token budget has to be positive, got {}".format(token_budget))
+
+    buckets = []
+    bucket = []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # sorted by length, the current sequence is the longest in the bucket
+        if bucket and (len(bucket) + 1) * lengths[i] > token_budget:
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(i)
+
+    if bucket:
+        buckets.append(bucket)
+
+    return buckets
+
+
+def _bucketed(scorer, model, seqs, token_budget, cuda):
+    scores = [None] * len(seqs)
+    for bucket in length_buckets([len(seq) for seq in seqs], token_budget):
+        bucket_scores = scorer(model, [seqs[i] for i in bucket], cuda)
+        for i, score in zip(bucket, bucket_scores):
+            scores[i] = score
+
+    return scores
+
+
+def bucketed_seqs_logprob(model, seqs, token_budget, cuda=False):
+    """ Log-probabilities of word sequences, scored in length buckets.
+
+        Results are in the order of `seqs`.
+    """
+    return _bucketed(padded_seqs_logprob, model, seqs, token_budget, cuda)
+
+
+def bucketed_word_logprobs(model, seqs, token_budget, cuda=False):
+    """ Log-probabilities of each word but the first, scored in length buckets.
+    """
+    return _bucketed(padded_word_logprobs, model, seqs, token_budget, cuda)
+
+
+def stream_rescore(model, keyed_seqs, token_budget, window, cuda=False):
+    """ Scores a stream of (key, sequence) pairs, yielding (key, log-probability) in input order.
+
+        Up to `window` sequences, regardless of their segments, are
+        collected and scored together by `bucketed_seqs_logprob()`.
+    """
+    if window <= 0:
+        raise ValueError("Rescoring window has to be positive, got {}".format(window))
+
+    keys = []
+    seqs = []
+    for key, seq in keyed_seqs:
+        keys.append(key)
+        seqs.append(seq)
+        if len(seqs) == window:
+            yield from zip(keys, bucketed_seqs_logprob(model, seqs, token_budget, cuda))
+            keys = []
+            seqs = []
+
+    if seqs:
+        yield from zip(keys, bucketed_seqs_logprob(model, seqs, token_budget, cuda))
@@ -2,6 +2,8 @@ import torch
 from torch.autograd import Variable
 import torch.nn as nn
 
+from language_models.decoders import is_factorized, target_log_probs
+
 from .runtime_utils import repackage_hidden
 from .tensor_reorganization import TensorReorganizer
 
@@ -31,9 +33,50 @@ def prepare_inputs(inputs, do_transpose, use_ivecs, custom_batches):
     return X, targets_flat, ivecs, mask, batch_size
 
 
-def evaluate_(model, data_source, use_ivecs, custom_batches):
+def _model_inputs(X, hidden, ivecs):
+    return (X, hidden) if ivecs is None else (X, hidden, ivecs)
+
+
+def targets_nll(model, X, hidden, ivecs, targets_flat):
+    """ Summed negative log-likelihood of `targets_flat` and the new hidden state.
+
+        Models with a factorized decoder only evaluate what the targets need.
+    """
+    inputs = _model_inputs(X, hidden, ivecs)
+    if is_factorized(getattr(model, 'decoder', None)):
+        features, hidden = model.features(*inputs)
+        log_probs = model.decoder.target_log_probs(features.view(-1, features.size(-1)), targets_flat)
+        return -log_probs.sum(), hidden
+
+    output, hidden = model(*inputs)
+    output_flat = output.view(-1, output.size(-1))
+    return nn.NLLLoss(size_average=False)(output_flat, targets_flat), hidden
+
+
+def targets_log_probs(model, X, hidden, ivecs, targets_flat):
+    """ Log-probabilities of `targets_flat` and the new hidden state.
+
+        Models providing `features()` never materialize the distribution
+        over all words, see `language_models.decoders.target_log_probs()`.
+    """
+    inputs = _model_inputs(X, hidden, ivecs)
+    if hasattr(model, 'features'):
+        features, hidden = model.features(*inputs)
+        return target_log_probs(model, features.view(-1, features.size(-1)), targets_flat), hidden
+
+    output, hidden = model(*inputs)
+    output_flat = output.view(-1, output.size(-1))
+    return output_flat.gather(1, targets_flat.view(-1, 1)).view(-1), hidden
+
+
+def evaluate_(model, data_source, use_ivecs, custom_batches, batch_callback=None):
+    """ Average negative log-likelihood of the targets in `data_source`.
+
+        Args:
+            batch_callback (callable): Called as batch_callback(targets, log_probs)
+                for every batch, both shaped as the targets fed to the model.
+    """
     model.eval()
-    criterion = nn.NLLLoss(size_average=False)
 
     total_loss = 0.0
     total_timesteps = 0
@@ -58,42 +101,51 @@ def evaluate_(model, data_source, use_ivecs, custom_batches):
 
         hidden = repackage_hidden(hidden)
 
-        if use_ivecs:
-            output, hidden = model(X, hidden, ivecs)
-        else:
-            output, hidden = model(X, hidden)
-        output_flat = output.view(-1, output.size(-1))
+        log_probs, hidden = targets_log_probs(model, X, hidden, ivecs, targets_flat)
 
-        total_loss += criterion(output_flat, targets_flat).data
+        total_loss -= float(log_probs.data.sum())
         total_timesteps += len(targets_flat)
 
-    return total_loss[0] / total_timesteps
+        if batch_callback is not None:
+            targets_shape = inputs[1].t().size() if do_transpose else inputs[1].size()
+            batch_callback(targets_flat.data.view(targets_shape), log_probs.data.view(targets_shape))
+
+    return total_loss / total_timesteps
 
 
-def evaluate(model, data_source, use_ivecs):
+def evaluate(model, data_source, use_ivecs, batch_callback=None):
     return evaluate_(
         model, data_source,
-        use_ivecs, custom_batches=True
+        use_ivecs, custom_batches=True,
+        batch_callback=batch_callback
     )
 
 
-def evaluate_no_transpose(model, data_source, use_ivecs):
+def evaluate_no_transpose(model, data_source, use_ivecs, batch_callback=None):
     return evaluate_(
         model, data_source,
-        use_ivecs, custom_batches=False
+        use_ivecs, custom_batches=False,
+        batch_callback=batch_callback
     )
 
 
 # TODO time X batch or vice-versa?
 
-def train_(model, data, optim, logger, clip, use_ivecs, custom_batches):
+def train_(model, data, optim, logger, clip, use_ivecs, custom_batches, hidden=None, batch_callback=None, criterion=None):
+    """ Trains `model` for one pass over `data`.
+
+        Args:
+            hidden: Hidden state to start from, e.g. of an interrupted epoch.
+            batch_callback (callable): Called as batch_callback(hidden) after every update.
+            criterion (callable): Replaces the full softmax loss, called as
+                criterion(model, features, targets_flat) on the flattened
+                `model.features()`, see `runtime.sampled_criteria`.
+    """
     model.train()
-    criterion = nn.NLLLoss()
 
     if custom_batches:
         hs_reorganizer = TensorReorganizer(model.init_hidden)
 
-    hidden = None
     do_transpose = not model.batch_first
 
     for inputs in data:
@@ -109,13 +161,12 @@ def train_(model, data, optim, logger, clip, use_ivecs, custom_batches):
             hidden = hs_reorganizer(hidden, mask, batch_size)
         hidden = repackage_hidden(hidden)
 
-        if use_ivecs:
-            output, hidden = model(X, hidden, ivecs)
+        if criterion is None:
+            loss, hidden = targets_nll(model, X, hidden, ivecs, targets_flat)
+            loss = loss / len(targets_flat)
         else:
-            output, hidden = model(X, hidden)
-        output_flat = output.view(-1, output.size(-1))
-
-        loss = criterion(output_flat, targets_flat)
+            features, hidden = model.features(*_model_inputs(X, hidden, ivecs))
+            loss = criterion(model, features.view(-1, features.size(-1)), targets_flat)
 
         optim.zero_grad()
         loss.backward()
@@ -124,16 +175,21 @@ def train_(model, data, optim, logger, clip, use_ivecs, custom_batches):
         optim.step()
         logger.log(loss.data)
 
+        if batch_callback is not None:
+            batch_callback(hidden)
+
 
-def train(model, data, optim, logger, clip, use_ivecs):
+def train(model, data, optim, logger, clip, use_ivecs, hidden=None, batch_callback=None, criterion=None):
     train_(
         model, data, optim, logger, clip,
-        use_ivecs, custom_batches=True
+        use_ivecs, custom_batches=True,
+        hidden=hidden, batch_callback=batch_callback, criterion=criterion
     )
 
 
-def train_no_transpose(model, data, optim, logger, clip, use_ivecs):
+def train_no_transpose(model, data, optim, logger, clip, use_ivecs, hidden=None, batch_callback=None, criterion=None):
     train_(
         model, data, optim, logger, clip,
-        use_ivecs, custom_batches=False
+        use_ivecs, custom_batches=False,
+        hidden=hidden, batch_callback=batch_callback, criterion=criterion
     )
@@ -1,8 +1,13 @@
+import queue
 import random
+import threading
 import torch
 
 from torch.autograd import Variable
 from data_pipeline import split_corpus_dataset
+from data_pipeline.data import tokens_from_file
+from data_pipeline.document_store import is_document_store, DocumentStore, DocumentStoreSplits
+from data_pipeline.multistream import BatchBuilder, PlannedBatchBuilder
 
 import sys
 import math
@@ -17,6 +22,80 @@ class CudaStream():
             yield tuple(x.cuda() for x in batch)
 
 
+class PrefetchingStream():
+    def __init__(self, source, depth, cuda=False):
+        """ Iterates `source` in a background thread, keeping up to `depth` batches ready.
+
+            Batches come out in the order of `source`. With `cuda`, batches
+            are pinned in the worker and copied to the device asynchronously.
+            Exceptions of the worker are re-raised in the consumer; when the
+            consumer stops early, the worker is stopped before returning.
+        """
+        if depth <= 0:
+            raise ValueError("PrefetchingStream needs a positive depth, got {}".format(depth))
+
+        self._source = source
+        self._depth = depth
+        self._cuda = cuda
+
+    def _produce(self, batches, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        outcome = ('end', None)
+        try:
+            for batch in self._source:
+                if self._cuda:
+                    # pinned blocks come from the caching host allocator of PyTorch and are
+                    # reused once their asynchronous copy is done, a pool here would duplicate it
+                    batch = tuple(x.pin_memory() for x in batch)
+                if not put(('batch', batch)):
+                    return
+        except BaseException as e:
+            outcome = ('error', e)
+        finally:
+            # whatever ends the worker, the consumer must not wait for it forever
+            put(outcome)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self._depth)
+        stop = threading.Event()
+        worker = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        worker.start()
+
+        try:
+            while True:
+                kind, item = batches.get()
+                if kind == 'end':
+                    return
+                elif kind == 'error':
+                    raise item
+
+                if self._cuda:
+                    item = tuple(x.cuda(non_blocking=True) for x in item)
+                yield item
+        finally:
+            stop.set()
+            worker.join()
+
+
+def device_stream(source, cuda, prefetch=0):
+    """ Moves batches of `source` to the GPU if requested, prefetching `prefetch` of them ahead.
+    """
+    if prefetch > 0:
+        return PrefetchingStream(source, prefetch, cuda)
+    elif cuda:
+        return CudaStream(source)
+    else:
+        return source
+
+
 class TransposeWrapper:
     def __init__(self, stream):
         self._stream = stream
@@ -57,6 +136,91 @@ def filelist_to_objects(filelist_filename, action):
     return objects
 
 
+def documents_to_objects(documents_filename, vocab, action):
+    """ Builds an object per document, from either a DocumentStore or a filelist.
+
+        For a DocumentStore, the objects are only created when accessed.
+        `action` is called as action(tokens, document_index).
+    """
+    if is_document_store(documents_filename):
+        return DocumentStoreSplits(DocumentStore(documents_filename, vocab), action)
+
+    filenames = filenames_file_to_filenames(documents_filename)
+    objects = []
+    for i, filename in enumerate(filenames):
+        with open(filename, 'r') as f:
+            objects.append(action(tokens_from_file(f, vocab, randomize=False), i))
+
+    return OrderedObjects(objects)
+
+
+class OrderedObjects():
+    def __init__(self, objects):
+        """ A list of objects, iterated in a shuffleable `order`.
+
+            Unlike shuffling the list itself, the current order can be
+            stored and restored, see `objects_order()`.
+        """
+        self._objects = objects
+        self.order = list(range(len(objects)))
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        return self._objects[self.order[i]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def shuffle(self):
+        random.shuffle(self.order)
+
+
+def shuffle_objects(objects):
+    if isinstance(objects, (DocumentStoreSplits, OrderedObjects)):
+        objects.shuffle()
+    else:
+        random.shuffle(objects)
+
+
+def objects_order(objects):
+    """ Current order of shuffleable objects, as a list of int.
+
+        Plain lists have no order apart from themselves, None is returned.
+    """
+    if isinstance(objects, (DocumentStoreSplits, OrderedObjects)):
+        return list(objects.order)
+    else:
+        return None
+
+
+def set_objects_order(objects, order):
+    if not isinstance(objects, (DocumentStoreSplits, OrderedObjects)):
+        raise ValueError("Order can only be set on DocumentStoreSplits or OrderedObjects, got {}".format(type(objects)))
+    if sorted(order) != list(range(len(objects))):
+        raise ValueError("Order is not a permutation of {} objects".format(len(objects)))
+
+    objects.order = list(order)
+
+
+def batch_temporal_splits(tss, nb_inputs_necessary, nb_targets_parallel, batch_size, discard_h, start_step=0):
+    """ Batches over documents wrapped into TemporalSplits with the given parameters.
+
+        Documents of a DocumentStore are gathered from the store directly,
+        the TemporalSplits are then never built.
+    """
+    if isinstance(tss, DocumentStoreSplits):
+        return PlannedBatchBuilder(
+            tss.store.tokens(), tss.store.offsets(),
+            nb_inputs_necessary, nb_targets_parallel,
+            batch_size, discard_h=discard_h, order=tss.order, start_step=start_step
+        )
+    else:
+        return BatchBuilder(tss, batch_size, discard_h=discard_h, start_step=start_step)
+
+
 def filenames_file_to_filenames(filelist_filename):
     with open(filelist_filename) as filelist:
         filenames = filelist.read().split()
@@ -71,6 +235,21 @@ def init_seeds(seed, cuda):
         torch.cuda.manual_seed(seed)
 
 
+class BatchCounter:
+    def __init__(self, data):
+        """ Passes batches of `data` through, counting them for resumable training. """
+        self._data = data
+        self._nb_batches_read = 0
+
+    def __iter__(self):
+        for batch in self._data:
+            self._nb_batches_read += 1
+            yield batch
+
+    def nb_batches_read(self):
+        return self._nb_batches_read
+
+
 class BatchFilter:
     def __init__(self, data, batch_size, bptt, min_batch_size):
         self._data = data
@@ -81,9 +260,11 @@ class BatchFilter:
         self._nb_skipped_updates = 0
         self._nb_skipped_words = 0
         self._nb_skipped_seqs = 0  # accumulates size of skipped batches
+        self._nb_batches_read = 0
 
     def __iter__(self):
         for batch in self._data:
+            self._nb_batches_read += 1
             X = batch[0]
             if X.size(0) >= self._min_batch_size:
                 yield batch
@@ -92,6 +273,10 @@ class BatchFilter:
                 self._nb_skipped_words += X.size(0) * X.size(1)
                 self._nb_skipped_seqs += X.size(0)
 
+    def nb_batches_read(self):
+        """ Number of batches taken from the source, including the skipped ones. """
+        return self._nb_batches_read
+
     def report(self):
         if self._nb_skipped_updates > 0:
             sys.stderr.write(
@@ -0,0 +1,119 @@
+import numpy as np
+import torch
+from torch.autograd import Variable
+import torch.nn.functional as F
+
+from language_models.decoders import output_rows
+
+
+class UnigramNoise():
+    def __init__(self, counts, power=1.0):
+        """ Noise distribution over words, proportional to counts**power.
+
+            Words never seen count as seen once, so that every target has
+            a non-zero noise probability.
+        """
+        counts = np.maximum(np.asarray(counts, dtype=np.float64), 1.0) ** power
+        probs = counts / counts.sum()
+        self.probs = torch.from_numpy(probs).float()
+        self._log_probs = torch.from_numpy(np.log(probs))
+        self._typed_log_probs = None
+
+    def sample(self, nb_samples):
+        """ Word indices drawn with replacement, as a LongTensor.
+        """
+        return torch.multinomial(self.probs, nb_samples, replacement=True)
+
+    def log_probs(self, indices):
+        """ Noise log-probabilities of `indices`, in the type of the `indices`' device.
+        """
+        # the tensor to be indexed has to live where the indices do
+        if self._typed_log_probs is None or self._typed_log_probs.is_cuda != indices.is_cuda:
+            self._typed_log_probs = self._log_probs.cuda() if indices.is_cuda else self._log_probs
+        return self._typed_log_probs.index_select(0, indices)
+
+
+class _SampledCriterion():
+    def __init__(self, noise, nb_samples):
+        if nb_samples <= 0:
+            raise ValueError("Number of noise samples has to be positive, got {}".format(nb_samples))
+        self._noise = noise
+        self._nb_samples = nb_samples
+
+    def _scores(self, model, features, targets):
+        """ Logits of the targets [N] and of the noise samples [N, S], noise log-probabilities of both.
+        """
+        samples = self._noise.sample(self._nb_samples)
+        if targets.data.is_cuda:
+            samples = samples.cuda()
+
+        indices = torch.cat([targets.data, samples])
+        weight, bias = output_rows(model, Variable(indices))
+        target_weight, sample_weight = weight[:len(targets)], weight[len(targets):]
+        target_bias, sample_bias = bias[:len(targets)], bias[len(targets):]
+
+        target_logits = (features * target_weight).sum(1) + target_bias
+        sample_logits = features.matmul(sample_weight.t()) + sample_bias.unsqueeze(0)
+
+        noise_log_probs = Variable(self._noise.log_probs(indices).type_as(features.data))
+        return (
+            target_logits, sample_logits,
+            noise_log_probs[:len(targets)], noise_log_probs[len(targets):],
+            samples,
+        )
+
+
+class SampledSoftmaxLoss(_SampledCriterion):
+    """ Importance-sampled softmax: the target competes with noise samples shared by the whole batch.
+
+        Logits are corrected by the noise log-probabilities; samples equal
+        to the target of a row are ignored in that row.
+
+        Called as criterion(model, features, targets), with [N, F] outputs
+        of `model.features()` and [N] targets, returns the mean loss.
+    """
+    def __call__(self, model, features, targets):
+        target_logits, sample_logits, target_noise, sample_noise, samples = self._scores(model, features, targets)
+
+        target_logits = target_logits - target_noise
+        sample_logits = sample_logits - sample_noise.unsqueeze(0)
+        hits = targets.data.view(-1, 1) == samples.view(1, -1)
+        sample_logits = sample_logits.masked_fill(Variable(hits), -float('inf'))
+
+        logits = torch.cat([target_logits.unsqueeze(1), sample_logits], dim=1)
+        return -F.log_softmax(logits, dim=1)[:, 0].mean()
+
+
+class NCELoss(_SampledCriterion):
+    """ Noise contrastive estimation, with noise samples shared by the whole batch.
+
+        Exponentiated logits are taken as unnormalized probabilities, the
+        model learns to discriminate the targets from `nb_samples` noise
+        words each. Called like `SampledSoftmaxLoss`.
+    """
+    def __call__(self, model, features, targets):
+        target_logits, sample_logits, target_noise, sample_noise, _ = self._scores(model, features, targets)
+
+        log_k = np.log(self._nb_samples)
+        target_scores = target_logits - (target_noise + log_k)
+        sample_scores = sample_logits - (sample_noise + log_k).unsqueeze(0)
+
+        loss = -F.logsigmoid(target_scores) - F.logsigmoid(-sample_scores).sum(1)
+        return loss.mean()
+
+
+def make_criterion(name, counts, nb_samples, power=1.0):
+    """ Training criterion for `train_()`, None for the full softmax.
+
+        Args:
+            name (str): 'full', 'sampled' or 'nce'.
+            counts (np.ndarray): Word counts of the training corpus, for the noise distribution.
+    """
+    if name == 'full':
+        return None
+    elif name == 'sampled':
+        return SampledSoftmaxLoss(UnigramNoise(counts, power), nb_samples)
+    elif name == 'nce':
+        return NCELoss(UnigramNoise(counts, power), nb_samples)
+    else:
+        raise ValueError("Unknown training criterion '{}'".format(name))
@@ -0,0 +1,113 @@
+import itertools
+
+import numpy as np
+
+import kaldi_itf
+
+
+class NbestScores():
+    def __init__(self, segments, trans_ids, offsets, scores):
+        """ Scores of n-best hypotheses, aligned across sources.
+
+            Hypotheses of segment i are the positions offsets[i]:offsets[i+1].
+
+            Args:
+                segments (list of str): Segment names.
+                trans_ids (list of str): Transcription id of each hypothesis.
+                offsets (np.ndarray): Start of each segment, followed by the total count.
+                scores (np.ndarray): [nb_sources, nb_hypotheses] scores.
+        """
+        self.segments = segments
+        self.trans_ids = trans_ids
+        self.offsets = offsets
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.trans_ids)
+
+    def nb_sources(self):
+        return self.scores.shape[0]
+
+
+def load_nbest_scores(files):
+    """ Reads '<segment>-<trans_id> <score>' lines of several files, which have to match line by line.
+    """
+    keys = None
+    columns = []
+    for f in files:
+        file_keys = []
+        values = []
+        for line in f:
+            key, value = line.split()
+            file_keys.append(key)
+            values.append(value)
+
+        if keys is None:
+            keys = file_keys
+        elif file_keys != keys:
+            mismatch = next(
+                (i for i, (a, b) in enumerate(itertools.zip_longest(keys, file_keys)) if a != b)
+            )
+            raise ValueError("Score files differ at line {}".format(mismatch + 1))
+
+        columns.append(np.asarray(values, dtype=np.float64))
+
+    segments = []
+    trans_ids = []
+    offsets = []
+    for i, key in enumerate(keys):
+        segment, trans_id = kaldi_itf.split_nbest_key(key)
+        if not segments or segment != segments[-1]:
+            segments.append(segment)
+            offsets.append(i)
+        trans_ids.append(trans_id)
+    offsets.append(len(keys))
+
+    return NbestScores(segments, trans_ids, np.asarray(offsets, dtype=np.int64), np.stack(columns))
+
+
+def segment_argmin(values, offsets):
+    """ Position of the minimum within each segment, for each row of `values`.
+
+        Ties go to the first position, as with min() over the hypotheses.
+
+        Args:
+            values (np.ndarray): [nb_rows, nb_hypotheses]
+            offsets (np.ndarray): Segment starts, followed by nb_hypotheses.
+    """
+    starts = offsets[:-1]
+    minima = np.minimum.reduceat(values, starts, axis=1)
+    lengths = np.diff(offsets)
+    is_minimum = values == np.repeat(minima, lengths, axis=1)
+
+    positions = np.where(is_minimum, np.arange(values.shape[1]), values.shape[1])
+    return np.minimum.reduceat(positions, starts, axis=1)
+
+
+def best_picks(nbest, weights, max_elements=2**26):
+    """ Best hypothesis of each segment, for each weight setting.
+
+        Args:
+            weights (np.ndarray): [nb_settings, nb_sources] weights of the scores.
+            max_elements (int): Bound on the size of a combined [settings, hypotheses] block.
+
+        Returns:
+            np.ndarray: [nb_settings, nb_segments] positions of the picked hypotheses.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.ndim != 2 or weights.shape[1] != nbest.nb_sources():
+        raise ValueError("Weights have to be [nb_settings, {}], got {}".format(nbest.nb_sources(), weights.shape))
+
+    picks = np.empty((len(weights), len(nbest.segments)), dtype=np.int64)
+    if len(nbest) == 0:
+        return picks
+
+    chunk = max(1, max_elements // len(nbest))
+    for start in range(0, len(weights), chunk):
+        w = weights[start:start+chunk]
+        combined = w[:, 0:1] * nbest.scores[0]
+        for source in range(1, nbest.nb_sources()):
+            combined = combined + w[:, source:source+1] * nbest.scores[source]
+        picks[start:start+chunk] = segment_argmin(combined, nbest.offsets)
+
+    return picks
@@ -0,0 +1,281 @@
+import http.server
+import json
+import os
+import queue
+import socketserver
+import stat
+import threading
+import time
+
+from language_models.decoders import model_ntoken
+from language_models.vocab import encode_words
+
+from .rescoring import bucketed_word_logprobs, check_rescoring_model
+
+
+class ScoringRequest():
+    def __init__(self, seqs):
+        self.seqs = seqs
+        self.arrival = time.time()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class DynamicBatcher():
+    def __init__(self, model, max_batch_size=256, max_latency=0.01, token_budget=20000, cuda=False):
+        """ Scores word sequences of concurrent requests together.
+
+            Requests are queued and a single thread runs the model. A batch
+            starts with the oldest waiting request and takes further ones
+            until it holds `max_batch_size` sequences or the oldest request
+            has waited `max_latency` seconds. Sequences of a batch are then
+            scored in length buckets of at most `token_budget` tokens.
+        """
+        if max_batch_size <= 0:
+            raise ValueError("DynamicBatcher needs a positive batch size, got {}".format(max_batch_size))
+        check_rescoring_model(model)
+
+        self._model = model
+        self.ntoken = model_ntoken(model)
+        self._max_bsz = max_batch_size
+        self._max_latency = max_latency
+        self._token_budget = token_budget
+        self._cuda = cuda
+
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+
+        self._metrics_lock = threading.Lock()
+        self._nb_requests = 0
+        self._nb_batches = 0
+        self._nb_seqs = 0
+        self._max_batch_seqs = 0
+        self._total_wait = 0.0
+        self._total_scoring = 0.0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def score(self, seqs):
+        """ Per-word log-probabilities of `seqs`, all words but the first being scored.
+
+            Blocks until the batch holding the request is scored.
+        """
+        request = ScoringRequest(seqs)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+
+        return request.result
+
+    def _next_batch(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        nb_seqs = len(first.seqs)
+        deadline = first.arrival + self._max_latency
+        while nb_seqs < self._max_bsz:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    request = self._queue.get(timeout=remaining)
+                else:
+                    request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            nb_seqs += len(request.seqs)
+
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._score_batch(batch)
+
+    def _score_batch(self, batch):
+        start = time.time()
+        seqs = [seq for request in batch for seq in request.seqs]
+        try:
+            word_log_probs = bucketed_word_logprobs(self._model, seqs, self._token_budget, self._cuda)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+
+        with self._metrics_lock:
+            self._nb_requests += len(batch)
+            self._nb_batches += 1
+            self._nb_seqs += len(seqs)
+            self._max_batch_seqs = max(self._max_batch_seqs, len(seqs))
+            self._total_wait += sum(start - request.arrival for request in batch)
+            self._total_scoring += time.time() - start
+
+        position = 0
+        for request in batch:
+            request.result = word_log_probs[position:position + len(request.seqs)]
+            position += len(request.seqs)
+            request.done.set()
+
+    def metrics(self):
+        with self._metrics_lock:
+            nb_batches = max(self._nb_batches, 1)
+            return {
+                'queue_depth': self._queue.qsize(),
+                'requests': self._nb_requests,
+                'batches': self._nb_batches,
+                'sequences': self._nb_seqs,
+                'mean_batch_size': self._nb_seqs / nb_batches,
+                'max_batch_size': self._max_batch_seqs,
+                'mean_requests_per_batch': self._nb_requests / nb_batches,
+                'mean_queue_wait': self._total_wait / max(self._nb_requests, 1),
+                'mean_batch_time': self._total_scoring / nb_batches,
+            }
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class ScoringHandler(http.server.BaseHTTPRequestHandler):
+    """ POST /score with {"sequences": [[int]]} or {"sentences": [str]}, optionally "per_word": true.
+        GET /metrics.
+
+        Sentences are split on whitespace, mapped through the vocabulary
+        and wrapped into <s> and </s>. Sequences are taken as they are,
+        their first word being given and not scored.
+    """
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, code, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply(200, self.server.batcher.metrics())
+        else:
+            self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            seqs = self.server.request_seqs(request)
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+            return
+
+        try:
+            word_log_probs = self.server.batcher.score(seqs)
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+            return
+
+        response = {'log_probs': [sum(seq) for seq in word_log_probs]}
+        if request.get('per_word', False):
+            response['word_log_probs'] = word_log_probs
+        self._reply(200, response)
+
+
+class _ScoringServerMixin():
+    daemon_threads = True
+
+    def setup_scoring(self, batcher, vocab, verbose):
+        self.batcher = batcher
+        self.vocab = vocab
+        self.verbose = verbose
+        self._ntoken = batcher.ntoken
+
+    def request_seqs(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("request has to be a JSON object")
+
+        if 'sentences' in request:
+            if not isinstance(request['sentences'], list):
+                raise ValueError("sentences have to be a list")
+            if any(not isinstance(sentence, str) for sentence in request['sentences']):
+                raise ValueError("sentences have to be strings")
+            seqs = [
+                encode_words(self.vocab, ['<s>'] + sentence.split() + ['</s>']).tolist()
+                for sentence in request['sentences']
+            ]
+        elif 'sequences' in request:
+            seqs = request['sequences']
+            if not isinstance(seqs, list):
+                raise ValueError("sequences have to be a list")
+            for seq in seqs:
+                if not isinstance(seq, list):
+                    raise ValueError("sequences have to be lists of word indices")
+                if len(seq) == 0:
+                    raise ValueError("sequences must not be empty")
+                # JSON true/false arrive as bool, a subclass of int
+                if any(not isinstance(w, int) or isinstance(w, bool) or w < 0 or w >= self._ntoken for w in seq):
+                    raise ValueError("sequences have to consist of word indices below {}".format(self._ntoken))
+        else:
+            raise ValueError("request needs 'sentences' or 'sequences'")
+
+        if len(seqs) == 0:
+            raise ValueError("nothing to score")
+
+        return seqs
+
+
+class TCPScoringServer(_ScoringServerMixin, socketserver.ThreadingMixIn, http.server.HTTPServer):
+    pass
+
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+class UnixScoringServer(_ScoringServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    def server_bind(self):
+        # a socket left by a previous server is replaced, anything else is not ours to remove
+        if _is_socket(self.server_address):
+            os.remove(self.server_address)
+        elif os.path.lexists(self.server_address):
+            raise ValueError("{} exists and is not a socket".format(self.server_address))
+        socketserver.UnixStreamServer.server_bind(self)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if _is_socket(self.server_address):
+            os.remove(self.server_address)
+
+
+def make_scoring_server(address, batcher, vocab, verbose=False):
+    """ HTTP server scoring through `batcher`.
+
+        Args:
+            address: (host, port) to listen on, or a path for a Unix socket.
+    """
+    if isinstance(address, str):
+        server = UnixScoringServer(address, ScoringHandler)
+    else:
+        server = TCPScoringServer(address, ScoringHandler)
+    server.setup_scoring(batcher, vocab, verbose)
+    return server
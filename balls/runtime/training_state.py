@@ -0,0 +1,156 @@
+import os
+import random
+import tempfile
+
+import torch
+from torch.autograd import Variable
+
+
+TRAINING_STATE_VERSION = 1
+
+
+class TrainingState():
+    def __init__(self, epoch, lr, best_val_loss,
+                 nb_batches_done=0, data_order=None, hidden=None, optimizer_state=None):
+        """ Where an interrupted training stopped, see `save_training_state()`.
+
+            Args:
+                epoch (int): Epoch to continue with.
+                nb_batches_done (int): Number of batches of `epoch` already
+                    trained on, as taken from the batch builder.
+                data_order (list of int): Order of the training documents in `epoch`.
+                hidden: Hidden state after the last batch trained on.
+        """
+        self.epoch = epoch
+        self.lr = lr
+        self.best_val_loss = best_val_loss
+        self.nb_batches_done = nb_batches_done
+        self.data_order = data_order
+        self.hidden = hidden
+        self.optimizer_state = optimizer_state
+
+    def restore_optimizer(self, optim):
+        if self.optimizer_state is not None:
+            optim.load_state_dict(self.optimizer_state)
+
+
+def rng_states():
+    states = {
+        'python': random.getstate(),
+        'torch': torch.get_rng_state(),
+        'cuda': None,
+    }
+    if torch.cuda.is_available():
+        states['cuda'] = torch.cuda.get_rng_state_all()
+
+    return states
+
+
+def set_rng_states(states):
+    random.setstate(states['python'])
+    torch.set_rng_state(states['torch'])
+    if states['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states['cuda'])
+
+
+def _map_hidden(h, fn):
+    if h is None:
+        return None
+    elif isinstance(h, (tuple, list)):
+        return tuple(_map_hidden(v, fn) for v in h)
+    else:
+        return fn(h)
+
+
+def _hidden_to_cpu(h):
+    if isinstance(h, Variable):
+        h = h.data
+    return h.cpu().clone()
+
+
+def save_training_state(fn, model, optim, epoch, lr, best_val_loss,
+                        nb_batches_done=0, data_order=None, hidden=None):
+    """ Stores everything needed to continue training `model` from this very point.
+
+        Next to the parameters of the model, the state holds the optimizer,
+        the learning rate schedule, the position within the epoch and the
+        states of all random generators. The file is written aside and
+        renamed over `fn`, so a kill never leaves a partial state behind.
+    """
+    state = {
+        'version': TRAINING_STATE_VERSION,
+        'model': {name: t.cpu().clone() for name, t in model.state_dict().items()},
+        'optimizer': optim.state_dict(),
+        'epoch': epoch,
+        'lr': lr,
+        'best_val_loss': None if best_val_loss is None else float(best_val_loss),
+        'nb_batches_done': nb_batches_done,
+        'data_order': data_order,
+        'hidden': _map_hidden(hidden, _hidden_to_cpu),
+        'rng': rng_states(),
+    }
+
+    directory = os.path.dirname(os.path.abspath(fn))
+    fd, tmp_fn = tempfile.mkstemp(dir=directory, prefix='.training-state-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp_fn)
+        raise
+    os.replace(tmp_fn, fn)
+
+
+def load_training_state(fn, model):
+    """ Restores `model` and the random generators, returns the TrainingState.
+
+        The hidden state is placed on the device of `model`.
+    """
+    with open(fn, 'rb') as f:
+        state = torch.load(f)
+
+    if state['version'] > TRAINING_STATE_VERSION:
+        raise ValueError("Training state {} has version {}, newest supported is {}".format(
+            fn, state['version'], TRAINING_STATE_VERSION
+        ))
+
+    model.load_state_dict(state['model'])
+    set_rng_states(state['rng'])
+
+    cuda = next(model.parameters()).is_cuda
+    hidden = _map_hidden(state['hidden'], lambda h: Variable(h.cuda() if cuda else h))
+
+    return TrainingState(
+        state['epoch'], state['lr'], state['best_val_loss'],
+        nb_batches_done=state['nb_batches_done'],
+        data_order=state['data_order'],
+        hidden=hidden,
+        optimizer_state=state['optimizer'],
+    )
+
+
+def periodic_state_saver(fn, interval, position, model, optim, **state):
+    """ Builds a `batch_callback` for `train_()`, saving the state every `interval` updates.
+
+        Args:
+            position (callable): Returns the number of batches of the epoch
+                done so far, as counted by the batch builder.
+            state: Remaining arguments of `save_training_state()`.
+    """
+    if interval <= 0:
+        raise ValueError("Training state has to be saved in a positive interval, got {}".format(interval))
+
+    nb_updates = 0
+
+    def batch_callback(hidden):
+        nonlocal nb_updates
+        nb_updates += 1
+        if nb_updates % interval == 0:
+            save_training_state(
+                fn, model, optim,
+                nb_batches_done=position(), hidden=hidden, **state
+            )
+
+    return batch_callback
@@ -0,0 +1,42 @@
+import argparse
+
+from data_pipeline.data import compile_corpus
+from language_models import language_model, vocab
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Translates a text corpus into a memory-mappable binary file of token indices')
+    parser.add_argument('--corpus', type=str, required=True,
+                        help='text corpus to compile')
+    parser.add_argument('--load', type=str,
+                        help='take the vocabulary from this language model')
+    parser.add_argument('--wordlist', type=str,
+                        help='take the vocabulary from this Kaldi style "words.txt"')
+    parser.add_argument('--unk', type=str, default="<unk>",
+                        help='expected form of "unk" word. Most likely a <UNK> or <unk>')
+    parser.add_argument('--characters', action='store_true',
+                        help='work on character level, whitespace is significant')
+    parser.add_argument('--save', type=str, required=True,
+                        help='where to put the compiled corpus')
+    args = parser.parse_args()
+    print(args)
+
+    if (args.load is None) == (args.wordlist is None):
+        parser.error("exactly one of --load and --wordlist has to be given")
+
+    print("loading vocabulary...")
+    if args.load:
+        with open(args.load, 'rb') as f:
+            corpus_vocab = language_model.load(f).vocab
+    else:
+        with open(args.wordlist, 'r') as f:
+            corpus_vocab = vocab.vocab_from_kaldi_wordlist(f, args.unk)
+
+    tokenize_regime = 'words'
+    if args.characters:
+        tokenize_regime = 'chars'
+
+    print("compiling corpus...")
+    with open(args.corpus, 'r') as f, open(args.save, 'wb') as out_f:
+        nb_tokens = compile_corpus(f, corpus_vocab, out_f, regime=tokenize_regime)
+    print("{} tokens written".format(nb_tokens))
@@ -0,0 +1,27 @@
+import argparse
+
+from data_pipeline.document_store import compile_document_store
+from language_models import language_model
+from runtime.runtime_utils import filenames_file_to_filenames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Packs a list of documents into a single memory-mappable document store')
+    parser.add_argument('--file-list', type=str, required=True,
+                        help='file with paths to documents')
+    parser.add_argument('--load', type=str, required=True,
+                        help='take the vocabulary from this language model')
+    parser.add_argument('--save', type=str, required=True,
+                        help='where to put the document store')
+    args = parser.parse_args()
+    print(args)
+
+    print("loading vocabulary...")
+    with open(args.load, 'rb') as f:
+        vocab = language_model.load(f).vocab
+
+    print("packing documents...")
+    filenames = filenames_file_to_filenames(args.file_list)
+    with open(args.save, 'wb') as out_f:
+        compile_document_store(filenames, vocab, out_f)
+    print("{} documents written".format(len(filenames)))
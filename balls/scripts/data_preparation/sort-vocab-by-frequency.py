@@ -0,0 +1,45 @@
+import argparse
+
+from data_pipeline.data import tokens_from_fn, remap_compiled_corpus
+from language_models import vocab
+from language_models.decoders import unigram_counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Renumbers a vocabulary by decreasing word frequency, for adaptive and class-based softmax')
+    parser.add_argument('--wordlist', type=str, required=True,
+                        help='word -> int map; Kaldi style "words.txt"')
+    parser.add_argument('--unk', type=str, default="<unk>",
+                        help='expected form of "unk" word. Most likely a <UNK> or <unk>')
+    parser.add_argument('--corpus', type=str, required=True,
+                        help='text or compiled corpus to count the words in')
+    parser.add_argument('--save-wordlist', type=str, required=True,
+                        help='where to put the renumbered "words.txt", to build models with')
+    parser.add_argument('--save-remapping', type=str, required=True,
+                        help='where to put "old new" index pairs, to translate indices in either direction')
+    parser.add_argument('--remap-corpus', type=str, nargs=2, action='append', default=[], metavar=('IN', 'OUT'),
+                        help='translate a corpus compiled with --wordlist; can be repeated')
+    args = parser.parse_args()
+    print(args)
+
+    print("loading vocabulary...")
+    with open(args.wordlist, 'r') as f:
+        old_vocab = vocab.vocab_from_kaldi_wordlist(f, args.unk)
+
+    print("counting words...")
+    tokens = tokens_from_fn(args.corpus, old_vocab, randomize=False)
+    counts = unigram_counts(tokens, max(old_vocab[w] for w in old_vocab) + 1)
+
+    remapping = vocab.VocabularyRemapping.by_frequency(old_vocab, counts)
+    new_vocab = remapping.remap_vocab(old_vocab)
+    with open(args.save_wordlist, 'w') as f:
+        vocab.write_kaldi_wordlist(new_vocab, f)
+    with open(args.save_remapping, 'w') as f:
+        remapping.save(f)
+    print("{} words renumbered, {} of them seen".format(len(new_vocab), int((counts > 0).sum())))
+
+    for in_fn, out_fn in args.remap_corpus:
+        print("remapping {}...".format(in_fn))
+        with open(out_fn, 'wb') as out_f:
+            nb_tokens = remap_compiled_corpus(in_fn, old_vocab, remapping, out_f)
+        print("{} tokens written".format(nb_tokens))
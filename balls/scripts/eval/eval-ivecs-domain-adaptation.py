@@ -6,6 +6,7 @@ from smm_itf import ivec_appenders
 from data_pipeline.split_corpus_dataset import DomainAdaptationSplitFFMultiTarget
 from data_pipeline.multistream import BatchBuilder
 from smm_itf import smm_ivec_extractor
+from smm_itf.ivec_cache import IvecCache
 
 from runtime.runtime_utils import CudaStream, filelist_to_objects, init_seeds
 from runtime.runtime_multifile import evaluate_
@@ -33,6 +34,10 @@ if __name__ == '__main__':
                         help='where to load a ivector extractor from')
     parser.add_argument('--ivec-nb-iters', type=int,
                         help='override the number of iterations when extracting ivectors')
+    parser.add_argument('--ivec-cache', type=str,
+                        help='directory to cache extracted ivectors in')
+    parser.add_argument('--ivec-cache-size', type=int, default=4096, metavar='MB',
+                        help='size limit of the ivector cache')
     args = parser.parse_args()
     print(args)
 
@@ -50,18 +55,20 @@ if __name__ == '__main__':
         ivec_extractor = smm_ivec_extractor.load(f)
     if args.ivec_nb_iters is not None:
         ivec_extractor._nb_iters = args.ivec_nb_iters
+    if args.ivec_cache:
+        ivec_extractor = IvecCache(args.ivec_cache, ivec_extractor, max_bytes=args.ivec_cache_size * 2**20)
     print(ivec_extractor)
 
     print("preparing data...")
 
-    def ivec_ts_from_file(f):
-        da_ts = DomainAdaptationSplitFFMultiTarget(
+    def da_ts_from_file(f):
+        return DomainAdaptationSplitFFMultiTarget(
             f, lm.vocab, lm.model.in_len,
             args.target_seq_len, end_portion=args.domain_portion,
         )
-        return ivec_appenders.CheatingIvecAppender(da_ts, ivec_extractor)
 
-    tss = filelist_to_objects(args.file_list, ivec_ts_from_file)
+    da_tss = filelist_to_objects(args.file_list, da_ts_from_file)
+    tss = ivec_appenders.cheating_ivec_appenders(da_tss, ivec_extractor)
     data = BatchBuilder(tss, args.batch_size,
                         discard_h=not args.concat_articles)
     if args.cuda:
@@ -5,6 +5,7 @@ from data_pipeline.split_corpus_dataset import TokenizedSplitFFBase
 from language_models import language_model
 from smm_itf import  ivec_appenders
 from smm_itf import  smm_ivec_extractor
+from smm_itf.ivec_cache import IvecCache
 from data_pipeline.multistream import BatchBuilder
 from data_pipeline.temporal_splitting import TemporalSplits
 
@@ -32,6 +33,10 @@ if __name__ == '__main__':
                         help='where to load a ivector extractor from')
     parser.add_argument('--ivec-nb-iters', type=int,
                         help='override the number of iterations when extracting ivectors')
+    parser.add_argument('--ivec-cache', type=str,
+                        help='directory to cache extracted ivectors in')
+    parser.add_argument('--ivec-cache-size', type=int, default=4096, metavar='MB',
+                        help='size limit of the ivector cache')
     args = parser.parse_args()
     print(args)
 
@@ -49,18 +54,20 @@ if __name__ == '__main__':
         ivec_extractor = smm_ivec_extractor.load(f)
     if args.ivec_nb_iters:
         ivec_extractor._nb_iters = args.ivec_nb_iters
+    if args.ivec_cache:
+        ivec_extractor = IvecCache(args.ivec_cache, ivec_extractor, max_bytes=args.ivec_cache_size * 2**20)
     print(ivec_extractor)
 
     print("preparing data...")
 
-    def ivec_ts_from_file(f):
-        ts = TokenizedSplitFFBase(
+    def ts_from_file(f):
+        return TokenizedSplitFFBase(
             f, lm.vocab,
             lambda seq: TemporalSplits(seq, lm.model.in_len, args.target_seq_len)
         )
-        return ivec_appenders.CheatingIvecAppender(ts, ivec_extractor)
 
-    data_ivecs = filelist_to_objects(args.file_list, ivec_ts_from_file)
+    tss = filelist_to_objects(args.file_list, ts_from_file)
+    data_ivecs = ivec_appenders.cheating_ivec_appenders(tss, ivec_extractor)
     data = BatchBuilder(
         data_ivecs,
         args.batch_size,
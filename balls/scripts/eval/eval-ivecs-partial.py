@@ -32,6 +32,8 @@ if __name__ == '__main__':
                         help='where to load a ivector extractor from')
     parser.add_argument('--ivec-nb-iters', type=int,
                         help='override the number of iterations when extracting ivectors')
+    parser.add_argument('--ivec-refinement-iters', type=int,
+                        help='refine ivectors of the previous batch by this many iterations instead of extracting them anew')
     args = parser.parse_args()
     print(args)
 
@@ -65,7 +67,8 @@ if __name__ == '__main__':
     if args.cuda:
         data = CudaStream(data)
     data_ivecs = ivec_appenders.ParalelIvecAppender(
-        data, ivec_extractor, ivec_extractor.build_translator(lm.vocab)
+        data, ivec_extractor, ivec_extractor.build_translator(lm.vocab),
+        refinement_iters=args.ivec_refinement_iters
     )
 
     print("evaluating...")
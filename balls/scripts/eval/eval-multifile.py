@@ -2,18 +2,16 @@ import argparse
 import math
 
 from language_models import language_model
-from data_pipeline.multistream import BatchBuilder
 
-from data_pipeline.data import tokens_from_file
 from data_pipeline.temporal_splitting import TemporalSplits
-from runtime.runtime_utils import CudaStream, init_seeds, filelist_to_objects
+from runtime.runtime_utils import CudaStream, init_seeds, documents_to_objects, batch_temporal_splits
 from runtime.runtime_multifile import evaluate
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='PyTorch RNN/LSTM Language Model')
     parser.add_argument('--file-list', type=str, required=True,
-                        help='file with paths to training documents')
+                        help='file with paths to evaluation documents, or a compiled document store')
     parser.add_argument('--batch-size', type=int, default=20, metavar='N',
                         help='batch size')
     parser.add_argument('--target-seq-len', type=int, default=35,
@@ -26,6 +24,8 @@ if __name__ == '__main__':
                         help='pass hidden states over article boundaries')
     parser.add_argument('--load', type=str, required=True,
                         help='where to load a model from')
+    parser.add_argument('--quantize', action='store_true',
+                        help='evaluate with int8 weights, see model_building/quantize.py')
     args = parser.parse_args()
     print(args)
 
@@ -34,19 +34,22 @@ if __name__ == '__main__':
     print("loading model...")
     with open(args.load, 'rb') as f:
         lm = language_model.load(f)
+    if args.quantize:
+        lm.quantize()
     if args.cuda:
         lm.model.cuda()
     print(lm.model)
 
     print("preparing data...")
 
-    def temp_splits_from_fn(fn):
-        tokens = tokens_from_file(fn, lm.vocab, randomize=False)
+    def temp_splits_from_tokens(tokens, doc_index):
         return TemporalSplits(tokens, lm.model.in_len, args.target_seq_len)
 
-    tss = filelist_to_objects(args.file_list, temp_splits_from_fn)
-    data = BatchBuilder(tss, args.batch_size,
-                        discard_h=not args.concat_articles)
+    tss = documents_to_objects(args.file_list, lm.vocab, temp_splits_from_tokens)
+    data = batch_temporal_splits(
+        tss, lm.model.in_len, args.target_seq_len,
+        args.batch_size, discard_h=not args.concat_articles
+    )
     if args.cuda:
         data = CudaStream(data)
 
@@ -31,6 +31,10 @@ if __name__ == '__main__':
                         help='use CUDA')
     parser.add_argument('--load', type=str, required=True,
                         help='where to load a model from')
+    parser.add_argument('--quantize', action='store_true',
+                        help='evaluate with int8 weights, see model_building/quantize.py')
+    parser.add_argument('--token-scores', type=str,
+                        help='write "word log-probability" of every scored token, in corpus order')
     args = parser.parse_args()
     print(args)
 
@@ -39,6 +43,8 @@ if __name__ == '__main__':
     print("loading model...")
     with open(args.load, 'rb') as f:
         lm = language_model.load(f)
+    if args.quantize:
+        lm.quantize()
     if args.cuda:
         lm.model.cuda()
     print(lm.model)
@@ -53,10 +59,28 @@ if __name__ == '__main__':
     )
     data = TransposeWrapper(data_tb)
 
+    batch_scores = []
+
+    def keep_scores(targets, log_probs):
+        batch_scores.append((targets.cpu(), log_probs.cpu()))
+
     # Run on test data.
     loss = evaluate_(
         lm.model, data,
         use_ivecs=False,
         custom_batches=False,
+        batch_callback=keep_scores if args.token_scores else None
     )
     print('loss {:5.2f} | ppl {:8.2f}'.format(loss, math.exp(loss)))
+
+    if args.token_scores:
+        # each batch column is a continuous part of the corpus
+        time_dim = 1 if lm.model.batch_first else 0
+        targets = torch.cat([t for t, _ in batch_scores], dim=time_dim)
+        log_probs = torch.cat([lp for _, lp in batch_scores], dim=time_dim)
+        if not lm.model.batch_first:
+            targets, log_probs = targets.t(), log_probs.t()
+
+        with open(args.token_scores, 'w') as f:
+            for w, log_p in zip(targets.contiguous().view(-1).tolist(), log_probs.contiguous().view(-1).tolist()):
+                f.write('{} {}\n'.format(lm.vocab.i2w(w), log_p))
@@ -0,0 +1,52 @@
+import argparse
+
+from language_models import language_model
+from runtime.scoring_server import DynamicBatcher, make_scoring_server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve log-probabilities of a language model over HTTP')
+    parser.add_argument('--load', type=str, required=True,
+                        help='where to load a model from')
+    parser.add_argument('--cuda', action='store_true',
+                        help='use CUDA')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('--port', type=int, default=8470,
+                        help='port to listen on')
+    parser.add_argument('--unix-socket', type=str,
+                        help='listen on a Unix socket at this path instead of TCP')
+    parser.add_argument('--max-batch-size', type=int, default=256, metavar='N',
+                        help='sequences of concurrent requests scored together at most')
+    parser.add_argument('--max-latency', type=float, default=10.0, metavar='MS',
+                        help='longest time a request waits for others to join its batch')
+    parser.add_argument('--token-budget', type=int, default=20000, metavar='N',
+                        help='at most N tokens, padding included, per forward pass')
+    parser.add_argument('--verbose', action='store_true',
+                        help='log every request')
+    args = parser.parse_args()
+    print(args)
+
+    print("loading model...")
+    with open(args.load, 'rb') as f:
+        lm = language_model.load(f)
+    if args.cuda:
+        lm.model.cuda()
+    lm.model.eval()
+    print(lm.model)
+
+    batcher = DynamicBatcher(
+        lm.model, args.max_batch_size, args.max_latency / 1000.0,
+        args.token_budget, args.cuda
+    )
+    address = args.unix_socket if args.unix_socket else (args.host, args.port)
+    server = make_scoring_server(address, batcher, lm.vocab, args.verbose)
+
+    print("serving on {}...".format(address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
@@ -0,0 +1,31 @@
+import argparse
+
+from language_models import language_model
+from smm_itf import smm_ivec_extractor
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stores the LM -> SMM vocabulary translation inside an ivector extractor')
+    parser.add_argument('--ivec-extractor', type=str, required=True,
+                        help='ivector extractor to extend')
+    parser.add_argument('--load', type=str, required=True,
+                        help='take the vocabulary from this language model')
+    parser.add_argument('--save', type=str, required=True,
+                        help='where to put the extended ivector extractor')
+    args = parser.parse_args()
+    print(args)
+
+    print("loading vocabulary...")
+    with open(args.load, 'rb') as f:
+        vocab = language_model.load(f).vocab
+
+    print("loading SMM iVector extractor ...")
+    with open(args.ivec_extractor, 'rb') as f:
+        ivec_extractor = smm_ivec_extractor.load(f)
+
+    print("computing translation...")
+    table, mask = ivec_extractor.translation_table(vocab)
+    print("{} out of {} words translated".format(int((mask == 0).sum()), len(vocab)))
+
+    with open(args.save, 'wb') as f:
+        ivec_extractor.save(f)
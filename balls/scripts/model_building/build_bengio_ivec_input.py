@@ -5,7 +5,9 @@ import torch
 import sys
 sys.path.insert(0, '/homes/kazi/ibenes/PhD/pyth-lm/')
 
+from data_pipeline.data import tokens_from_fn
 from language_models import language_model, vocab, ffnn_models
+from language_models.decoders import bin_classes_by_frequency, model_ntoken
 
 
 if __name__ == '__main__':
@@ -26,6 +28,11 @@ if __name__ == '__main__':
                         help='dropout applied to layers (0 = no dropout)')
     parser.add_argument('--tied', action='store_true',
                         help='tie the word embedding and softmax weights')
+    parser.add_argument('--decoder', type=str, default='full',
+                        help='output layer; "full" softmax, "class:N" for a two-level softmax with N classes, or "adaptive:C1,C2,..." '
+                             'for an adaptive softmax with cutoffs C1, C2, ..., which expects a frequency-sorted wordlist')
+    parser.add_argument('--class-corpus', type=str,
+                        help='corpus to bin words into classes by frequency; consecutive indices form classes otherwise')
     parser.add_argument('--seed', type=int, default=1111,
                         help='random seed')
     parser.add_argument('--save', type=str, required=True,
@@ -43,9 +50,15 @@ if __name__ == '__main__':
 
     model = ffnn_models.BengioModelIvecInput(
         len(vocab), args.emsize, args.hist_len,
-        args.nhid, args.dropout, args.ivec_dim
+        args.nhid, args.dropout, args.ivec_dim,
+        decoder=args.decoder,
     )
 
+    if args.class_corpus:
+        print("binning words by frequency...")
+        tokens = tokens_from_fn(args.class_corpus, vocab, randomize=False)
+        bin_classes_by_frequency(model.decoder, tokens, model_ntoken(model))
+
     lm = language_model.LanguageModel(model, vocab)
     with open(args.save, 'wb') as f:
         lm.save(f)
@@ -0,0 +1,71 @@
+import argparse
+import copy
+import io
+import math
+import time
+
+from data_pipeline.data import tokens_from_fn
+from data_pipeline.multistream import batchify
+from data_pipeline.temporal_splitting import TemporalSplits
+from language_models import language_model
+
+from runtime.runtime_utils import TransposeWrapper
+from runtime.runtime_multifile import evaluate_
+
+
+def corpus_loss(model, ids, target_seq_len):
+    """ Average loss of `model` on `ids`, and the seconds it took.
+    """
+    data_tb = TemporalSplits(
+        batchify(ids, 10, False),
+        nb_inputs_necessary=model.in_len,
+        nb_targets_parallel=target_seq_len
+    )
+    start = time.time()
+    loss = evaluate_(model, TransposeWrapper(data_tb), use_ivecs=False, custom_batches=False)
+    return loss, time.time() - start
+
+
+def saved_size(lm):
+    f = io.BytesIO()
+    lm.save(f)
+    return len(f.getvalue())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts a model to int8 weights for inference')
+    parser.add_argument('--load', type=str, required=True,
+                        help='where to load the floating point model from')
+    parser.add_argument('--save', type=str, required=True,
+                        help='where to put the quantized model')
+    parser.add_argument('--data', type=str,
+                        help='report the perplexity and scoring time of both models on this corpus')
+    parser.add_argument('--target-seq-len', type=int, default=35,
+                        help='sequence length for the perplexity report')
+    args = parser.parse_args()
+    print(args)
+
+    print("loading model...")
+    with open(args.load, 'rb') as f:
+        lm = language_model.load(f, mmap=False)
+    lm.model.eval()
+
+    print("quantizing...")
+    quantized = language_model.LanguageModel(copy.deepcopy(lm.model), lm.vocab)
+    quantized.quantize()
+    print(quantized.model)
+
+    with open(args.save, 'wb') as f:
+        quantized.save(f)
+    print("size {} -> {} bytes".format(saved_size(lm), saved_size(quantized)))
+
+    if args.data:
+        print("evaluating...")
+        ids = tokens_from_fn(args.data, lm.vocab, randomize=False)
+        loss, elapsed = corpus_loss(lm.model, ids, args.target_seq_len)
+        quantized_loss, quantized_elapsed = corpus_loss(quantized.model, ids, args.target_seq_len)
+        print('float | loss {:5.2f} | ppl {:8.2f} | {:.2f}s'.format(loss, math.exp(loss), elapsed))
+        print('int8  | loss {:5.2f} | ppl {:8.2f} | {:.2f}s'.format(quantized_loss, math.exp(quantized_loss), quantized_elapsed))
+        print('ppl difference {:+.2f}% | speedup {:.2f}x'.format(
+            100.0 * (math.exp(quantized_loss - loss) - 1.0), elapsed / max(quantized_elapsed, 1e-9)
+        ))
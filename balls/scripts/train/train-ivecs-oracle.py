@@ -1,6 +1,5 @@
 import argparse
 import math
-import random
 
 import torch
 
@@ -8,21 +7,25 @@ from language_models import language_model
 from data_pipeline.multistream import BatchBuilder
 from data_pipeline.temporal_splitting import TemporalSplits
 from data_pipeline.split_corpus_dataset import TokenizedSplitFFBase
+from data_pipeline.document_store import is_document_store, DocumentStore, DocumentStoreSplits
 from smm_itf import ivec_appenders
 from smm_itf import smm_ivec_extractor
+from smm_itf.ivec_cache import IvecCache
 
-from runtime.runtime_utils import CudaStream, init_seeds, filelist_to_objects, BatchFilter, epoch_summary
+from runtime.runtime_utils import CudaStream, device_stream, init_seeds, filelist_to_objects, OrderedObjects, shuffle_objects, objects_order, set_objects_order, BatchFilter, epoch_summary
 from runtime.runtime_multifile import train, evaluate
 
+from runtime.checkpointing import AsyncCheckpointWriter
+from runtime.training_state import save_training_state, load_training_state, periodic_state_saver
 from runtime.loggers import InfinityLogger
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='PyTorch RNN/LSTM Language Model')
     parser.add_argument('--train-list', type=str, required=True,
-                        help='file with paths to training documents')
+                        help='file with paths to training documents, or a compiled document store')
     parser.add_argument('--valid-list', type=str, required=True,
-                        help='file with paths to validation documents')
+                        help='file with paths to validation documents, or a compiled document store')
     parser.add_argument('--lr', type=float, default=20,
                         help='initial learning rate')
     parser.add_argument('--beta', type=float, default=0,
@@ -43,16 +46,30 @@ if __name__ == '__main__':
                         help='pass hidden states over article boundaries')
     parser.add_argument('--min-batch-size', type=int, default=1,
                         help='stop, once batch is smaller than given size')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='N',
+                        help='prepare N training batches ahead in a background thread')
     parser.add_argument('--log-interval', type=int, default=200, metavar='N',
                         help='report interval')
     parser.add_argument('--ivec-extractor', type=str, required=True,
                         help='where to load a ivector extractor from')
     parser.add_argument('--ivec-nb-iters', type=int,
                         help='override the number of iterations when extracting ivectors')
+    parser.add_argument('--ivec-cache', type=str,
+                        help='directory to cache extracted ivectors in')
+    parser.add_argument('--ivec-cache-size', type=int, default=4096, metavar='MB',
+                        help='size limit of the ivector cache')
     parser.add_argument('--load', type=str, required=True,
                         help='where to load a model from')
     parser.add_argument('--save', type=str, required=True,
                         help='path to save the final model')
+    parser.add_argument('--keep-checkpoints', type=int, default=1, metavar='K',
+                        help='keep K last best models, older ones as SAVE.1, SAVE.2, ...')
+    parser.add_argument('--save-state', type=str,
+                        help='where to keep the training state, to be continued by --resume-state')
+    parser.add_argument('--state-interval', type=int, default=1000, metavar='N',
+                        help='save the training state every N updates and after each epoch')
+    parser.add_argument('--resume-state', type=str,
+                        help='continue an interrupted training from its saved state')
     args = parser.parse_args()
     print(args)
 
@@ -60,7 +77,7 @@ if __name__ == '__main__':
 
     print("loading LSTM model...")
     with open(args.load, 'rb') as f:
-        lm = language_model.load(f)
+        lm = language_model.load(f, mmap=False)  # --save may overwrite the source
     if args.cuda:
         lm.model.cuda()
     print(lm.model)
@@ -70,24 +87,39 @@ if __name__ == '__main__':
         ivec_extractor = smm_ivec_extractor.load(f)
     if args.ivec_nb_iters:
         ivec_extractor._nb_iters = args.ivec_nb_iters
+    if args.ivec_cache:
+        ivec_extractor = IvecCache(args.ivec_cache, ivec_extractor, max_bytes=args.ivec_cache_size * 2**20)
     print(ivec_extractor)
 
     print("preparing data...")
-    ivec_app_creator = lambda ts: ivec_appenders.CheatingIvecAppender(ts, ivec_extractor)
 
     print("\ttraining...")
 
-    def ivec_ts_from_file(f):
-        ts = TokenizedSplitFFBase(
+    def ts_from_file(f):
+        return TokenizedSplitFFBase(
             f, lm.vocab,
             lambda seq: TemporalSplits(seq, lm.model.in_len, args.target_seq_len)
         )
-        return ivec_appenders.CheatingIvecAppender(ts, ivec_extractor)
 
-    train_data_ivecs = filelist_to_objects(args.train_list, ivec_ts_from_file)
+    def ivec_documents(documents_filename):
+        if not is_document_store(documents_filename):
+            tss = filelist_to_objects(documents_filename, ts_from_file)
+            return OrderedObjects(ivec_appenders.cheating_ivec_appenders(tss, ivec_extractor))
+
+        # i-vectors are extracted once, streams are built lazily around them
+        store = DocumentStore(documents_filename, lm.vocab)
+        ivecs = ivec_extractor.extract_batch([store.words(i) for i in range(len(store))])
+
+        def ivec_ts_from_tokens(tokens, doc_index):
+            ts = TemporalSplits(tokens, lm.model.in_len, args.target_seq_len)
+            return ivec_appenders.FixedIvecAppender(ts, ivecs[doc_index])
+
+        return DocumentStoreSplits(store, ivec_ts_from_tokens)
+
+    train_data_ivecs = ivec_documents(args.train_list)
 
     print("\tvalidation...")
-    valid_data_ivecs = filelist_to_objects(args.valid_list, ivec_ts_from_file)
+    valid_data_ivecs = ivec_documents(args.valid_list)
     valid_data = BatchBuilder(
         valid_data_ivecs,
         args.batch_size,
@@ -99,15 +131,30 @@ if __name__ == '__main__':
     print("training...")
     lr = args.lr
     best_val_loss = None
-
-    for epoch in range(1, args.epochs+1):
-        random.shuffle(train_data_ivecs)
+    first_epoch = 1
+    resumed = None
+    if args.resume_state:
+        resumed = load_training_state(args.resume_state, lm.model)
+        lr, best_val_loss, first_epoch = resumed.lr, resumed.best_val_loss, resumed.epoch
+        print("resuming epoch {} after {} batches".format(first_epoch, resumed.nb_batches_done))
+    checkpoint_writer = AsyncCheckpointWriter(args.save, keep=args.keep_checkpoints)
+
+    for epoch in range(first_epoch, args.epochs+1):
+        nb_batches_skipped = 0
+        hidden = None
+        if resumed is not None:
+            set_objects_order(train_data_ivecs, resumed.data_order)
+        if resumed is not None and resumed.nb_batches_done > 0:
+            nb_batches_skipped = resumed.nb_batches_done
+            hidden = resumed.hidden
+        else:
+            shuffle_objects(train_data_ivecs)
         train_data = BatchBuilder(
             train_data_ivecs,
-            args.batch_size, discard_h=not args.concat_articles
+            args.batch_size, discard_h=not args.concat_articles,
+            start_step=nb_batches_skipped
         )
-        if args.cuda:
-            train_data = CudaStream(train_data)
+        train_data = device_stream(train_data, args.cuda, args.prefetch)
 
         logger = InfinityLogger(epoch, args.log_interval, lr)
         train_data_filtered = BatchFilter(
@@ -115,11 +162,24 @@ if __name__ == '__main__':
         )
 
         optim = torch.optim.SGD(lm.model.parameters(), lr=lr, weight_decay=args.beta)
+        if resumed is not None:
+            resumed.restore_optimizer(optim)
+            resumed = None
+
+        batch_callback = None
+        if args.save_state:
+            batch_callback = periodic_state_saver(
+                args.save_state, args.state_interval,
+                lambda: nb_batches_skipped + train_data_filtered.nb_batches_read(),
+                lm.model, optim,
+                epoch=epoch, lr=lr, best_val_loss=best_val_loss, data_order=objects_order(train_data_ivecs)
+            )
 
         train(
             lm.model, train_data_filtered, optim, logger,
             clip=args.clip,
-            use_ivecs=True
+            use_ivecs=True,
+            hidden=hidden, batch_callback=batch_callback
         )
         train_data_filtered.report()
 
@@ -128,9 +188,16 @@ if __name__ == '__main__':
 
         # Save the model if the validation loss is the best we've seen so far.
         if not best_val_loss or val_loss < best_val_loss:
-            with open(args.save, 'wb') as f:
-                lm.save(f)
+            checkpoint_writer.save(lm)
             best_val_loss = val_loss
         else:
             lr /= 2.0
             pass
+
+        if args.save_state:
+            save_training_state(
+                args.save_state, lm.model, optim, epoch+1, lr, best_val_loss,
+                data_order=objects_order(train_data_ivecs)
+            )
+
+    checkpoint_writer.close()
@@ -1,6 +1,5 @@
 import argparse
 import math
-import random
 
 import torch
 
@@ -9,9 +8,11 @@ from data_pipeline.multistream import BatchBuilder
 from smm_itf import ivec_appenders
 from smm_itf import smm_ivec_extractor
 
-from runtime.runtime_utils import CudaStream, init_seeds, filelist_to_tokenized_splits, BatchFilter, epoch_summary
+from runtime.runtime_utils import CudaStream, PrefetchingStream, init_seeds, filelist_to_tokenized_splits, OrderedObjects, shuffle_objects, objects_order, set_objects_order, BatchFilter, epoch_summary
 from runtime.runtime_multifile import train, evaluate
 
+from runtime.checkpointing import AsyncCheckpointWriter
+from runtime.training_state import save_training_state, load_training_state
 from runtime.loggers import InfinityLogger
 
 
@@ -41,16 +42,26 @@ if __name__ == '__main__':
                         help='pass hidden states over article boundaries')
     parser.add_argument('--min-batch-size', type=int, default=1,
                         help='stop, once batch is smaller than given size')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='N',
+                        help='prepare N training batches ahead in a background thread')
     parser.add_argument('--log-interval', type=int, default=200, metavar='N',
                         help='report interval')
     parser.add_argument('--ivec-extractor', type=str, required=True,
                         help='where to load a ivector extractor from')
     parser.add_argument('--ivec-nb-iters', type=int,
                         help='override the number of iterations when extracting ivectors')
+    parser.add_argument('--ivec-refinement-iters', type=int,
+                        help='refine ivectors of the previous batch by this many iterations instead of extracting them anew')
     parser.add_argument('--load', type=str, required=True,
                         help='where to load a model from')
     parser.add_argument('--save', type=str, required=True,
                         help='path to save the final model')
+    parser.add_argument('--keep-checkpoints', type=int, default=1, metavar='K',
+                        help='keep K last best models, older ones as SAVE.1, SAVE.2, ...')
+    parser.add_argument('--save-state', type=str,
+                        help='where to keep the training state after each epoch, to be continued by --resume-state')
+    parser.add_argument('--resume-state', type=str,
+                        help='continue an interrupted training from its saved state')
     args = parser.parse_args()
     print(args)
 
@@ -58,7 +69,7 @@ if __name__ == '__main__':
 
     print("loading LSTM model...")
     with open(args.load, 'rb') as f:
-        lm = language_model.load(f)
+        lm = language_model.load(f, mmap=False)  # --save may overwrite the source
     if args.cuda:
         lm.model.cuda()
     print(lm.model)
@@ -75,7 +86,7 @@ if __name__ == '__main__':
     ivec_app_creator = lambda ts: ivec_appenders.HistoryIvecAppender(ts, ivec_extractor)
 
     print("\ttraining...")
-    train_tss = filelist_to_tokenized_splits(args.train_list, lm.vocab, args.target_seq_len)
+    train_tss = OrderedObjects(filelist_to_tokenized_splits(args.train_list, lm.vocab, args.target_seq_len))
 
     print("\tvalidation...")
     valid_tss = filelist_to_tokenized_splits(args.valid_list, lm.vocab, args.target_seq_len)
@@ -91,9 +102,19 @@ if __name__ == '__main__':
     print("training...")
     lr = args.lr
     best_val_loss = None
-
-    for epoch in range(1, args.epochs+1):
-        random.shuffle(train_tss)
+    first_epoch = 1
+    if args.resume_state:
+        # i-vectors of the history are not part of the state, only whole epochs are continued
+        resumed = load_training_state(args.resume_state, lm.model)
+        if resumed.nb_batches_done > 0:
+            raise ValueError("Training state {} is from the middle of an epoch".format(args.resume_state))
+        lr, best_val_loss, first_epoch = resumed.lr, resumed.best_val_loss, resumed.epoch
+        set_objects_order(train_tss, resumed.data_order)
+        print("resuming at epoch {}".format(first_epoch))
+    checkpoint_writer = AsyncCheckpointWriter(args.save, keep=args.keep_checkpoints)
+
+    for epoch in range(first_epoch, args.epochs+1):
+        shuffle_objects(train_tss)
         train_data = BatchBuilder(
             train_tss, args.batch_size, discard_h=not args.concat_articles
         )
@@ -103,8 +124,11 @@ if __name__ == '__main__':
             train_data, args.batch_size, args.target_seq_len, args.min_batch_size
         )
         train_data_ivecs = ivec_appenders.ParalelIvecAppender(
-            train_data_filtered, ivec_extractor, translator
+            train_data_filtered, ivec_extractor, translator,
+            refinement_iters=args.ivec_refinement_iters
         )
+        if args.prefetch > 0:
+            train_data_ivecs = PrefetchingStream(train_data_ivecs, args.prefetch)
 
         logger = InfinityLogger(epoch, args.log_interval, lr)
         optim = torch.optim.SGD(lm.model.parameters(), lr=lr, weight_decay=args.beta)
@@ -121,9 +145,16 @@ if __name__ == '__main__':
 
         # Save the model if the validation loss is the best we've seen so far.
         if not best_val_loss or val_loss < best_val_loss:
-            with open(args.save, 'wb') as f:
-                lm.save(f)
+            checkpoint_writer.save(lm)
             best_val_loss = val_loss
         else:
             lr /= 2.0
             pass
+
+        if args.save_state:
+            save_training_state(
+                args.save_state, lm.model, optim, epoch+1, lr, best_val_loss,
+                data_order=objects_order(train_tss)
+            )
+
+    checkpoint_writer.close()
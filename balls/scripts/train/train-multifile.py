@@ -1,32 +1,39 @@
 import argparse
-import random
 
 import torch
 
 from language_models import language_model
-from data_pipeline.multistream import BatchBuilder
+from language_models.decoders import model_ntoken, unigram_counts
 
-from data_pipeline.data import tokens_from_file
 from data_pipeline.temporal_splitting import TemporalSplits
 
-from runtime.runtime_utils import CudaStream, init_seeds, filelist_to_objects, BatchFilter, epoch_summary
+from runtime.runtime_utils import CudaStream, device_stream, init_seeds, documents_to_objects, shuffle_objects, objects_order, set_objects_order, batch_temporal_splits, BatchFilter, epoch_summary
 from runtime.runtime_multifile import evaluate, train
 
+from runtime.checkpointing import AsyncCheckpointWriter
+from runtime.training_state import save_training_state, load_training_state, periodic_state_saver
+from runtime.sampled_criteria import make_criterion
 from runtime.loggers import InfinityLogger
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='PyTorch RNN/LSTM Language Model')
     parser.add_argument('--train-list', type=str, required=True,
-                        help='file with paths to training documents')
+                        help='file with paths to training documents, or a compiled document store')
     parser.add_argument('--valid-list', type=str, required=True,
-                        help='file with paths to validation documents')
+                        help='file with paths to validation documents, or a compiled document store')
     parser.add_argument('--lr', type=float, default=20,
                         help='initial learning rate')
     parser.add_argument('--beta', type=float, default=0,
                         help='L2 regularization penalty')
     parser.add_argument('--clip', type=float, default=0.25,
                         help='gradient clipping')
+    parser.add_argument('--criterion', choices=['full', 'sampled', 'nce'], default='full',
+                        help='training loss; full softmax, importance-sampled softmax or NCE. Evaluation is always exact')
+    parser.add_argument('--nb-samples', type=int, default=1024, metavar='K',
+                        help='noise samples per batch for the sampled criteria')
+    parser.add_argument('--noise-power', type=float, default=1.0,
+                        help='exponent of the unigram counts in the noise distribution')
     parser.add_argument('--epochs', type=int, default=40,
                         help='upper epoch limit')
     parser.add_argument('--batch-size', type=int, default=20, metavar='N',
@@ -45,12 +52,22 @@ if __name__ == '__main__':
                         help='shuffle the order of articles for each epoch')
     parser.add_argument('--min-batch-size', type=int, default=1,
                         help='stop, once batch is smaller than given size')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='N',
+                        help='prepare N training batches ahead in a background thread')
     parser.add_argument('--log-interval', type=int, default=200, metavar='N',
                         help='report interval')
     parser.add_argument('--load', type=str, required=True,
                         help='where to load a model from')
     parser.add_argument('--save', type=str, required=True,
                         help='path to save the final model')
+    parser.add_argument('--keep-checkpoints', type=int, default=1, metavar='K',
+                        help='keep K last best models, older ones as SAVE.1, SAVE.2, ...')
+    parser.add_argument('--save-state', type=str,
+                        help='where to keep the training state, to be continued by --resume-state')
+    parser.add_argument('--state-interval', type=int, default=1000, metavar='N',
+                        help='save the training state every N updates and after each epoch')
+    parser.add_argument('--resume-state', type=str,
+                        help='continue an interrupted training from its saved state')
     args = parser.parse_args()
     print(args)
 
@@ -58,53 +75,83 @@ if __name__ == '__main__':
 
     print("loading model...")
     with open(args.load, 'rb') as f:
-        lm = language_model.load(f)
+        lm = language_model.load(f, mmap=False)  # --save may overwrite the source
     if args.cuda:
         lm.model.cuda()
     print(lm.model)
 
     print("preparing data...")
 
-    def temp_splits_from_fn(fn):
-        tokens = tokens_from_file(fn, lm.vocab, randomize=False)
+    def temp_splits_from_tokens(tokens, doc_index):
         return TemporalSplits(tokens, lm.model.in_len, args.target_seq_len)
 
+    def batches(tss, start_step=0):
+        return batch_temporal_splits(
+            tss, lm.model.in_len, args.target_seq_len,
+            args.batch_size, discard_h=not args.concat_articles,
+            start_step=start_step
+        )
+
     print("\ttraining...")
-    train_tss = filelist_to_objects(args.train_list, temp_splits_from_fn)
-    train_data = BatchBuilder(train_tss, args.batch_size,
-                              discard_h=not args.concat_articles)
-    if args.cuda:
-        train_data = CudaStream(train_data)
+    train_tss = documents_to_objects(args.train_list, lm.vocab, temp_splits_from_tokens)
+    criterion = None
+    if args.criterion != 'full':
+        counts = sum(unigram_counts(targets, model_ntoken(lm.model)) for tss in train_tss for _, targets in tss)
+        criterion = make_criterion(args.criterion, counts, args.nb_samples, args.noise_power)
 
     print("\tvalidation...")
-    valid_tss = filelist_to_objects(args.valid_list, temp_splits_from_fn)
-    valid_data = BatchBuilder(valid_tss, args.batch_size,
-                              discard_h=not args.concat_articles)
+    valid_tss = documents_to_objects(args.valid_list, lm.vocab, temp_splits_from_tokens)
+    valid_data = batches(valid_tss)
     if args.cuda:
         valid_data = CudaStream(valid_data)
 
     print("training...")
     lr = args.lr
     best_val_loss = None
-
-    for epoch in range(1, args.epochs+1):
-        if args.keep_shuffling:
-            random.shuffle(train_tss)
-            train_data = BatchBuilder(train_tss, args.batch_size,
-                                      discard_h=not args.concat_articles)
-            if args.cuda:
-                train_data = CudaStream(train_data)
+    first_epoch = 1
+    resumed = None
+    if args.resume_state:
+        resumed = load_training_state(args.resume_state, lm.model)
+        lr, best_val_loss, first_epoch = resumed.lr, resumed.best_val_loss, resumed.epoch
+        print("resuming epoch {} after {} batches".format(first_epoch, resumed.nb_batches_done))
+    checkpoint_writer = AsyncCheckpointWriter(args.save, keep=args.keep_checkpoints)
+
+    for epoch in range(first_epoch, args.epochs+1):
+        nb_batches_skipped = 0
+        hidden = None
+        if resumed is not None:
+            set_objects_order(train_tss, resumed.data_order)
+        if resumed is not None and resumed.nb_batches_done > 0:
+            nb_batches_skipped = resumed.nb_batches_done
+            hidden = resumed.hidden
+        elif args.keep_shuffling:
+            shuffle_objects(train_tss)
+        train_data = device_stream(batches(train_tss, nb_batches_skipped), args.cuda, args.prefetch)
 
         logger = InfinityLogger(epoch, args.log_interval, lr)
         train_data_filtered = BatchFilter(
             train_data, args.batch_size, args.target_seq_len, args.min_batch_size
         )
         optim = torch.optim.SGD(lm.model.parameters(), lr=lr, weight_decay=args.beta)
+        if resumed is not None:
+            resumed.restore_optimizer(optim)
+            resumed = None
+
+        batch_callback = None
+        if args.save_state:
+            batch_callback = periodic_state_saver(
+                args.save_state, args.state_interval,
+                lambda: nb_batches_skipped + train_data_filtered.nb_batches_read(),
+                lm.model, optim,
+                epoch=epoch, lr=lr, best_val_loss=best_val_loss, data_order=objects_order(train_tss)
+            )
 
         train(
             lm.model, train_data_filtered, optim, logger,
             clip=args.clip,
-            use_ivecs=False
+            use_ivecs=False,
+            hidden=hidden, batch_callback=batch_callback,
+            criterion=criterion
         )
         train_data_filtered.report()
 
@@ -113,9 +160,16 @@ if __name__ == '__main__':
 
         # Save the model if the validation loss is the best we've seen so far.
         if not best_val_loss or val_loss < best_val_loss:
-            with open(args.save, 'wb') as f:
-                lm.save(f)
+            checkpoint_writer.save(lm)
             best_val_loss = val_loss
         else:
             lr /= 2.0
             pass
+
+        if args.save_state:
+            save_training_state(
+                args.save_state, lm.model, optim, epoch+1, lr, best_val_loss,
+                data_order=objects_order(train_tss)
+            )
+
+    checkpoint_writer.close()
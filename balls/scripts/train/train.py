@@ -3,12 +3,16 @@ import torch
 
 from data_pipeline.data import tokens_from_fn
 from data_pipeline.multistream import batchify
-from data_pipeline.temporal_splitting import TemporalSplits
+from data_pipeline.temporal_splitting import TemporalSplits, temporal_splits_from
 from language_models import language_model
+from language_models.decoders import model_ntoken, unigram_counts
 
-from runtime.runtime_utils import TransposeWrapper, init_seeds, epoch_summary
+from runtime.runtime_utils import BatchCounter, TransposeWrapper, init_seeds, epoch_summary
 from runtime.runtime_multifile import evaluate_, train_
 
+from runtime.checkpointing import AsyncCheckpointWriter
+from runtime.training_state import save_training_state, load_training_state, periodic_state_saver
+from runtime.sampled_criteria import make_criterion
 from runtime.loggers import ProgressLogger
 
 
@@ -34,6 +38,12 @@ if __name__ == '__main__':
                         help='L2 regularization penalty')
     parser.add_argument('--clip', type=float, default=0.25,
                         help='gradient clipping')
+    parser.add_argument('--criterion', choices=['full', 'sampled', 'nce'], default='full',
+                        help='training loss; full softmax, importance-sampled softmax or NCE. Evaluation is always exact')
+    parser.add_argument('--nb-samples', type=int, default=1024, metavar='K',
+                        help='noise samples per batch for the sampled criteria')
+    parser.add_argument('--noise-power', type=float, default=1.0,
+                        help='exponent of the unigram counts in the noise distribution')
     parser.add_argument('--epochs', type=int, default=40,
                         help='upper epoch limit')
 
@@ -47,6 +57,14 @@ if __name__ == '__main__':
                         help='where to load a model from')
     parser.add_argument('--save', type=str, required=True,
                         help='path to save the final model')
+    parser.add_argument('--keep-checkpoints', type=int, default=1, metavar='K',
+                        help='keep K last best models, older ones as SAVE.1, SAVE.2, ...')
+    parser.add_argument('--save-state', type=str,
+                        help='where to keep the training state, to be continued by --resume-state')
+    parser.add_argument('--state-interval', type=int, default=1000, metavar='N',
+                        help='save the training state every N updates and after each epoch')
+    parser.add_argument('--resume-state', type=str,
+                        help='continue an interrupted training from its saved state')
     args = parser.parse_args()
     print(args)
 
@@ -54,7 +72,7 @@ if __name__ == '__main__':
 
     print("loading model...")
     with open(args.load, 'rb') as f:
-        lm = language_model.load(f)
+        lm = language_model.load(f, mmap=False)  # --save may overwrite the source
     if args.cuda:
         lm.model.cuda()
     print(lm.model)
@@ -65,13 +83,15 @@ if __name__ == '__main__':
         tokenize_regime = 'chars'
 
     train_ids = tokens_from_fn(args.train, lm.vocab, randomize=False, regime=tokenize_regime)
+    criterion = None
+    if args.criterion != 'full':
+        counts = unigram_counts(train_ids, model_ntoken(lm.model))
+        criterion = make_criterion(args.criterion, counts, args.nb_samples, args.noise_power)
     train_batched = batchify(train_ids, args.batch_size, args.cuda)
-    train_data_tb = TemporalSplits(
-        train_batched,
-        nb_inputs_necessary=lm.model.in_len,
-        nb_targets_parallel=args.target_seq_len
-    )
-    train_data = TransposeWrapper(train_data_tb)
+
+    def train_batches(start_step=0):
+        train_data_tb = temporal_splits_from(train_batched, start_step, lm.model.in_len, args.target_seq_len)
+        return BatchCounter(TransposeWrapper(train_data_tb))
 
     valid_ids = tokens_from_fn(args.valid, lm.vocab, randomize=False, regime=tokenize_regime)
     valid_batched = batchify(valid_ids, 10, args.cuda)
@@ -85,16 +105,44 @@ if __name__ == '__main__':
     print("training...")
     lr = args.lr
     best_val_loss = None
+    first_epoch = 1
+    resumed = None
+    if args.resume_state:
+        resumed = load_training_state(args.resume_state, lm.model)
+        lr, best_val_loss, first_epoch = resumed.lr, resumed.best_val_loss, resumed.epoch
+        print("resuming epoch {} after {} batches".format(first_epoch, resumed.nb_batches_done))
+    checkpoint_writer = AsyncCheckpointWriter(args.save, keep=args.keep_checkpoints)
+
+    for epoch in range(first_epoch, args.epochs+1):
+        nb_batches_skipped = 0
+        hidden = None
+        if resumed is not None and resumed.nb_batches_done > 0:
+            nb_batches_skipped = resumed.nb_batches_done
+            hidden = resumed.hidden
+        train_data = train_batches(nb_batches_skipped)
 
-    for epoch in range(1, args.epochs+1):
         logger = ProgressLogger(epoch, args.log_interval, lr, len(train_batched)//args.target_seq_len)
         optim = torch.optim.SGD(lm.model.parameters(), lr, weight_decay=args.beta)
+        if resumed is not None:
+            resumed.restore_optimizer(optim)
+            resumed = None
+
+        batch_callback = None
+        if args.save_state:
+            batch_callback = periodic_state_saver(
+                args.save_state, args.state_interval,
+                lambda: nb_batches_skipped + train_data.nb_batches_read(),
+                lm.model, optim,
+                epoch=epoch, lr=lr, best_val_loss=best_val_loss
+            )
 
         train_(
             lm.model, train_data, optim,
             logger, args.clip,
             use_ivecs=False,
             custom_batches=False,
+            hidden=hidden, batch_callback=batch_callback,
+            criterion=criterion
         )
 
         val_loss = evaluate_(
@@ -106,9 +154,13 @@ if __name__ == '__main__':
 
         # Save the model if the validation loss is the best we've seen so far.
         if not best_val_loss or val_loss < best_val_loss:
-            with open(args.save, 'wb') as f:
-                lm.save(f)
+            checkpoint_writer.save(lm)
             best_val_loss = val_loss
         else:
             lr /= 2.0
             pass
+
+        if args.save_state:
+            save_training_state(args.save_state, lm.model, optim, epoch+1, lr, best_val_loss)
+
+    checkpoint_writer.close()
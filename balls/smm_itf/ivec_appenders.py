@@ -16,6 +16,29 @@ class CheatingIvecAppender():
             yield (x, t, self._ivec)
 
 
+class FixedIvecAppender():
+    def __init__(self, tokens, ivec):
+        """
+            Args:
+                tokens (TemporalSplits): Source of tokens, represents single 'document'.
+                ivec (Tensor): Precomputed i-vector of the whole document.
+        """
+        self.tokens = tokens
+        self._ivec = ivec
+
+    def __iter__(self):
+        for x, t in self.tokens:
+            yield (x, t, self._ivec)
+
+
+def cheating_ivec_appenders(tss, ivec_eetor):
+    """ Same as wrapping each of `tss` into CheatingIvecAppender, with i-vectors extracted in one batch.
+    """
+    all_words = [" ".join(ts.input_words()) for ts in tss]
+    ivecs = ivec_eetor.extract_batch(all_words)
+    return [FixedIvecAppender(ts, ivec) for ts, ivec in zip(tss, ivecs)]
+
+
 class HistoryIvecAppender():
     def __init__(self, tokens, ivec_eetor):
         """
@@ -35,20 +58,41 @@ class HistoryIvecAppender():
 
 
 class ParalelIvecAppender:
-    def __init__(self, stream, extractor, translator):
+    def __init__(self, stream, extractor, translator, refinement_iters=None):
+        """
+            Args:
+                stream (BatchBuilder): Source of (x, t, mask) batches.
+                refinement_iters (int): If given, i-vectors of continuing streams are
+                    not extracted from scratch, but refined from their values in the
+                    previous batch by this many iterations. New streams start from
+                    the i-vector of an empty document.
+        """
         self._stream = stream
         self._extractor = extractor
         self._translator = translator 
+        self._refinement_iters = refinement_iters
         self._reorganizer = TensorReorganizer(extractor.zero_bows)
 
     def __iter__(self):
+        if self._refinement_iters is not None:
+            empty_ivec = self._extractor(self._extractor.zero_bows(1)).clone().view(1, -1)
+            ivec_reorganizer = TensorReorganizer(lambda n: empty_ivec.expand(n, empty_ivec.size(1)))
+
         old_bows = None
+        old_ivecs = None
         for x, t, mask in self._stream:
             corresponding_bows = self._reorganizer(old_bows, mask, x.size(0))
             try:
-                ivectors = self._extractor(corresponding_bows)
+                if self._refinement_iters is None:
+                    ivectors = self._extractor(corresponding_bows)
+                else:
+                    corresponding_ivecs = ivec_reorganizer(old_ivecs, mask, x.size(0))
+                    ivectors = self._extractor.refine(
+                        corresponding_bows, corresponding_ivecs, self._refinement_iters
+                    )
             except RuntimeError:
                 print(x.size(), mask, corresponding_bows.size())
                 raise
-            old_bows = corresponding_bows + self._translator(x)
+            old_bows = self._translator(x, corresponding_bows)  # extractor is done with them
+            old_ivecs = ivectors
             yield x, t, ivectors, mask
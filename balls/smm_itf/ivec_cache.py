@@ -0,0 +1,162 @@
+import glob
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import torch
+
+from data_pipeline.data import write_binary_header, read_binary_header
+
+
+SEGMENT_MAGIC = b'BRNOIVC1'
+SEGMENT_SUFFIX = '.ivecs'
+
+
+def document_key(document):
+    """ Hash of the tokens of a document, insensitive to whitespace layout.
+    """
+    return hashlib.sha1(" ".join(document.split()).encode('utf-8')).hexdigest()
+
+
+def write_segment(fn, keys, ivecs):
+    """ Atomically writes i-vectors [len(keys), ivec_dim] into a segment file.
+    """
+    ivecs = np.ascontiguousarray(ivecs, dtype=np.float32)
+    header = {
+        'keys': keys,
+        'ivec_dim': ivecs.shape[1],
+    }
+
+    fd, tmp_fn = tempfile.mkstemp(dir=os.path.dirname(fn), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_binary_header(f, SEGMENT_MAGIC, header)
+            f.write(ivecs.tobytes())
+        os.replace(tmp_fn, fn)
+    except BaseException:
+        os.remove(tmp_fn)
+        raise
+
+
+def read_segment(fn):
+    """ Returns (keys, ivecs), ivecs are memory-mapped.
+    """
+    with open(fn, 'rb') as f:
+        header, offset = read_binary_header(f, SEGMENT_MAGIC)
+
+    keys = header['keys']
+    ivecs = np.memmap(fn, dtype=np.float32, mode='r', offset=offset,
+                      shape=(len(keys), header['ivec_dim']))
+    return keys, ivecs
+
+
+class IvecCache():
+    def __init__(self, directory, extractor, max_bytes=None):
+        """ On-disk cache of i-vectors around an IvecExtractor.
+
+            Entries are keyed by `document_key()` and stored in a subdirectory
+            named by the fingerprint of the extractor, so changing the SMM,
+            its learning rate or number of iterations never hits old entries.
+            Each batch of new i-vectors becomes an immutable segment file,
+            published by an atomic rename, so any number of processes may
+            read and extend the cache at once. Once the whole cache grows
+            over `max_bytes`, least recently used segments are deleted;
+            mappings already open in other processes stay valid.
+
+            I-vectors are returned on CPU.
+
+            Args:
+                directory (str): Root of the cache, shared between extractors.
+                extractor (IvecExtractor): Source of i-vectors missing in the cache.
+                max_bytes (int): Size limit of the whole cache, unlimited if None.
+        """
+        self._directory = directory
+        self._extractor = extractor
+        self._max_bytes = max_bytes
+
+        self._segment_dir = os.path.join(directory, extractor.fingerprint())
+        os.makedirs(self._segment_dir, exist_ok=True)
+
+        self._entries = {}
+        for fn in glob.glob(os.path.join(self._segment_dir, '*' + SEGMENT_SUFFIX)):
+            self._add_segment(fn)
+
+    def _add_segment(self, fn):
+        try:
+            keys, ivecs = read_segment(fn)
+        except (OSError, ValueError):  # evicted or broken meanwhile
+            return
+
+        for row, key in enumerate(keys):
+            self._entries[key] = (fn, ivecs, row)
+
+    def __call__(self, document):
+        return self.extract_batch([document])[0]
+
+    def extract_batch(self, documents, chunk_size=None):
+        """ Same as IvecExtractor.extract_batch(), but only for documents not cached yet.
+        """
+        keys = [document_key(doc) for doc in documents]
+
+        missing = {}
+        for key, doc in zip(keys, documents):
+            if key not in self._entries and key not in missing:
+                missing[key] = doc
+
+        if missing:
+            missing_keys = list(missing.keys())
+            ivecs = self._extractor.extract_batch([missing[k] for k in missing_keys], chunk_size)
+            self._store(missing_keys, ivecs.cpu().numpy())
+
+        if len(keys) == 0:
+            return torch.FloatTensor()
+
+        used_segments = set(self._entries[k][0] for k in keys)
+        for fn in used_segments:
+            self._touch(fn)
+
+        return torch.from_numpy(np.stack([self._entries[k][1][self._entries[k][2]] for k in keys]))
+
+    def _store(self, keys, ivecs):
+        fn = os.path.join(self._segment_dir, '{}-{}{}'.format(
+            os.getpid(), hashlib.sha1("".join(keys).encode('utf-8')).hexdigest(), SEGMENT_SUFFIX
+        ))
+        write_segment(fn, keys, ivecs)
+        self._add_segment(fn)
+        self._evict(keep=fn)
+
+    def _touch(self, fn):
+        try:
+            os.utime(fn)
+        except OSError:
+            pass
+
+    def _evict(self, keep):
+        if self._max_bytes is None:
+            return
+
+        segments = []
+        for fn in glob.glob(os.path.join(self._directory, '*', '*' + SEGMENT_SUFFIX)):
+            try:
+                stat = os.stat(fn)
+            except OSError:
+                continue
+            segments.append((stat.st_mtime, stat.st_size, fn))
+
+        total_size = sum(size for _, size, _ in segments)
+        for _, size, fn in sorted(segments):
+            if total_size <= self._max_bytes:
+                break
+            if fn == keep:
+                continue
+            try:
+                os.remove(fn)
+            except OSError:
+                continue
+            total_size -= size
+
+    def __str__(self):
+        return "IvecCache ({}, {} entries) around {}".format(
+            self._segment_dir, len(self._entries), self._extractor
+        )
@@ -1,36 +1,111 @@
+import hashlib
 import io
 import tempfile
 import pickle
 
 import numpy as np
+from scipy import sparse
 import torch
 from torch.autograd import Variable
 
+from language_models.vocab import vocab_fingerprint
+
 import sys
 sys.path.append('/mnt/matylda5/ibenes/projects/santosh-lm/smm-pytorch/')
 from smm import SMM, update_ws 
 
+
+# bytes of dense bags of words optimized at once by extract_batch()
+BOW_MEMORY_BUDGET = 64 * 2**20
+
+
+def bow_chunk_size(bow_size, memory_budget=BOW_MEMORY_BUDGET):
+    """ Number of float32 bags of words of `bow_size` that fit into `memory_budget` bytes, at least 1. """
+    return max(1, memory_budget // (4 * max(bow_size, 1)))
+
+
 class IvecExtractor():
     def __init__(self, model, nb_iters, lr, tokenizer):
         self._model = model
         self._nb_iters = nb_iters
         self._lr = lr
         self._tokenizer = tokenizer
+        self._bow_size = None
+        self._translations = {}
 
     def __call__(self, sentence):
         """ Extract i-vectors given the model and stats """
         if isinstance(sentence, str):
-            data = self._tokenizer.transform([sentence])
-            data = torch.from_numpy(data.A.astype(np.float32))
-
+            data = self._dense_bows(self._tokenizer.transform([sentence]))
         else:
             data = sentence
 
+        return self._extract(data).squeeze()
+
+    def extract_batch(self, documents, chunk_size=None):
+        """ Extracts i-vectors of many documents, optimizing them jointly.
+
+            Columns of W are independent in the SMM objective, so the result
+            matches extraction of the documents one by one.
+
+            Args:
+                documents (list of str or scipy.sparse matrix): Texts, or their
+                    bags of words as produced by the tokenizer, one row per document.
+                chunk_size (int): Number of documents optimized at once, bounds the memory.
+                    By default as many as `BOW_MEMORY_BUDGET` bytes of dense bags of words.
+
+            Returns:
+                Tensor [nb_documents, ivec_dim]
+        """
+        if sparse.issparse(documents):
+            bows = documents.tocsr()
+        else:
+            bows = self._tokenizer.transform(list(documents))
+
+        if chunk_size is None:
+            chunk_size = bow_chunk_size(bows.shape[1])
+
+        ivecs = []
+        for start in range(0, bows.shape[0], chunk_size):
+            data = self._dense_bows(bows[start:start+chunk_size])
+            ivecs.append(self._extract(data).clone())
+
+        if len(ivecs) == 0:
+            return torch.FloatTensor()
+        return torch.cat(ivecs, dim=0)
+
+    def refine(self, bows, ivecs, nb_iters):
+        """ Continues the optimization of already estimated i-vectors.
+
+            Args:
+                bows (Tensor): Bags of words [B, V] of the documents.
+                ivecs (Tensor): Starting point [B, ivec_dim], typically i-vectors
+                    of shorter prefixes of the documents.
+                nb_iters (int): Number of optimization steps.
+
+            Returns:
+                Tensor [B, ivec_dim]
+        """
+        if nb_iters < 0:
+            raise ValueError("Cannot refine i-vectors with {} iterations".format(nb_iters))
+
+        return self._extract(bows, init=ivecs, nb_iters=nb_iters).clone()
+
+    def _dense_bows(self, bows):
+        return torch.from_numpy(bows.toarray().astype(np.float32))
+
+    def _extract(self, data, init=None, nb_iters=None):
+        """ i-vectors of bags of words `data` [B, V], returned as [B, ivec_dim] """
+        if nb_iters is None:
+            nb_iters = self._nb_iters
+
         if self._model.cuda:
             data = data.cuda()
         X = Variable(data.t())
 
         self._model.reset_w(X.size(-1))  # initialize i-vectors to zeros
+        if init is not None:
+            self._model.W.data.copy_(init.t())
         opt_w = torch.optim.Adagrad([self._model.W], lr=self._lr)
 
         loss = self._model.loss(X)
@@ -38,14 +113,21 @@ class IvecExtractor():
         # TODO this is a very nasty hack, needs to be 
         # completely reworked, a separate class should be 
         # prepared to implement this
-        if self._nb_iters < 0:
-            initrange = 10**(self._nb_iters)
+        if nb_iters < 0:
+            initrange = 10**(nb_iters)
             self._model.W.data.uniform_(-initrange, initrange)
         else: 
-            for i in range(self._nb_iters):
+            for i in range(nb_iters):
                 loss = update_ws(self._model, opt_w, loss, X)
 
-        return self._model.W.data.t().squeeze()
+        return self._model.W.data.t()
+
+    def fingerprint(self):
+        """ Identity of the extraction, changes with the model, lr or nb_iters. """
+        h = hashlib.sha1()
+        h.update(self._model.T.data.cpu().numpy().tobytes())
+        h.update("{} {}".format(self._lr, self._nb_iters).encode('utf-8'))
+        return h.hexdigest()
 
     def __str__(self):
         name = "IvecExtractor"
@@ -70,8 +152,12 @@ class IvecExtractor():
         tokenizer_byters = io.BytesIO()
         pickle.dump(self._tokenizer, tokenizer_byters)
 
+        translations_bytes = io.BytesIO()
+        pickle.dump(self._translations, translations_bytes)
+
         complete_smm = {'model': model_bytes, 'tokenizer': tokenizer_byters,
-                        'lr': lr_bytes, 'nb_iters': nb_iters_bytes}
+                        'lr': lr_bytes, 'nb_iters': nb_iters_bytes,
+                        'translations': translations_bytes}
         pickle.dump(complete_smm, f)
 
 
@@ -82,47 +168,81 @@ class IvecExtractor():
                self._tokenizer == other._tokenizer)
 
 
+    def bow_size(self):
+        if self._bow_size is None:
+            self._bow_size = self._tokenizer.transform([""]).shape[1]
+        return self._bow_size
+
     def zero_bows(self, nb_bows):
-        empty_docs = ["" for _ in range(nb_bows)]
-        bows = self._tokenizer.transform(empty_docs)
-        bows = torch.from_numpy(bows.A.astype(np.float32))
+        bows = torch.FloatTensor(nb_bows, self.bow_size()).zero_()
         if self._model.T.is_cuda:
             bows = bows.cuda()
         return bows
 
+    def translation_table(self, source_vocabulary):
+        """ Maps indices of `source_vocabulary` to SMM vocabulary indices.
+
+            Returns (table, mask), numpy arrays indexed by the source index.
+            mask is nonzero for indices with no exact single-word translation.
+            Tables are kept per vocabulary fingerprint and saved along with
+            the extractor, so they are only computed once.
+        """
+        fingerprint = vocab_fingerprint(source_vocabulary)
+        if fingerprint not in self._translations:
+            self._translations[fingerprint] = self._compute_translation_table(source_vocabulary)
+
+        return self._translations[fingerprint]
+
+    def _compute_translation_table(self, source_vocabulary):
+        indices = np.asarray([source_vocabulary[w] for w in source_vocabulary], dtype=np.int64)
+        bows = self._tokenizer.transform(list(source_vocabulary)).tocsr()
+
+        maxes = bows.max(axis=1).toarray().ravel().astype(np.float32)
+        argmaxes = np.asarray(bows.argmax(axis=1)).ravel().astype(np.int64)
+
+        table_size = indices.max() + 1 if len(indices) > 0 else 0
+        table = np.zeros(table_size, dtype=np.int64)
+        mask = np.ones(table_size, dtype=np.float32)  # indices not in the vocabulary never translate
+        table[indices] = argmaxes
+        mask[indices] = 1 - maxes
+
+        return table, mask
+
     def build_translator(self, source_vocabulary):  
-        maxes = []
-        argmaxes = []
-        for w in source_vocabulary:
-            bow = self._tokenizer.transform([w]) 
-            prototype = torch.from_numpy(bow.A.astype(np.float32))
-            p_max, p_argmax = prototype.max(dim=1)
-            maxes.append(p_max)
-            argmaxes.append(p_argmax)
-
-        maxes = torch.cat(maxes, dim=0)
-        argmaxes = torch.cat(argmaxes, dim=0)
+        table, mask = self.translation_table(source_vocabulary)
+        argmaxes = torch.from_numpy(table)
+        masks = torch.from_numpy(mask)
 
         if self._model.T.is_cuda:
-            maxes = maxes.cuda()
             argmaxes = argmaxes.cuda()
+            masks = masks.cuda()
 
-        return lambda W: translate(W, argmaxes, 1-maxes, prototype.size(1))
+        dst_vocab_size = self.bow_size()
+        return lambda W, bows=None: translate(W, argmaxes, masks, dst_vocab_size, bows)
 
 
-def translate(W, translation_table, translation_mask, dst_vocab_size):
-    W_flat = W.view(-1) # W was [B, T], W_flat is [BxT]
+def translate(W, translation_table, translation_mask, dst_vocab_size, bows=None):
+    """ Bags of words [B, SMM vocab_size] of word sequences W [B, T].
+
+        Words are accumulated by index_add_, so the only temporaries are
+        of the size of W. Words with a nonzero translation_mask are dropped.
+
+        Args:
+            bows (Tensor): If given, counts are added into it in place and it is returned.
+    """
+    W_flat = W.contiguous().view(-1) # W was [B, T], W_flat is [BxT]
     translation = translation_table[W_flat] # [BxT]
-    invalid_translations = translation_mask[W_flat].nonzero().view(-1) # [number of words without translation]
+    weights = (translation_mask[W_flat] == 0).float() # [BxT], 0 where no translation should ever happen
 
-    one_hot = W.new(translation.size() + (dst_vocab_size,)).float() # [BxT, SMM vocab_size]
-    one_hot.zero_()
-    one_hot.scatter_(1,translation.view(-1,1),1) 
-    if len(invalid_translations.size()) > 0:
-        one_hot[invalid_translations] = 0 # zeroes the entries where no translation should ever happen
+    seq_len = W.size(-1)
+    batch_size = W_flat.size(0) // seq_len
+    rows = torch.arange(0, batch_size).type_as(W_flat).view(-1, 1).expand(batch_size, seq_len)
+    flat_positions = rows.contiguous().view(-1) * dst_vocab_size + translation # [BxT]
 
-    one_hot_reshaped = one_hot.view(W.size() + (dst_vocab_size, )) # [B, T, SMM vocab_size]
-    return one_hot_reshaped.sum(dim=-2) # [B, SMM vocab_size]
+    if bows is None:
+        bows = weights.new(W.size()[:-1] + (dst_vocab_size, )).zero_() # [B, SMM vocab_size]
+    bows.view(-1).index_add_(0, flat_positions, weights.type_as(bows))
+    return bows
 
 
 def load(f):
@@ -146,4 +266,11 @@ def load(f):
     nb_iters_bytes.seek(0)
     nb_iters = pickle.load(nb_iters_bytes)
 
-    return IvecExtractor(model, nb_iters, lr, tokenizer)
+    extractor = IvecExtractor(model, nb_iters, lr, tokenizer)
+
+    if 'translations' in complete_lm:  # older extractors come without them
+        translations_bytes = complete_lm['translations']
+        translations_bytes.seek(0)
+        extractor._translations = pickle.load(translations_bytes)
+
+    return extractor
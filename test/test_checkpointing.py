@@ -0,0 +1,80 @@
+import io
+import os
+import tempfile
+
+import torch
+from test.common import TestCase
+
+from language_models import language_model
+from language_models.lstm_model import LSTMLanguageModel
+from language_models.vocab import Vocabulary
+from runtime.checkpointing import AsyncCheckpointWriter
+
+
+class AsyncCheckpointWriterTests(TestCase):
+    def setUp(self):
+        vocab = Vocabulary('<unk>', 0)
+        vocab.add_from_text("a b c d")
+        self.lm = language_model.LanguageModel(LSTMLanguageModel(5, 3, 4, 1), vocab)
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'model.lm')
+        self.log = io.StringIO()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def load_bias(self, path):
+        with open(path, 'rb') as f:
+            return language_model.load(f, mmap=False).model.decoder.bias.data
+
+    def test_saves_model(self):
+        writer = AsyncCheckpointWriter(self.path, output_file=self.log)
+        writer.save(self.lm)
+        writer.close()
+        self.assertTrue(torch.equal(self.load_bias(self.path), self.lm.model.decoder.bias.data))
+
+    def test_saves_quantized_model(self):
+        self.lm.quantize()
+        writer = AsyncCheckpointWriter(self.path, output_file=self.log)
+        writer.save(self.lm)
+        writer.close()
+        with open(self.path, 'rb') as f:
+            loaded = language_model.load(f, mmap=False).model
+        self.assertTrue(torch.equal(loaded.decoder.weight_int8, self.lm.model.decoder.weight_int8))
+        self.assertTrue(torch.equal(loaded.rnn.weight_hh_l0_int8, self.lm.model.rnn.weight_hh_l0_int8))
+
+    def test_snapshot_isolated_from_training(self):
+        writer = AsyncCheckpointWriter(self.path, output_file=self.log)
+        expectation = self.lm.model.decoder.bias.data.clone()
+        writer.save(self.lm)
+        self.lm.model.decoder.bias.data.fill_(7.0)
+        writer.close()
+        self.assertTrue(torch.equal(self.load_bias(self.path), expectation))
+
+    def test_keeps_last_k(self):
+        writer = AsyncCheckpointWriter(self.path, keep=2, output_file=self.log)
+        for value in [1.0, 2.0, 3.0]:
+            self.lm.model.decoder.bias.data.fill_(value)
+            writer.save(self.lm)
+        writer.close()
+
+        self.assertEqual(float(self.load_bias(self.path)[0]), 3.0)
+        self.assertEqual(float(self.load_bias(self.path + '.1')[0]), 2.0)
+        self.assertFalse(os.path.exists(self.path + '.2'))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ['model.lm', 'model.lm.1'])
+
+    def test_reports_timings(self):
+        writer = AsyncCheckpointWriter(self.path, output_file=self.log)
+        writer.save(self.lm)
+        writer.close()
+        self.assertIn("snapshot", self.log.getvalue())
+        self.assertIn("write", self.log.getvalue())
+
+    def test_error_raised_on_close(self):
+        writer = AsyncCheckpointWriter(os.path.join(self.tmp_dir.name, 'missing', 'model.lm'), output_file=self.log)
+        writer.save(self.lm)
+        self.assertRaises(OSError, writer.close)
+
+    def test_positive_keep_required(self):
+        self.assertRaises(ValueError, AsyncCheckpointWriter, self.path, 0)
@@ -0,0 +1,152 @@
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+from test.common import TestCase
+
+from data_pipeline.data import compile_corpus, tokens_from_compiled, tokens_from_file, tokens_from_fn, remap_compiled_corpus
+from data_pipeline.multistream import batchify
+from data_pipeline.temporal_splitting import TemporalSplits
+from language_models.vocab import CompactVocabulary, Vocabulary, VocabularyRemapping
+
+
+class CompiledCorpusTests(TestCase):
+    def setUp(self):
+        self.vocab = {
+            "<unk>": 0,
+            "a": 1,
+            "b": 2,
+            "c": 3,
+        }
+        self.text = "a b c\nb b\n\nc a <unk> a\n"
+
+        fd, self.fn = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.fn)
+
+    def compile(self, text, vocab, regime='words'):
+        with open(self.fn, 'wb') as out_f:
+            return compile_corpus(io.StringIO(text), vocab, out_f, regime=regime)
+
+    def test_matches_text_reading(self):
+        self.compile(self.text, self.vocab)
+        expectation = tokens_from_file(io.StringIO(self.text), self.vocab, randomize=False)
+        self.assertEqual(tokens_from_compiled(self.fn).long(), expectation)
+
+    def test_returns_number_of_tokens(self):
+        nb_tokens = self.compile(self.text, self.vocab)
+        self.assertEqual(nb_tokens, 9)
+
+    def test_small_vocab_narrow_type(self):
+        self.compile(self.text, self.vocab)
+        self.assertEqual(tokens_from_compiled(self.fn).numpy().dtype, np.int16)
+
+    def test_large_vocab_wide_type(self):
+        vocab = dict(self.vocab)
+        vocab["z"] = 2**16
+        self.compile(self.text + "z\n", vocab)
+        ids = tokens_from_compiled(self.fn)
+        self.assertEqual(ids.numpy().dtype, np.int32)
+        self.assertEqual(int(ids[-1]), 2**16)
+
+    def test_chunked_writing(self):
+        with open(self.fn, 'wb') as out_f:
+            compile_corpus(io.StringIO(self.text), self.vocab, out_f, chunk_size=2)
+        expectation = tokens_from_file(io.StringIO(self.text), self.vocab, randomize=False)
+        self.assertEqual(tokens_from_compiled(self.fn).long(), expectation)
+
+    def test_chars(self):
+        vocab = {" ": 0, "a": 1, "b": 2}
+        text = "ab a\nb\n"
+        self.compile(text, vocab, regime='chars')
+        expectation = tokens_from_file(io.StringIO(text), vocab, randomize=False, regime='chars')
+        self.assertEqual(tokens_from_compiled(self.fn, regime='chars').long(), expectation)
+
+    def test_empty(self):
+        self.compile("", self.vocab)
+        self.assertEqual(len(tokens_from_compiled(self.fn)), 0)
+
+    def test_vocab_check(self):
+        self.compile(self.text, self.vocab)
+        other_vocab = dict(self.vocab)
+        other_vocab["d"] = 4
+        self.assertRaises(ValueError, tokens_from_compiled, self.fn, other_vocab)
+
+    def test_regime_check(self):
+        self.compile(self.text, self.vocab)
+        self.assertRaises(ValueError, tokens_from_compiled, self.fn, self.vocab, 'chars')
+
+    def test_tokens_from_fn_detects_compiled(self):
+        self.compile(self.text, self.vocab)
+        expectation = tokens_from_file(io.StringIO(self.text), self.vocab, randomize=False)
+        self.assertEqual(tokens_from_fn(self.fn, self.vocab, randomize=False).long(), expectation)
+
+    def test_tokens_from_fn_refuses_shuffling(self):
+        self.compile(self.text, self.vocab)
+        self.assertRaises(ValueError, tokens_from_fn, self.fn, self.vocab, True)
+
+    def test_temporal_splits(self):
+        self.compile(self.text, self.vocab)
+        ids = tokens_from_compiled(self.fn)
+        expectation = tokens_from_file(io.StringIO(self.text), self.vocab, randomize=False)
+
+        batched = TemporalSplits(batchify(ids, 2, cuda=False), 1, 2)
+        expected_batched = TemporalSplits(batchify(expectation, 2, cuda=False), 1, 2)
+        self.assertEqual(list(batched), list(expected_batched))
+
+    def test_remapping(self):
+        vocab = CompactVocabulary.from_words(list(self.vocab), list(self.vocab.values()), "<unk>")
+        self.compile(self.text, vocab)
+        remapping = VocabularyRemapping([3, 1, 0, 2])
+
+        fd, remapped_fn = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            with open(remapped_fn, 'wb') as out_f:
+                nb_tokens = remap_compiled_corpus(self.fn, vocab, remapping, out_f)
+            remapped = tokens_from_compiled(remapped_fn, remapping.remap_vocab(vocab)).long()
+        finally:
+            os.remove(remapped_fn)
+
+        self.assertEqual(nb_tokens, 9)
+        expectation = [remapping.old2new[i] for i in tokens_from_compiled(self.fn).tolist()]
+        self.assertEqual(remapped.tolist(), expectation)
+
+    def test_temporal_splits_long(self):
+        self.compile(self.text, self.vocab)
+        x, t = next(iter(TemporalSplits(tokens_from_compiled(self.fn), 1, 2)))
+        self.assertTrue(isinstance(x, torch.LongTensor))
+        self.assertTrue(isinstance(t, torch.LongTensor))
+
+
+class CompactVocabularyReadingTests(TestCase):
+    def setUp(self):
+        self.dict_vocab = Vocabulary('<unk>', 0)
+        for i in range(20000):
+            self.dict_vocab.add_word('w{}'.format(i))
+        self.compact_vocab = CompactVocabulary.from_mapping(self.dict_vocab)
+
+        rng = np.random.RandomState(1)
+        # some of the words are out of the vocabulary
+        lines = [' '.join('w{}'.format(i) for i in rng.randint(0, 20100, size=20)) for _ in range(5000)]
+        self.text = '\n'.join(lines)
+
+    def read_time(self, vocab):
+        best = float('inf')
+        for _ in range(3):
+            start = time.time()
+            ids = tokens_from_file(io.StringIO(self.text), vocab, randomize=False)
+            best = min(best, time.time() - start)
+        return ids, best
+
+    def test_not_slower_than_dict(self):
+        # looking words up one at a time makes the compact vocabulary over 20 times slower
+        expectation, dict_time = self.read_time(self.dict_vocab)
+        ids, compact_time = self.read_time(self.compact_vocab)
+        self.assertEqual(ids, expectation)
+        self.assertLess(compact_time, 4 * dict_time)
@@ -0,0 +1,294 @@
+import io
+
+import numpy as np
+import torch
+from torch.autograd import Variable
+from test.common import TestCase
+
+from language_models import language_model
+from language_models.decoders import AdaptiveSoftmaxDecoder, ClassSoftmaxDecoder, build_decoder, frequency_classes, unigram_counts
+from language_models.decoders import bin_classes_by_frequency, blocked_logsumexp, model_ntoken, target_log_probs
+from language_models.ffnn_models import BengioModel
+from language_models.lstm_model import LSTMLanguageModel
+from language_models.smm_lstm_models import OutputBottleneckLM, OutputEnhancedLM
+from language_models.vocab import Vocabulary
+from runtime.rescoring import padded_seqs_logprob, trie_seqs_logprob
+from runtime.runtime_multifile import targets_log_probs, targets_nll
+
+
+class FrequencyClassesTests(TestCase):
+    def test_unigram_counts(self):
+        self.assertEqual(unigram_counts(torch.LongTensor([0, 2, 2, 3]), 5).tolist(), [1, 0, 2, 1, 0])
+
+    def test_frequent_words_in_small_classes(self):
+        counts = np.asarray([1, 100, 2, 50, 1, 1, 30, 5])
+        classes = frequency_classes(counts, 3)
+        self.assertEqual(classes.tolist(), [2, 0, 2, 1, 2, 2, 2, 2])
+
+    def test_no_empty_class(self):
+        counts = np.asarray([1000, 1, 1, 1])
+        classes = frequency_classes(counts, 4)
+        self.assertEqual(sorted(classes.tolist()), [0, 1, 2, 3])
+
+    def test_too_many_classes(self):
+        self.assertRaises(ValueError, frequency_classes, np.ones(3), 4)
+
+    def test_bin_classes_by_frequency(self):
+        model = LSTMLanguageModel(8, 4, 5, 1, decoder='class:3')
+        tokens = torch.LongTensor([1] * 100 + [3] * 50 + [6] * 30 + [7] * 5 + [2, 2, 0, 4, 5])
+        bin_classes_by_frequency(model.decoder, tokens, model_ntoken(model))
+        self.assertEqual(model.decoder.word2class.tolist(), [2, 0, 2, 1, 2, 2, 2, 2])
+
+    def test_binning_needs_class_decoder(self):
+        model = LSTMLanguageModel(8, 4, 5, 1)
+        self.assertRaises(ValueError, bin_classes_by_frequency, model.decoder, torch.LongTensor([1, 2]), 8)
+
+
+class ModelNtokenTests(TestCase):
+    def test_decoders(self):
+        for decoder in ['full', 'class:3', 'adaptive:4,7']:
+            self.assertEqual(model_ntoken(LSTMLanguageModel(10, 4, 5, 1, decoder=decoder)), 10)
+        self.assertEqual(model_ntoken(OutputEnhancedLM(12, 4, 5, 1, 3)), 12)
+
+
+class ClassSoftmaxDecoderTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.decoder = ClassSoftmaxDecoder(4, 9, 3)
+        self.decoder.init_weights(0.5)
+        self.decoder.set_classes([2, 0, 1, 2, 0, 2, 1, 2, 2])
+        self.x = Variable(torch.randn(6, 4))
+        self.targets = Variable(torch.LongTensor([0, 8, 4, 1, 6, 0]))
+
+    def test_normalized(self):
+        log_probs = self.decoder(self.x.view(2, 3, 4))
+        self.assertEqual(log_probs.size(), (2, 3, 9))
+        for total in log_probs.data.exp().sum(-1).view(-1):
+            self.assertAlmostEqual(float(total), 1.0)
+
+    def test_factorization(self):
+        log_probs = self.decoder(self.x).data
+        class_log_probs = torch.nn.functional.log_softmax(self.decoder.class_proj(self.x), dim=-1).data
+        members = [1, 4]
+        self.assertAlmostEqual(float(log_probs[0, members].exp().sum()), float(class_log_probs[0, 0].exp()))
+
+    def test_targets_match_full(self):
+        full = self.decoder(self.x).data.gather(1, self.targets.data.view(-1, 1)).view(-1)
+        observed = self.decoder.target_log_probs(self.x, self.targets).data
+        for o, e in zip(observed, full):
+            self.assertAlmostEqual(float(o), float(e))
+
+    def test_targets_gradient(self):
+        self.decoder.target_log_probs(self.x, self.targets).sum().backward()
+        self.assertGreater(float(self.decoder.word_proj.weight.grad.data.abs().sum()), 0.0)
+        self.assertGreater(float(self.decoder.class_proj.weight.grad.data.abs().sum()), 0.0)
+
+    def test_bad_classes(self):
+        self.assertRaises(ValueError, self.decoder.set_classes, [0] * 8)
+        self.assertRaises(ValueError, self.decoder.set_classes, [3] * 9)
+
+    def test_build_decoder(self):
+        self.assertTrue(isinstance(build_decoder('full', 4, 9), torch.nn.Linear))
+        self.assertEqual(build_decoder('class:3', 4, 9).nb_classes, 3)
+        self.assertRaises(ValueError, build_decoder, 'class:many', 4, 9)
+        self.assertRaises(ValueError, build_decoder, 'magic', 4, 9)
+
+
+class AdaptiveSoftmaxDecoderTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.decoder = AdaptiveSoftmaxDecoder(8, 12, [3, 7], div_value=2.0)
+        self.decoder.init_weights(0.5)
+        self.x = Variable(torch.randn(7, 8))
+        self.targets = Variable(torch.LongTensor([0, 5, 11, 2, 3, 7, 6]))
+
+    def test_tail_sizes(self):
+        self.assertEqual(self.decoder.head.out_features, 5)
+        self.assertEqual([tail[0].out_features for tail in self.decoder.tails], [4, 2])
+        self.assertEqual([tail[1].out_features for tail in self.decoder.tails], [4, 5])
+
+    def test_normalized(self):
+        log_probs = self.decoder(self.x.view(7, 1, 8))
+        self.assertEqual(log_probs.size(), (7, 1, 12))
+        for total in log_probs.data.exp().sum(-1).view(-1):
+            self.assertAlmostEqual(float(total), 1.0)
+
+    def test_targets_match_full(self):
+        full = self.decoder(self.x).data.gather(1, self.targets.data.view(-1, 1)).view(-1)
+        observed = self.decoder.target_log_probs(self.x, self.targets).data
+        for o, e in zip(observed, full):
+            self.assertAlmostEqual(float(o), float(e))
+
+    def test_head_only_targets(self):
+        targets = Variable(torch.LongTensor([0, 1, 2, 0, 1, 2, 0]))
+        full = self.decoder(self.x).data.gather(1, targets.data.view(-1, 1)).view(-1)
+        for o, e in zip(self.decoder.target_log_probs(self.x, targets).data, full):
+            self.assertAlmostEqual(float(o), float(e))
+
+    def test_targets_gradient(self):
+        self.decoder.target_log_probs(self.x, self.targets).sum().backward()
+        for tail in self.decoder.tails:
+            self.assertGreater(float(tail[1].weight.grad.data.abs().sum()), 0.0)
+
+    def test_bad_cutoffs(self):
+        self.assertRaises(ValueError, AdaptiveSoftmaxDecoder, 8, 12, [7, 3])
+        self.assertRaises(ValueError, AdaptiveSoftmaxDecoder, 8, 12, [3, 12])
+        self.assertRaises(ValueError, AdaptiveSoftmaxDecoder, 8, 12, [])
+
+    def test_build_decoder(self):
+        decoder = build_decoder('adaptive:3,7:2', 8, 12)
+        self.assertEqual(decoder.cutoffs, [3, 7])
+        self.assertEqual(decoder.tails[0][0].out_features, 4)
+        self.assertRaises(ValueError, build_decoder, 'adaptive:x', 8, 12)
+
+    def test_lstm_model(self):
+        self.assertRaises(ValueError, LSTMLanguageModel, 12, 4, 4, 1, tie_weights=True, decoder='adaptive:3,7')
+        model = LSTMLanguageModel(12, 4, 4, 1, dropout=0.0, decoder='adaptive:3,7')
+        model.eval()
+        seqs = [[0, 3, 4, 11], [0, 3, 5, 6, 1]]
+        for seq, trie, padded in zip(seqs, trie_seqs_logprob(model, seqs), padded_seqs_logprob(model, seqs)):
+            y, _ = model(Variable(torch.LongTensor(seq).view(-1, 1)), model.init_hidden(1))
+            expectation = sum(float(y.data[i, 0, w]) for i, w in enumerate(seq[1:]))
+            self.assertAlmostEqual(trie, expectation)
+            self.assertAlmostEqual(padded, expectation)
+
+
+class ClassDecoderModelsTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.X = Variable(torch.LongTensor([[1, 2], [3, 4], [5, 0]]))
+        self.targets = Variable(torch.LongTensor([[3, 4], [5, 0], [7, 8]]).view(-1))
+        self.ivec = Variable(torch.randn(2, 3))
+
+    def assertTargetsConsistent(self, model, *inputs):
+        model.eval()
+        output, _ = model(*inputs)
+        expectation = torch.nn.NLLLoss(size_average=False)(output.view(-1, output.size(-1)), self.targets)
+
+        args = inputs + (None,) if len(inputs) == 2 else inputs
+        nll, _ = targets_nll(model, *(args + (self.targets,)))
+        self.assertAlmostEqual(float(nll.data), float(expectation.data))
+
+    def test_lstm(self):
+        model = LSTMLanguageModel(10, 4, 4, 1, dropout=0.0, tie_weights=True, decoder='class:3')
+        self.assertTrue(model.decoder.word_proj.weight is model.encoder.weight)
+        self.assertTargetsConsistent(model, self.X, model.init_hidden(2))
+
+    def test_bengio(self):
+        model = BengioModel(10, 4, 2, 5, dropout=0.0, decoder='class:3')
+        model.eval()
+        X = Variable(torch.LongTensor([[1, 2, 3, 4], [5, 6, 7, 8]]))
+        output, _ = model(X, model.init_hidden(2))
+        features, _ = model.features(X, model.init_hidden(2))
+        targets = Variable(torch.LongTensor([4, 5, 6, 9, 0, 1]))
+        observed = model.decoder.target_log_probs(features.view(-1, 5), targets)
+        expectation = output.view(-1, 10).gather(1, targets.view(-1, 1)).view(-1)
+        for o, e in zip(observed.data, expectation.data):
+            self.assertAlmostEqual(float(o), float(e))
+
+    def test_output_enhanced(self):
+        model = OutputEnhancedLM(10, 4, 5, 1, 3, dropout=0.0, decoder='class:4')
+        self.assertEqual(model.decoder.class_proj.in_features, 8)
+        self.assertTargetsConsistent(model, self.X, model.init_hidden(2), self.ivec)
+
+    def test_output_enhanced_untied(self):
+        self.assertRaises(ValueError, OutputEnhancedLM, 10, 4, 4, 1, 3, tie_weights=True, decoder='class:4')
+
+    def test_output_bottleneck(self):
+        model = OutputBottleneckLM(10, 4, 5, 1, 3, dropout=0.0, decoder='class:4')
+        self.assertTargetsConsistent(model, self.X, model.init_hidden(2), self.ivec)
+
+    def test_full_decoder_unchanged(self):
+        model = OutputEnhancedLM(10, 4, 5, 1, 3, dropout=0.0)
+        self.assertEqual(
+            sorted(name for name, _ in model.named_parameters() if not name.startswith('rnn')),
+            ['decoder.bias', 'decoder.weight', 'encoder.weight', 'ivec_proj.bias', 'ivec_proj.weight'],
+        )
+        self.assertTargetsConsistent(model, self.X, model.init_hidden(2), self.ivec)
+
+    def test_checkpoint_keeps_classes(self):
+        model = LSTMLanguageModel(10, 4, 5, 1, dropout=0.0, decoder='class:3')
+        classes = frequency_classes(np.arange(10)[::-1] + 1, 3)
+        model.decoder.set_classes(classes)
+        vocab = Vocabulary('<unk>', 0)
+        vocab.add_from_text("a b c d e f g h i")
+
+        f = io.BytesIO()
+        language_model.LanguageModel(model, vocab).save(f)
+        f.seek(0)
+        loaded = language_model.load(f).model
+
+        self.assertEqual(loaded.decoder.word2class.tolist(), classes.tolist())
+        X = Variable(torch.LongTensor([[1], [2]]))
+        self.assertTrue(torch.equal(model(X, model.init_hidden(1))[0].data, loaded(X, loaded.init_hidden(1))[0].data))
+
+    def test_rescoring(self):
+        model = LSTMLanguageModel(10, 4, 5, 1, dropout=0.0, decoder='class:3')
+        model.eval()
+        seqs = [[0, 3, 4, 1], [0, 3, 5, 6, 1], [0, 2]]
+        for seq, trie, padded in zip(seqs, trie_seqs_logprob(model, seqs), padded_seqs_logprob(model, seqs)):
+            y, _ = model(Variable(torch.LongTensor(seq).view(-1, 1)), model.init_hidden(1))
+            expectation = sum(float(y.data[i, 0, w]) for i, w in enumerate(seq[1:]))
+            self.assertAlmostEqual(trie, expectation)
+            self.assertAlmostEqual(padded, expectation)
+
+
+class BlockedTargetLogProbsTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.X = Variable(torch.LongTensor([[1, 2], [3, 4], [5, 0]]))
+        self.targets = Variable(torch.LongTensor([[3, 4], [5, 0], [7, 8]]).view(-1))
+        self.ivec = Variable(torch.randn(2, 3))
+
+    def assertMatchesFull(self, model, *inputs):
+        model.eval()
+        output, _ = model(*inputs)
+        expectation = output.view(-1, 10).gather(1, self.targets.view(-1, 1)).view(-1).data
+        features, _ = model.features(*inputs)
+        features = features.view(-1, features.size(-1))
+        for block_size in [1, 3, 10, 64]:
+            observed = target_log_probs(model, features, self.targets, block_size).data
+            self.assertTrue(np.allclose(observed.numpy(), expectation.numpy()))
+
+    def test_logsumexp(self):
+        model = LSTMLanguageModel(10, 4, 5, 1, dropout=0.0)
+        features = Variable(torch.randn(6, 5) * 10)
+        logits = model.decoder(features).data
+        expectation = logits.max(1)[0] + (logits - logits.max(1, keepdim=True)[0]).exp().sum(1).log()
+        self.assertTrue(np.allclose(blocked_logsumexp(model, features, 4).data.numpy(), expectation.numpy()))
+
+    def test_lstm(self):
+        model = LSTMLanguageModel(10, 4, 5, 1, dropout=0.0)
+        self.assertMatchesFull(model, self.X, model.init_hidden(2))
+
+    def test_bengio(self):
+        model = BengioModel(10, 4, 1, 5, dropout=0.0)
+        self.assertMatchesFull(model, self.X.t().contiguous(), model.init_hidden(2))
+
+    def test_output_enhanced(self):
+        model = OutputEnhancedLM(10, 4, 5, 1, 3, dropout=0.0)
+        self.assertMatchesFull(model, self.X, model.init_hidden(2), self.ivec)
+
+    def test_output_bottleneck(self):
+        model = OutputBottleneckLM(10, 4, 5, 1, 3, dropout=0.0)
+        self.assertMatchesFull(model, self.X, model.init_hidden(2), self.ivec)
+
+    def test_class_decoder(self):
+        model = LSTMLanguageModel(10, 4, 5, 1, dropout=0.0, decoder='class:3')
+        self.assertMatchesFull(model, self.X, model.init_hidden(2))
+
+    def test_targets_log_probs_without_features(self):
+        class ForwardOnly(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, *inputs):
+                return self.model(*inputs)
+
+        model = OutputEnhancedLM(10, 4, 5, 1, 3, dropout=0.0)
+        model.eval()
+        inputs = (self.X, model.init_hidden(2), self.ivec, self.targets)
+        with_features, _ = targets_log_probs(model, *inputs)
+        without_features, _ = targets_log_probs(ForwardOnly(model), *inputs)
+        self.assertTrue(np.allclose(with_features.data.numpy(), without_features.data.numpy()))
@@ -0,0 +1,106 @@
+import os
+import random
+import tempfile
+
+from test.common import TestCase
+
+from data_pipeline.document_store import compile_document_store, is_document_store, DocumentStore, DocumentStoreSplits
+from data_pipeline.multistream import BatchBuilder
+from data_pipeline.temporal_splitting import TemporalSplits
+from language_models.vocab import Vocabulary
+from runtime.runtime_utils import documents_to_objects, batch_temporal_splits
+
+
+class DocumentStoreTests(TestCase):
+    def setUp(self):
+        self.documents = ["a b c a", "b b\nc", "", "c a b a b"]
+        self.vocab = Vocabulary('<unk>', 0)
+        self.vocab.add_from_text("a b c")
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filenames = []
+        for i, doc in enumerate(self.documents):
+            fn = os.path.join(self.tmp_dir.name, 'doc-{}.txt'.format(i))
+            with open(fn, 'w') as f:
+                f.write(doc)
+            self.filenames.append(fn)
+
+        self.filelist = os.path.join(self.tmp_dir.name, 'list.txt')
+        with open(self.filelist, 'w') as f:
+            f.write("\n".join(self.filenames))
+
+        self.store_fn = os.path.join(self.tmp_dir.name, 'store.bin')
+        with open(self.store_fn, 'wb') as f:
+            compile_document_store(self.filenames, self.vocab, f)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def doc_tokens(self, i):
+        return [self.vocab[w] for w in self.documents[i].split()]
+
+    def test_detection(self):
+        self.assertTrue(is_document_store(self.store_fn))
+        self.assertFalse(is_document_store(self.filelist))
+
+    def test_len(self):
+        store = DocumentStore(self.store_fn)
+        self.assertEqual(len(store), len(self.documents))
+
+    def test_documents(self):
+        store = DocumentStore(self.store_fn)
+        for i in range(len(self.documents)):
+            self.assertEqual(store[i].long().tolist(), self.doc_tokens(i))
+
+    def test_keys(self):
+        store = DocumentStore(self.store_fn)
+        self.assertEqual(store.keys, self.filenames)
+
+    def test_words(self):
+        store = DocumentStore(self.store_fn, self.vocab)
+        self.assertEqual(store.words(1), "b b c")
+
+    def test_vocab_check(self):
+        other_vocab = Vocabulary('<unk>', 0)
+        other_vocab.add_from_text("a b")
+        self.assertRaises(ValueError, DocumentStore, self.store_fn, other_vocab)
+
+    def test_offsets(self):
+        store = DocumentStore(self.store_fn)
+        self.assertEqual(store.offsets().tolist(), [0, 4, 7, 7, 12])
+
+    def test_splits_are_lazy(self):
+        built = []
+
+        def builder(tokens, i):
+            built.append(i)
+            return TemporalSplits(tokens, 1, 1)
+
+        splits = DocumentStoreSplits(DocumentStore(self.store_fn), builder)
+        self.assertEqual(built, [])
+        splits[2]
+        self.assertEqual(built, [2])
+
+    def test_shuffle_permutes_order(self):
+        random.seed(1)
+        splits = DocumentStoreSplits(DocumentStore(self.store_fn), lambda tokens, i: i)
+        splits.shuffle()
+        self.assertEqual(sorted(splits), list(range(len(self.documents))))
+        self.assertEqual(list(splits), splits.order)
+
+    def test_same_batches_as_filelist(self):
+        builder = lambda tokens, i: TemporalSplits(tokens, 1, 2)
+        from_files = documents_to_objects(self.filelist, self.vocab, builder)
+        from_store = documents_to_objects(self.store_fn, self.vocab, builder)
+        self.assertTrue(isinstance(from_store, DocumentStoreSplits))
+
+        expectation = list(BatchBuilder(from_files, 2))
+        self.assertEqual(list(BatchBuilder(from_store, 2)), expectation)
+
+    def test_planned_batches_from_store(self):
+        builder = lambda tokens, i: TemporalSplits(tokens, 1, 2)
+        from_files = documents_to_objects(self.filelist, self.vocab, builder)
+        from_store = documents_to_objects(self.store_fn, self.vocab, builder)
+
+        expectation = list(batch_temporal_splits(from_files, 1, 2, 2, discard_h=True))
+        self.assertEqual(list(batch_temporal_splits(from_store, 1, 2, 2, discard_h=True)), expectation)
@@ -231,3 +231,29 @@ class ParalelIvecAppenderTests(TestCase):
         self.assertEqual(obs_stream[1], exp_stream[1])
         self.assertEqual(obs_stream[2], exp_stream[2])
         self.assertEqual(obs_stream[3], exp_stream[3])
+
+    def test_refinement_without_iterations_carries_ivecs(self):
+        ws = [self.vocab[w] for w in self.vocab]
+
+        xs = [
+            torch.LongTensor([[ws[0], ws[1]], [ws[0], ws[2]]]),
+            torch.LongTensor([[ws[2], ws[3]], [ws[4], ws[6]]]),
+            torch.LongTensor([[ws[4], ws[5]], [ws[0], ws[1]]]),
+        ]
+        ts = [x + 1 for x in xs]
+        masks = [
+            torch.LongTensor([]),
+            torch.LongTensor([1]),
+            torch.LongTensor([1, 0]),
+        ]
+
+        stream = zip(xs, ts, masks)
+        ivec_appender = ivec_appenders.ParalelIvecAppender(
+            stream, self.extractor, self.translator, refinement_iters=0
+        )
+        obs_ivecs = [ivecs for x, t, ivecs, mask in ivec_appender]
+
+        empty_ivec = self.extractor(self.extractor.zero_bows(1))
+        self.assertEqual(obs_ivecs[0], torch.stack([empty_ivec, empty_ivec]))
+        self.assertEqual(obs_ivecs[1], torch.stack([obs_ivecs[0][1], empty_ivec]))
+        self.assertEqual(obs_ivecs[2], torch.stack([obs_ivecs[1][1], obs_ivecs[1][0]]))
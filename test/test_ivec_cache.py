@@ -0,0 +1,89 @@
+import glob
+import os
+import tempfile
+
+import numpy as np
+import torch
+from test.common import TestCase
+
+from smm_itf.ivec_cache import IvecCache, document_key
+
+
+class LengthExtractor():
+    def __init__(self, nb_iters=10):
+        self.nb_iters = nb_iters
+        self.extracted = []
+
+    def fingerprint(self):
+        return "length-{}".format(self.nb_iters)
+
+    def extract_batch(self, documents, chunk_size=None):
+        self.extracted.extend(documents)
+        return torch.FloatTensor([[len(doc.split()), self.nb_iters] for doc in documents])
+
+
+class IvecCacheTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.documents = ["a b c", "d", "a b c d e"]
+        self.expectation = np.asarray([[3, 10], [1, 10], [5, 10]], dtype=np.float32)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_document_key_ignores_layout(self):
+        self.assertEqual(document_key("a b\nc"), document_key(" a  b c\n"))
+        self.assertNotEqual(document_key("a b c"), document_key("a c b"))
+
+    def test_extraction(self):
+        cache = IvecCache(self.tmp_dir.name, LengthExtractor())
+        ivecs = cache.extract_batch(self.documents)
+        self.assertTrue(np.array_equal(ivecs.numpy(), self.expectation))
+
+    def test_single_document(self):
+        cache = IvecCache(self.tmp_dir.name, LengthExtractor())
+        self.assertTrue(np.array_equal(cache("a b c").numpy(), self.expectation[0]))
+
+    def test_duplicates_extracted_once(self):
+        extractor = LengthExtractor()
+        cache = IvecCache(self.tmp_dir.name, extractor)
+        cache.extract_batch(["a b", "a  b", "c"])
+        self.assertEqual(extractor.extracted, ["a b", "c"])
+
+    def test_persistence(self):
+        IvecCache(self.tmp_dir.name, LengthExtractor()).extract_batch(self.documents)
+
+        extractor = LengthExtractor()
+        cache = IvecCache(self.tmp_dir.name, extractor)
+        ivecs = cache.extract_batch(self.documents[::-1])
+        self.assertEqual(extractor.extracted, [])
+        self.assertTrue(np.array_equal(ivecs.numpy(), self.expectation[::-1]))
+
+    def test_partial_hit(self):
+        IvecCache(self.tmp_dir.name, LengthExtractor()).extract_batch(self.documents[:2])
+
+        extractor = LengthExtractor()
+        ivecs = IvecCache(self.tmp_dir.name, extractor).extract_batch(self.documents)
+        self.assertEqual(extractor.extracted, self.documents[2:])
+        self.assertTrue(np.array_equal(ivecs.numpy(), self.expectation))
+
+    def test_fingerprint_invalidates(self):
+        IvecCache(self.tmp_dir.name, LengthExtractor()).extract_batch(self.documents)
+
+        extractor = LengthExtractor(nb_iters=3)
+        ivecs = IvecCache(self.tmp_dir.name, extractor).extract_batch(self.documents)
+        self.assertEqual(extractor.extracted, self.documents)
+        self.assertEqual(ivecs[0].tolist(), [3, 3])
+
+    def test_eviction(self):
+        cache = IvecCache(self.tmp_dir.name, LengthExtractor(), max_bytes=1)
+        first = cache.extract_batch(self.documents[:1])
+        cache.extract_batch(self.documents[1:])
+
+        segments = glob.glob(os.path.join(self.tmp_dir.name, '*', '*.ivecs'))
+        self.assertEqual(len(segments), 1)
+        self.assertTrue(np.array_equal(cache.extract_batch(self.documents[:1]).numpy(), first.numpy()))
+
+    def test_empty(self):
+        cache = IvecCache(self.tmp_dir.name, LengthExtractor())
+        self.assertEqual(len(cache.extract_batch([])), 0)
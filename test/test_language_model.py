@@ -0,0 +1,134 @@
+import io
+import os
+import tempfile
+
+import unittest
+
+import torch
+import torch.nn as nn
+from test.common import TestCase
+
+from language_models import language_model
+from language_models.lstm_model import LSTMLanguageModel
+from language_models.smm_lstm_models import OutputBottleneckLM
+from language_models.vocab import Vocabulary, CompactVocabulary
+
+
+@language_model.registered_model
+class ViewingModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.register_buffer('full', torch.arange(0, 12).float().view(4, 3))
+        self.register_buffer('head', self.full[:2])
+
+
+class CheckpointTests(TestCase):
+    def setUp(self):
+        self.vocab = Vocabulary('<unk>', 0)
+        self.vocab.add_from_text("a b c d")
+
+        fd, self.fn = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.fn)
+
+    def round_trip(self, model):
+        with open(self.fn, 'wb') as f:
+            language_model.LanguageModel(model, self.vocab).save(f)
+        with open(self.fn, 'rb') as f:
+            return language_model.load(f)
+
+    def assertSameParameters(self, model, loaded):
+        expected = model.state_dict()
+        observed = loaded.state_dict()
+        self.assertEqual(sorted(observed.keys()), sorted(expected.keys()))
+        for name in expected:
+            self.assertTrue(torch.equal(observed[name], expected[name]), name)
+
+    def test_format(self):
+        with open(self.fn, 'wb') as f:
+            language_model.LanguageModel(LSTMLanguageModel(5, 3, 4, 2), self.vocab).save(f)
+        with open(self.fn, 'rb') as f:
+            self.assertEqual(f.read(len(language_model.CHECKPOINT_MAGIC)), language_model.CHECKPOINT_MAGIC)
+
+    def test_round_trip(self):
+        model = LSTMLanguageModel(5, 3, 4, 2, dropout=0.1)
+        lm = self.round_trip(model)
+        self.assertTrue(isinstance(lm.model, LSTMLanguageModel))
+        self.assertEqual(lm.model.init_kwargs, model.init_kwargs)
+        self.assertSameParameters(model, lm.model)
+
+    def test_vocab(self):
+        lm = self.round_trip(LSTMLanguageModel(5, 3, 4, 2))
+        self.assertTrue(isinstance(lm.vocab, CompactVocabulary))
+        self.assertEqual(dict(lm.vocab), dict(self.vocab))
+        self.assertEqual(lm.vocab['nonexistent'], 0)
+
+    def test_load_vocab(self):
+        self.round_trip(LSTMLanguageModel(5, 3, 4, 2))
+        vocab = language_model.load_vocab(self.fn)
+        self.assertTrue(isinstance(vocab, CompactVocabulary))
+        self.assertEqual(dict(vocab), dict(self.vocab))
+
+    def test_tied_weights(self):
+        model = LSTMLanguageModel(5, 4, 4, 1, tie_weights=True)
+        lm = self.round_trip(model)
+        self.assertTrue(lm.model.encoder.weight is lm.model.decoder.weight)
+        self.assertSameParameters(model, lm.model)
+
+    def test_views_stored_apart(self):
+        model = ViewingModel()
+        self.assertEqual(len(language_model.checkpoint_tensors(model)), 2)
+        model.full.mul_(-1)
+        lm = self.round_trip(model)
+        self.assertSameParameters(model, lm.model)
+
+    @unittest.skipUnless(hasattr(torch.device, '__enter__'), "no meta device in this PyTorch")
+    def test_load_skips_initialization(self):
+        model = LSTMLanguageModel(50, 30, 40, 2, decoder='class:4')
+        torch.manual_seed(3)
+        expected = torch.rand(1)
+        torch.manual_seed(3)
+        self.round_trip(model)
+        self.assertEqual(torch.rand(1), expected)
+
+    def test_weight_norm(self):
+        model = OutputBottleneckLM(5, 3, 4, 1, ivec_dim=2)
+        lm = self.round_trip(model)
+        self.assertSameParameters(model, lm.model)
+
+    def test_parameters_writable(self):
+        lm = self.round_trip(LSTMLanguageModel(5, 3, 4, 2))
+        lm.model.decoder.bias.data.fill_(1.0)
+        with open(self.fn, 'rb') as f:
+            self.assertFalse(torch.equal(language_model.load(f).model.decoder.bias.data, lm.model.decoder.bias.data))
+
+    def test_save_over_source(self):
+        model = LSTMLanguageModel(5, 3, 4, 2)
+        self.round_trip(model)
+        with open(self.fn, 'rb') as f:
+            lm = language_model.load(f, mmap=False)
+        with open(self.fn, 'wb') as f:
+            lm.save(f)
+        with open(self.fn, 'rb') as f:
+            self.assertSameParameters(model, language_model.load(f).model)
+
+    def test_from_stream(self):
+        model = LSTMLanguageModel(5, 3, 4, 2)
+        f = io.BytesIO()
+        language_model.LanguageModel(model, self.vocab).save(f)
+        f.seek(0)
+        self.assertSameParameters(model, language_model.load(f).model)
+
+    def test_unknown_class(self):
+        model = LSTMLanguageModel(5, 3, 4, 2)
+        with open(self.fn, 'wb') as f:
+            language_model.LanguageModel(model, self.vocab).save(f)
+
+        del language_model.MODEL_CLASSES['LSTMLanguageModel']
+        try:
+            self.assertRaises(ValueError, language_model.load_checkpoint, self.fn)
+        finally:
+            language_model.MODEL_CLASSES['LSTMLanguageModel'] = LSTMLanguageModel
+
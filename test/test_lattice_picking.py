@@ -0,0 +1,74 @@
+import io
+import os
+import tempfile
+
+from test.common import TestCase
+
+from runtime.lattice_picking import index_latts, pick_indexed, pick_sequential
+
+
+LATTICES = [
+    ('utt-a', '1', '0 1 hello 1.0,2.0,\n1 2 world 0.5,0.1,\n2\n'),
+    ('utt-a', '2', '0 1 yellow 1.5,2.0,\n1\n'),
+    ('utt-b', '1', '0 1 good 1.0,1.0,\n1\n'),
+    ('utt-b', '2', '0 1 goods 2.0,1.0,\n1\n'),
+    ('utt-b', '3', '0 1 could 3.0,1.0,\n1\n'),
+    ('utt-c', '1', '0\n'),
+]
+
+
+class LatticePickingTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.latts_fn = os.path.join(self.tmp_dir.name, 'latts.txt')
+        self.archive = ''.join('{}-{}\n{}\n'.format(seg, trans, content) for seg, trans, content in LATTICES)
+        with open(self.latts_fn, 'w') as f:
+            f.write(self.archive)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def expectation(self, picks):
+        contents = {(seg, trans): content for seg, trans, content in LATTICES}
+        return ''.join('{}\n{}\n\n'.format(seg, contents[(seg, trans)]) for seg, trans in picks)
+
+    def pick_indexed(self, picks, latts_fn=None):
+        out_f = io.BytesIO()
+        p_f = io.StringIO(''.join('{} {}\n'.format(seg, trans) for seg, trans in picks))
+        unserved = pick_indexed(p_f, latts_fn or self.latts_fn, out_f)
+        return unserved, out_f.getvalue().decode('utf-8')
+
+    def test_index(self):
+        index = index_latts(self.archive.encode('utf-8'))
+        self.assertEqual(sorted(index.keys()), sorted((seg, trans) for seg, trans, _ in LATTICES))
+        start, end = index[('utt-b', '2')]
+        self.assertEqual(self.archive[start:end], '0 1 goods 2.0,1.0,\n1\n')
+
+    def test_same_as_sequential(self):
+        picks = [('utt-a', '2'), ('utt-b', '3'), ('utt-c', '1')]
+        p_f = io.StringIO(''.join('{} {}\n'.format(seg, trans) for seg, trans in picks))
+        out_f = io.StringIO()
+        self.assertEqual(pick_sequential(p_f, io.StringIO(self.archive), out_f), 0)
+
+        unserved, observed = self.pick_indexed(picks)
+        self.assertEqual(unserved, 0)
+        self.assertEqual(observed, out_f.getvalue())
+        self.assertEqual(observed, self.expectation(picks))
+
+    def test_out_of_order(self):
+        picks = [('utt-c', '1'), ('utt-a', '1'), ('utt-b', '2')]
+        unserved, observed = self.pick_indexed(picks)
+        self.assertEqual(unserved, 0)
+        self.assertEqual(observed, self.expectation(picks))
+
+    def test_missing_picks_unserved(self):
+        unserved, observed = self.pick_indexed([('utt-a', '3'), ('utt-b', '1'), ('utt-d', '1')])
+        self.assertEqual(unserved, 2)
+        self.assertEqual(observed, self.expectation([('utt-b', '1')]))
+
+    def test_empty_archive(self):
+        empty_fn = os.path.join(self.tmp_dir.name, 'empty.txt')
+        open(empty_fn, 'w').close()
+        unserved, observed = self.pick_indexed([('utt-a', '1')], empty_fn)
+        self.assertEqual(unserved, 1)
+        self.assertEqual(observed, '')
@@ -1,4 +1,5 @@
-from data_pipeline.multistream import BatchBuilder
+from data_pipeline.multistream import BatchBuilder, PlannedBatchBuilder
+from data_pipeline.temporal_splitting import TemporalSplits
 import data_pipeline.split_corpus_dataset as split_corpus_dataset
 import smm_itf.ivec_appenders as ivec_appenders
 
@@ -422,3 +423,62 @@ class BatchBuilderTest(TestCase):
         )
 
         self.assertEqual(batch, expectation)
+
+
+class PlannedBatchBuilderTests(TestCase):
+    def setUp(self):
+        self.doc_lens = [5, 1, 9, 0, 3, 12, 4, 7, 2, 8]
+        self.docs = [torch.LongTensor(l).random_(0, 50) for l in self.doc_lens]
+
+        offsets = [0]
+        for l in self.doc_lens:
+            offsets.append(offsets[-1] + l)
+        self.offsets = offsets
+        self.tokens = torch.cat([d for d in self.docs if len(d) > 0])
+
+    def reference(self, nb_inputs, nb_targets, bsz, discard_h, order=None, start_step=0):
+        if order is None:
+            order = range(len(self.docs))
+        tss = [TemporalSplits(self.docs[i], nb_inputs, nb_targets) for i in order]
+        return list(BatchBuilder(tss, bsz, discard_h=discard_h, start_step=start_step))
+
+    def planned(self, nb_inputs, nb_targets, bsz, discard_h, order=None, start_step=0):
+        return list(PlannedBatchBuilder(
+            self.tokens, self.offsets, nb_inputs, nb_targets, bsz,
+            discard_h=discard_h, order=order, start_step=start_step
+        ))
+
+    def test_matches_batch_builder(self):
+        for nb_inputs, nb_targets, bsz in [(1, 1, 1), (1, 2, 3), (1, 3, 2), (3, 1, 4), (2, 2, 20)]:
+            expectation = self.reference(nb_inputs, nb_targets, bsz, True)
+            self.assertEqual(self.planned(nb_inputs, nb_targets, bsz, True), expectation)
+
+    def test_matches_batch_builder_no_discard(self):
+        for nb_inputs, nb_targets, bsz in [(1, 1, 1), (1, 2, 3), (3, 1, 4)]:
+            expectation = self.reference(nb_inputs, nb_targets, bsz, False)
+            self.assertEqual(self.planned(nb_inputs, nb_targets, bsz, False), expectation)
+
+    def test_matches_batch_builder_order(self):
+        order = [5, 2, 9, 0, 1, 3, 8, 7, 6, 4]
+        expectation = self.reference(1, 2, 3, True, order)
+        self.assertEqual(self.planned(1, 2, 3, True, order), expectation)
+
+    def test_start_step(self):
+        complete = self.reference(1, 2, 3, False)
+        for start_step in [0, 1, 4, len(complete), len(complete) + 1]:
+            self.assertEqual(self.reference(1, 2, 3, False, start_step=start_step), complete[start_step:])
+            self.assertEqual(self.planned(1, 2, 3, False, start_step=start_step), complete[start_step:])
+
+    def test_len(self):
+        expectation = self.reference(1, 2, 3, True)
+        batches = PlannedBatchBuilder(self.tokens, self.offsets, 1, 2, 3)
+        self.assertEqual(len(batches), len(expectation))
+
+    def test_narrow_tokens(self):
+        expectation = self.reference(1, 2, 3, True)
+        batches = list(PlannedBatchBuilder(self.tokens.short(), self.offsets, 1, 2, 3))
+        self.assertTrue(isinstance(batches[0][0], torch.LongTensor))
+        self.assertEqual(batches, expectation)
+
+    def test_requires_nonzero_bsz(self):
+        self.assertRaises(ValueError, PlannedBatchBuilder, self.tokens, self.offsets, 1, 1, 0)
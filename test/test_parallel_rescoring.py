@@ -0,0 +1,142 @@
+import io
+import os
+import tempfile
+import time
+
+import torch
+from test.common import TestCase
+
+from language_models import language_model
+from language_models.language_model import registered_model
+from language_models.lstm_model import LSTMLanguageModel
+from language_models.vocab import Vocabulary
+from runtime.parallel_rescoring import ParallelRescorer, score_segments
+from runtime.rescoring import trie_seqs_logprob
+
+
+@registered_model
+class CrashingLM(LSTMLanguageModel):
+    """ Kills its process at use, until `marker_dir` holds `nb_crashes` files. """
+    def __init__(self, ntoken, ninp, nhid, nlayers, marker_dir, nb_crashes=1, dropout=0.0):
+        super().__init__(ntoken, ninp, nhid, nlayers, dropout=dropout)
+        self.marker_dir = marker_dir
+        self.nb_crashes = nb_crashes
+
+    def features(self, input, hidden):
+        if len(os.listdir(self.marker_dir)) < self.nb_crashes:
+            os.close(tempfile.mkstemp(dir=self.marker_dir)[0])
+            os._exit(1)
+        return super().features(input, hidden)
+
+
+@registered_model
+class PoisonedLM(LSTMLanguageModel):
+    """ Kills its process whenever it sees word `poison`, takes a while on word `slow`. """
+    def __init__(self, ntoken, ninp, nhid, nlayers, poison, slow, dropout=0.0):
+        super().__init__(ntoken, ninp, nhid, nlayers, dropout=dropout)
+        self.poison = poison
+        self.slow = slow
+
+    def features(self, input, hidden):
+        if bool((input.data == self.poison).any()):
+            os._exit(1)
+        if bool((input.data == self.slow).any()):
+            time.sleep(0.5)
+        return super().features(input, hidden)
+
+
+class ParallelRescoringTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.model_fn = os.path.join(self.tmp_dir.name, 'model.lm')
+        self.vocab = Vocabulary('<unk>', 0)
+        self.vocab.add_from_text("a b c d e f g h i")
+
+        self.segments = [
+            ('utt{}'.format(i), {'1': [0, 3, 4, 1], '2': [0, 3, 5, 6, 1], '3': [0, 2 + i, 1]})
+            for i in range(7)
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def save(self, model):
+        model.eval()
+        with open(self.model_fn, 'wb') as f:
+            language_model.LanguageModel(model, self.vocab).save(f)
+        return model
+
+    def expectation(self, model):
+        scores = []
+        for segment, utts in self.segments:
+            keys = [segment + '-' + trans_id for trans_id in utts]
+            scores.extend(zip(keys, trie_seqs_logprob(model, list(utts.values()))))
+        return scores
+
+    def assertScores(self, observed, expectation):
+        self.assertEqual([key for key, score in observed], [key for key, score in expectation])
+        for (_, o), (_, e) in zip(observed, expectation):
+            self.assertAlmostEqual(o, e, places=4)
+
+    def test_score_segments_engines(self):
+        model = LSTMLanguageModel(10, 4, 5, 1, dropout=0.0)
+        model.eval()
+        for engine in ['trie', 'padded', 'bucketed']:
+            self.assertScores(score_segments(model, self.segments, engine, 20), self.expectation(model))
+
+    def test_unknown_engine(self):
+        model = LSTMLanguageModel(10, 4, 5, 1, dropout=0.0)
+        self.assertRaises(ValueError, score_segments, model, self.segments, 'magic', 20)
+
+    def test_order(self):
+        model = self.save(LSTMLanguageModel(10, 4, 5, 1, dropout=0.0))
+        rescorer = ParallelRescorer(self.model_fn, 3, 'trie', 20, report_file=io.StringIO())
+        groups = [self.segments[i:i+2] for i in range(0, len(self.segments), 2)]
+        self.assertScores(list(rescorer(groups)), self.expectation(model))
+
+    def test_report(self):
+        self.save(LSTMLanguageModel(10, 4, 5, 1, dropout=0.0))
+        report = io.StringIO()
+        rescorer = ParallelRescorer(self.model_fn, 2, 'padded', 20, report_file=report)
+        list(rescorer([self.segments]))
+        rescorer.report()
+        self.assertIn("hyps/s", report.getvalue())
+
+    def crashing_model(self, nb_crashes):
+        marker_dir = os.path.join(self.tmp_dir.name, 'crashes')
+        os.mkdir(marker_dir)
+        return self.save(CrashingLM(10, 4, 5, 1, marker_dir=marker_dir, nb_crashes=nb_crashes)), marker_dir
+
+    def test_worker_crash(self):
+        model, marker_dir = self.crashing_model(1)
+        report = io.StringIO()
+        rescorer = ParallelRescorer(self.model_fn, 2, 'trie', 20, report_file=report)
+        observed = list(rescorer([self.segments[:3], self.segments[3:]]))
+
+        model.nb_crashes = 0
+        self.assertScores(observed, self.expectation(model))
+        self.assertIn("restarting", report.getvalue())
+
+    def test_unrelated_crashes(self):
+        model, marker_dir = self.crashing_model(2)
+        # a single worker crashes twice in a row, each time on a different group
+        rescorer = ParallelRescorer(self.model_fn, 1, 'trie', 20, max_attempts=2, report_file=io.StringIO())
+        observed = list(rescorer([self.segments[i:i+1] for i in range(len(self.segments))]))
+
+        model.nb_crashes = 0
+        self.assertScores(observed, self.expectation(model))
+        self.assertEqual(len(os.listdir(marker_dir)), 2)
+
+    def test_crashing_group_named(self):
+        # the first group is still running when the second one crashes the pool
+        self.segments[0][1]['2'] = [0, 8, 1]
+        self.segments[2][1]['2'] = [0, 9, 1]
+        self.save(PoisonedLM(10, 4, 5, 1, poison=9, slow=8))
+        rescorer = ParallelRescorer(self.model_fn, 2, 'trie', 20, report_file=io.StringIO())
+        groups = [self.segments[i:i+2] for i in range(0, len(self.segments), 2)]
+        with self.assertRaisesRegex(RuntimeError, 'utt2'):
+            list(rescorer(groups))
+
+    def test_positive_jobs_required(self):
+        self.assertRaises(ValueError, ParallelRescorer, self.model_fn, 0, 'trie', 20)
@@ -0,0 +1,221 @@
+import copy
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.autograd import Variable
+from test.common import TestCase
+
+from language_models import language_model
+from language_models.decoders import target_log_probs
+from language_models.ffnn_models import BengioModel
+from language_models.lstm_model import LSTMLanguageModel
+from language_models.quantization import QuantizedEmbedding, QuantizedLinear, QuantizedLSTM
+from language_models.quantization import int8_kernels_available, is_quantized, quantize_model, quantize_per_channel
+from language_models.quantization import _pack
+from language_models.smm_lstm_models import OutputEnhancedLM
+from language_models.vocab import Vocabulary
+
+
+class QuantizePerChannelTests(TestCase):
+    def test_error_bound(self):
+        torch.manual_seed(1)
+        weight = torch.randn(6, 10) * torch.Tensor([0.01, 0.1, 1, 10, 100, 1000]).unsqueeze(1)
+        quantized, scale = quantize_per_channel(weight)
+        self.assertEqual(quantized.type(), 'torch.CharTensor')
+        error = (quantized.float() * scale.unsqueeze(1) - weight).abs()
+        self.assertTrue(bool((error <= scale.unsqueeze(1) / 2 + 1e-6).all()))
+
+    def test_zero_row(self):
+        quantized, scale = quantize_per_channel(torch.zeros(2, 3))
+        self.assertEqual(int(quantized.abs().sum()), 0)
+        self.assertEqual(scale.tolist(), [1.0, 1.0])
+
+
+class QuantizedModulesTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+
+    def assertClose(self, observed, expected, atol=0.05):
+        self.assertTrue(np.allclose(observed.data.numpy(), expected.data.numpy(), atol=atol))
+
+    def test_linear(self):
+        linear = nn.Linear(5, 4)
+        x = Variable(torch.randn(3, 5))
+        quantized = QuantizedLinear.from_float(linear)
+        self.assertClose(quantized(x), linear(x))
+
+        weight, bias = quantized.rows(Variable(torch.LongTensor([3, 1])))
+        self.assertClose(weight, linear.weight[torch.LongTensor([3, 1])])
+        weight, bias = quantized.block(1, 3)
+        self.assertClose(weight, linear.weight[1:3])
+        self.assertEqual(bias.size(0), 2)
+
+    def test_embedding(self):
+        embedding = nn.Embedding(7, 3)
+        X = Variable(torch.LongTensor([[1, 2], [6, 0]]))
+        self.assertClose(QuantizedEmbedding.from_float(embedding)(X), embedding(X))
+
+    def test_lstm(self):
+        lstm = nn.LSTM(3, 4, 2)
+        X = Variable(torch.randn(5, 2, 3))
+        hidden = (Variable(torch.randn(2, 2, 4)), Variable(torch.randn(2, 2, 4)))
+        output, (h, c) = lstm(X, hidden)
+        q_output, (q_h, q_c) = QuantizedLSTM.from_float(lstm)(X, hidden)
+        self.assertClose(q_output, output)
+        self.assertClose(q_h, h)
+        self.assertClose(q_c, c)
+
+    def test_block_logits(self):
+        quantized = QuantizedLinear.from_float(nn.Linear(5, 9))
+        x = Variable(torch.randn(3, 5))
+        full = quantized(x)
+        self.assertClose(quantized.block_logits(x, 2, 6), full[:, 2:6], atol=1e-5)
+
+    def test_dequantized_path(self):
+        # float64 inputs have no int8 kernels, weights are dequantized instead
+        lstm = nn.LSTM(3, 4, 2).double()
+        X = Variable(torch.randn(5, 2, 3).double())
+        hidden = (Variable(torch.randn(2, 2, 4).double()), Variable(torch.randn(2, 2, 4).double()))
+        output, _ = lstm(X, hidden)
+        q_output, _ = QuantizedLSTM.from_float(lstm)(X, hidden)
+        self.assertClose(q_output, output)
+
+        linear = nn.Linear(5, 4).double()
+        x = Variable(torch.randn(3, 5).double())
+        self.assertClose(QuantizedLinear.from_float(linear)(x), linear(x))
+
+    @unittest.skipUnless(int8_kernels_available(), "no int8 kernels in this PyTorch")
+    def test_packed_weights_exact(self):
+        weight = torch.randn(50, 8) * torch.rand(50, 1) * 10
+        quantized, scale = quantize_per_channel(weight)
+        packed_weight, _ = torch.ops.quantized.linear_unpack(_pack(quantized, scale, torch.zeros(50)))
+        self.assertTrue(torch.equal(packed_weight.int_repr(), quantized))
+
+    @unittest.skipUnless(int8_kernels_available(), "no int8 kernels in this PyTorch")
+    def test_repacked_after_load(self):
+        linear = QuantizedLinear.from_float(nn.Linear(5, 4))
+        x = torch.randn(3, 5)
+        linear(x)
+        linear.weight_int8 = torch.zeros(4, 5).char()
+        self.assertTrue(np.allclose(linear(x).data.numpy(), linear.bias.data.unsqueeze(0).expand(3, 4).numpy()))
+
+    def test_batch_first_lstm(self):
+        self.assertRaises(ValueError, QuantizedLSTM.from_float, nn.LSTM(3, 4, batch_first=True))
+
+
+class QuantizeModelTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.X = Variable(torch.LongTensor([[1, 2], [3, 4], [5, 0]]))
+        self.targets = Variable(torch.LongTensor([3, 4, 5, 0, 7, 8]))
+
+    def assertQuantizedMatches(self, model, X):
+        model.eval()
+        quantized = quantize_model(copy.deepcopy(model))
+        self.assertTrue(is_quantized(quantized))
+        self.assertFalse(is_quantized(model))
+
+        expected, _ = model(X, model.init_hidden(2))
+        observed, _ = quantized(X, quantized.init_hidden(2))
+        self.assertTrue(np.allclose(observed.data.numpy(), expected.data.numpy(), atol=0.05))
+
+        features, _ = quantized.features(X, quantized.init_hidden(2))
+        features = features.view(-1, features.size(-1))
+        lse_observed = target_log_probs(quantized, features, self.targets, 3).data
+        lse_expected = observed.view(-1, 10).gather(1, self.targets.view(-1, 1)).view(-1).data
+        self.assertTrue(np.allclose(lse_observed.numpy(), lse_expected.numpy(), atol=1e-5))
+        return quantized
+
+    def test_lstm(self):
+        quantized = self.assertQuantizedMatches(LSTMLanguageModel(10, 4, 5, 2, dropout=0.0), self.X)
+        self.assertTrue(isinstance(quantized.rnn, QuantizedLSTM))
+        self.assertTrue(isinstance(quantized.decoder, QuantizedLinear))
+
+    def test_tied(self):
+        quantized = self.assertQuantizedMatches(LSTMLanguageModel(10, 5, 5, 1, dropout=0.0, tie_weights=True), self.X)
+        self.assertTrue(quantized.decoder.weight_int8 is quantized.encoder.weight_int8)
+
+    def test_bengio(self):
+        quantized = self.assertQuantizedMatches(BengioModel(10, 4, 1, 5, dropout=0.0), self.X.t().contiguous())
+        self.assertTrue(all(isinstance(e2h, QuantizedLinear) for e2h in quantized.emb2h))
+
+    def test_class_decoder_kept(self):
+        model = LSTMLanguageModel(10, 4, 5, 1, dropout=0.0, decoder='class:3')
+        quantized = self.assertQuantizedMatches(model, self.X)
+        self.assertTrue(isinstance(quantized.decoder.word_proj, nn.Linear))
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, quantize_model, OutputEnhancedLM(10, 4, 5, 1, 3))
+        model = quantize_model(LSTMLanguageModel(10, 4, 5, 1))
+        self.assertRaises(ValueError, quantize_model, model)
+
+
+class QuantizedCheckpointTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.vocab = Vocabulary('<unk>', 0)
+        self.vocab.add_from_text("a b c d e f g h i")
+
+        fd, self.fn = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.fn)
+
+    def round_trip(self, lm):
+        with open(self.fn, 'wb') as f:
+            lm.save(f)
+        with open(self.fn, 'rb') as f:
+            return language_model.load(f)
+
+    def assertSameOutputs(self, model, loaded, X):
+        model.eval()
+        loaded.eval()
+        expected, _ = model(X, model.init_hidden(2))
+        observed, _ = loaded(X, loaded.init_hidden(2))
+        self.assertTrue(torch.equal(observed.data, expected.data))
+
+    def test_round_trip(self):
+        lm = language_model.LanguageModel(LSTMLanguageModel(10, 4, 5, 2), self.vocab)
+        lm.quantize()
+        loaded = self.round_trip(lm)
+        self.assertTrue(isinstance(loaded.model.rnn, QuantizedLSTM))
+        self.assertEqual(loaded.model.decoder.weight_int8.type(), 'torch.CharTensor')
+        self.assertSameOutputs(lm.model, loaded.model, Variable(torch.LongTensor([[1, 2], [3, 4]])))
+
+    def test_tied(self):
+        lm = language_model.LanguageModel(LSTMLanguageModel(10, 5, 5, 1, tie_weights=True), self.vocab)
+        lm.quantize()
+        loaded = self.round_trip(lm)
+        self.assertTrue(loaded.model.decoder.weight_int8 is loaded.model.encoder.weight_int8)
+        self.assertSameOutputs(lm.model, loaded.model, Variable(torch.LongTensor([[1, 2], [3, 4]])))
+
+    def test_bengio(self):
+        lm = language_model.LanguageModel(BengioModel(10, 4, 2, 5), self.vocab)
+        lm.quantize()
+        loaded = self.round_trip(lm)
+        self.assertSameOutputs(lm.model, loaded.model, Variable(torch.LongTensor([[1, 2, 3], [3, 4, 5]])))
+
+    def test_smaller(self):
+        model = LSTMLanguageModel(200, 32, 32, 1)
+        with open(self.fn, 'wb') as f:
+            language_model.LanguageModel(model, self.vocab).save(f)
+        float_size = os.path.getsize(self.fn)
+
+        lm = language_model.LanguageModel(model, self.vocab)
+        lm.quantize()
+        with open(self.fn, 'wb') as f:
+            lm.save(f)
+        self.assertLess(os.path.getsize(self.fn), float_size / 2.5)
+
+    def test_float_checkpoint_version(self):
+        with open(self.fn, 'wb') as f:
+            language_model.LanguageModel(LSTMLanguageModel(10, 4, 5, 1), self.vocab).save(f)
+        with open(self.fn, 'rb') as f:
+            header, _ = language_model.read_binary_header(f, language_model.CHECKPOINT_MAGIC)
+        self.assertEqual(header['version'], 1)
+        self.assertEqual(header['quantization'], None)
@@ -0,0 +1,119 @@
+import math
+
+import torch
+from torch.autograd import Variable
+from test.common import TestCase
+
+from language_models.lstm_model import LSTMLanguageModel
+from runtime.rescoring import PrefixTrie, trie_seqs_logprob, padded_seqs_logprob
+from runtime.rescoring import length_buckets, bucketed_seqs_logprob, stream_rescore, seqs_to_tensor
+
+
+def reference_logprob(model, seq):
+    X = Variable(torch.LongTensor(seq).view(-1, 1))
+    y, _ = model(X, model.init_hidden(1))
+    return sum(float(y.data[i, 0, w]) for i, w in enumerate(seq[1:]))
+
+
+class PrefixTrieTests(TestCase):
+    def test_shared_prefixes(self):
+        trie = PrefixTrie([[0, 1, 2, 3], [0, 1, 2, 4], [0, 1, 5]])
+        self.assertEqual([len(tokens) for tokens in trie.tokens], [1, 1, 2, 2])
+        self.assertEqual(trie.nb_nodes(), 6)
+        self.assertEqual(trie.nb_inner_nodes(), 3)
+
+    def test_ends(self):
+        trie = PrefixTrie([[0, 1, 2], [0, 1], [0, 1, 2]])
+        self.assertEqual(trie.ends, [(2, 0), (1, 0), (2, 0)])
+
+    def test_parents(self):
+        trie = PrefixTrie([[0, 1, 2], [0, 3, 4], [0, 3, 2]])
+        self.assertEqual(trie.tokens[2].tolist(), [2, 4, 2])
+        self.assertEqual(trie.parents[2].tolist(), [0, 1, 1])
+
+    def test_common_start_required(self):
+        self.assertRaises(ValueError, PrefixTrie, [[0, 1], [1, 1]])
+
+    def test_empty(self):
+        self.assertRaises(ValueError, PrefixTrie, [])
+
+
+class SeqsToTensorTests(TestCase):
+    def test_padding(self):
+        data, lengths = seqs_to_tensor([[1, 2, 3], [4], [5, 6]])
+        self.assertEqual(data.tolist(), [[1, 4, 5], [2, 0, 6], [3, 0, 0]])
+        self.assertEqual(lengths.tolist(), [3, 1, 2])
+
+
+class LengthBucketsTests(TestCase):
+    def test_budget(self):
+        lengths = [3, 1, 4, 1, 5, 9, 2, 6]
+        buckets = length_buckets(lengths, token_budget=10)
+        self.assertEqual(sorted(i for bucket in buckets for i in bucket), list(range(len(lengths))))
+        for bucket in buckets:
+            self.assertTrue(len(bucket) == 1 or len(bucket) * max(lengths[i] for i in bucket) <= 10)
+
+    def test_sorted_by_length(self):
+        buckets = length_buckets([5, 1, 3], token_budget=100)
+        self.assertEqual(buckets, [[1, 2, 0]])
+
+    def test_overlong(self):
+        self.assertEqual(length_buckets([20, 30], token_budget=10), [[0], [1]])
+
+    def test_positive_budget_required(self):
+        self.assertRaises(ValueError, length_buckets, [1], 0)
+
+
+class SeqsLogprobTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.model = LSTMLanguageModel(10, 4, 6, 2, dropout=0.0)
+        self.model.eval()
+        self.seqs = [
+            [0, 3, 4, 5, 1],
+            [0, 3, 4, 6, 1],
+            [0, 3, 1],
+            [0, 7, 4, 5, 9, 1],
+            [0, 3, 4, 5, 1],
+            [0],
+        ]
+
+    def assertScores(self, observed):
+        self.assertEqual(len(observed), len(self.seqs))
+        for seq, score in zip(self.seqs, observed):
+            self.assertTrue(math.isclose(score, reference_logprob(self.model, seq), rel_tol=1e-5, abs_tol=1e-5))
+
+    def test_trie(self):
+        self.assertScores(trie_seqs_logprob(self.model, self.seqs))
+
+    def test_padded(self):
+        self.assertScores(padded_seqs_logprob(self.model, self.seqs))
+
+    def test_padded_first_words_only(self):
+        self.seqs = [[0], [0]]
+        self.assertScores(padded_seqs_logprob(self.model, self.seqs))
+
+    def test_single_sequence(self):
+        self.seqs = [[0, 2, 1]]
+        self.assertScores(trie_seqs_logprob(self.model, self.seqs))
+
+    def test_bucketed(self):
+        self.assertScores(bucketed_seqs_logprob(self.model, self.seqs, token_budget=10))
+
+    def test_stream(self):
+        keyed_seqs = [('utt{}-1'.format(i), seq) for i, seq in enumerate(self.seqs)]
+        scored = list(stream_rescore(self.model, iter(keyed_seqs), token_budget=12, window=4))
+        self.assertEqual([key for key, score in scored], [key for key, seq in keyed_seqs])
+        self.assertScores([score for key, score in scored])
+
+    def test_no_autograd(self):
+        grad_enabled = []
+        self.model.rnn.register_forward_hook(lambda module, inputs, outputs: grad_enabled.append(torch.is_grad_enabled()))
+        trie_seqs_logprob(self.model, self.seqs)
+        bucketed_seqs_logprob(self.model, self.seqs, token_budget=10)
+        self.assertTrue(len(grad_enabled) > 0)
+        self.assertFalse(any(grad_enabled))
+
+    def test_requires_recurrent_model(self):
+        self.model.in_len = 3
+        self.assertRaises(ValueError, trie_seqs_logprob, self.model, self.seqs)
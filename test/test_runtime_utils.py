@@ -0,0 +1,99 @@
+import threading
+
+import torch
+from test.common import TestCase
+
+from runtime.runtime_utils import PrefetchingStream, BatchFilter, OrderedObjects, shuffle_objects, objects_order, set_objects_order
+
+
+class CountingStream:
+    def __init__(self, nb_batches):
+        self.nb_batches = nb_batches
+        self.produced = 0
+
+    def __iter__(self):
+        for i in range(self.nb_batches):
+            self.produced += 1
+            yield torch.LongTensor([i]), torch.LongTensor([i+1]), torch.LongTensor([])
+
+
+class FailingStream:
+    def __iter__(self):
+        yield torch.LongTensor([0]),
+        raise RuntimeError("broken batch")
+
+
+class WorkerKilled(BaseException):
+    pass
+
+
+class KilledStream:
+    def __iter__(self):
+        yield torch.LongTensor([0]),
+        raise WorkerKilled()
+
+
+class PrefetchingStreamTests(TestCase):
+    def test_order_preserved(self):
+        source = CountingStream(20)
+        expectation = list(source)
+        self.assertEqual(list(PrefetchingStream(source, 3)), expectation)
+
+    def test_repeated_iteration(self):
+        stream = PrefetchingStream(CountingStream(5), 2)
+        self.assertEqual(list(stream), list(stream))
+
+    def test_exception_propagated(self):
+        stream = iter(PrefetchingStream(FailingStream(), 2))
+        self.assertEqual(next(stream), (torch.LongTensor([0]),))
+        self.assertRaises(RuntimeError, next, stream)
+
+    def test_base_exception_propagated(self):
+        stream = iter(PrefetchingStream(KilledStream(), 2))
+        next(stream)
+        self.assertRaises(WorkerKilled, next, stream)
+
+    def test_bounded_lookahead(self):
+        source = CountingStream(100)
+        stream = iter(PrefetchingStream(source, 4))
+        next(stream)
+        self.assertLessEqual(source.produced, 1 + 4 + 1)
+
+    def test_early_stop_joins_worker(self):
+        nb_threads = threading.active_count()
+        stream = iter(PrefetchingStream(CountingStream(100), 2))
+        next(stream)
+        stream.close()
+        self.assertEqual(threading.active_count(), nb_threads)
+
+    def test_positive_depth_required(self):
+        self.assertRaises(ValueError, PrefetchingStream, CountingStream(1), 0)
+
+
+class OrderedObjectsTests(TestCase):
+    def test_iteration(self):
+        self.assertEqual(list(OrderedObjects(['a', 'b', 'c'])), ['a', 'b', 'c'])
+
+    def test_order_restored(self):
+        objects = OrderedObjects(list(range(10)))
+        shuffle_objects(objects)
+        order = objects_order(objects)
+        shuffled = list(objects)
+
+        restored = OrderedObjects(list(range(10)))
+        set_objects_order(restored, order)
+        self.assertEqual(list(restored), shuffled)
+
+    def test_order_of_list(self):
+        self.assertEqual(objects_order([1, 2]), None)
+
+    def test_invalid_order(self):
+        self.assertRaises(ValueError, set_objects_order, OrderedObjects(['a', 'b']), [0, 0])
+
+
+class BatchFilterTests(TestCase):
+    def test_batches_read_include_skipped(self):
+        source = [(torch.LongTensor(bsz, 2).zero_(),) for bsz in [3, 1, 3, 2]]
+        batch_filter = BatchFilter(source, 3, 2, min_batch_size=3)
+        self.assertEqual(len(list(batch_filter)), 2)
+        self.assertEqual(batch_filter.nb_batches_read(), 4)
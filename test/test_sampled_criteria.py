@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+import torch
+from torch.autograd import Variable
+import torch.nn.functional as F
+from test.common import TestCase
+
+from language_models.decoders import output_rows
+from language_models.lstm_model import LSTMLanguageModel
+from language_models.smm_lstm_models import OutputEnhancedLM
+from runtime.sampled_criteria import UnigramNoise, SampledSoftmaxLoss, NCELoss, make_criterion
+
+
+class FixedNoise(UnigramNoise):
+    def __init__(self, counts, samples):
+        super().__init__(counts)
+        self.samples = torch.LongTensor(samples)
+
+    def sample(self, nb_samples):
+        return self.samples[:nb_samples]
+
+
+class UnigramNoiseTests(TestCase):
+    def test_probs(self):
+        noise = UnigramNoise([3, 0, 1, 4])
+        self.assertEqual(noise.probs.tolist(), [1/3, 1/9, 1/9, 4/9])
+        self.assertAlmostEqual(float(noise.log_probs(torch.LongTensor([3]))[0]), math.log(4/9))
+
+    def test_power(self):
+        noise = UnigramNoise([4, 1], power=0.5)
+        self.assertAlmostEqual(float(noise.probs[0]), 2/3, places=6)
+
+    def test_samples(self):
+        samples = UnigramNoise([0, 0, 1000, 0]).sample(50)
+        self.assertEqual(len(samples), 50)
+        self.assertGreater(int((samples == 2).sum()), 40)
+
+
+class SampledCriteriaTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.model = LSTMLanguageModel(6, 3, 4, 1, dropout=0.0)
+        self.features = Variable(torch.randn(3, 4), requires_grad=True)
+        self.targets = Variable(torch.LongTensor([1, 4, 1]))
+        self.counts = [5, 4, 3, 2, 1, 1]
+        self.samples = [0, 4, 5]
+
+    def logits(self, words):
+        weight, bias = output_rows(self.model, Variable(torch.LongTensor(words)))
+        return self.features.matmul(weight.t()) + bias
+
+    def test_sampled_softmax(self):
+        noise = FixedNoise(self.counts, self.samples)
+        loss = SampledSoftmaxLoss(noise, 3)(self.model, self.features, self.targets)
+
+        log_q = noise.log_probs(torch.LongTensor([0, 1, 2, 3, 4, 5])).tolist()
+        all_logits = self.logits([0, 1, 2, 3, 4, 5]).data
+        expectation = 0.0
+        for i, t in enumerate(self.targets.data.tolist()):
+            candidates = [t] + [s for s in self.samples if s != t]
+            corrected = [all_logits[i, w] - log_q[w] for w in candidates]
+            expectation -= float(corrected[0] - torch.logsumexp(torch.stack(corrected), 0))
+
+        self.assertAlmostEqual(float(loss.data), expectation / 3)
+
+    def test_nce(self):
+        noise = FixedNoise(self.counts, self.samples)
+        loss = NCELoss(noise, 3)(self.model, self.features, self.targets)
+
+        log_kq = noise.log_probs(torch.LongTensor([0, 1, 2, 3, 4, 5])) + math.log(3)
+        all_logits = self.logits([0, 1, 2, 3, 4, 5]).data
+        expectation = 0.0
+        for i, t in enumerate(self.targets.data.tolist()):
+            expectation -= float(F.logsigmoid(all_logits[i, t] - log_kq[t]))
+            for s in self.samples:
+                expectation -= float(F.logsigmoid(-(all_logits[i, s] - log_kq[s])))
+
+        self.assertAlmostEqual(float(loss.data), expectation / 3)
+
+    def test_gradients(self):
+        loss = SampledSoftmaxLoss(UnigramNoise(self.counts), 4)(self.model, self.features, self.targets)
+        loss.backward()
+        self.assertGreater(float(self.model.decoder.weight.grad.data.abs().sum()), 0.0)
+        self.assertGreater(float(self.features.grad.data.abs().sum()), 0.0)
+
+    def test_make_criterion(self):
+        self.assertTrue(make_criterion('full', self.counts, 5) is None)
+        self.assertTrue(isinstance(make_criterion('nce', self.counts, 5), NCELoss))
+        self.assertRaises(ValueError, make_criterion, 'magic', self.counts, 5)
+        self.assertRaises(ValueError, make_criterion, 'sampled', self.counts, 0)
+
+    def test_class_decoder_rejected(self):
+        model = LSTMLanguageModel(6, 3, 4, 1, dropout=0.0, decoder='class:2')
+        criterion = SampledSoftmaxLoss(UnigramNoise(self.counts), 4)
+        self.assertRaises(ValueError, criterion, model, self.features, self.targets)
+
+
+class OutputRowsTests(TestCase):
+    def test_output_enhanced(self):
+        torch.manual_seed(1)
+        model = OutputEnhancedLM(7, 3, 4, 1, 2, dropout=0.0)
+        model.eval()
+        X = Variable(torch.LongTensor([[1, 2], [3, 4]]))
+        ivec = Variable(torch.randn(2, 2))
+        output, _ = model(X, model.init_hidden(2), ivec)
+        features, _ = model.features(X, model.init_hidden(2), ivec)
+
+        weight, bias = output_rows(model, Variable(torch.LongTensor(list(range(7)))))
+        log_probs = F.log_softmax(features.matmul(weight.t()) + bias, dim=-1)
+        self.assertTrue(np.allclose(log_probs.data.numpy(), output.data.numpy()))
+
+
+class TrainingTests(TestCase):
+    def test_training_decreases_loss(self):
+        torch.manual_seed(1)
+        model = LSTMLanguageModel(6, 3, 8, 1, dropout=0.0)
+        seq = torch.LongTensor([0, 1, 2, 3, 4, 5] * 4)
+        X, targets = Variable(seq[:-1].view(-1, 1)), Variable(seq[1:])
+        criterion = SampledSoftmaxLoss(UnigramNoise(np.ones(6)), 4)
+        optim = torch.optim.SGD(model.parameters(), lr=1.0)
+
+        losses = []
+        for _ in range(30):
+            features, _ = model.features(X, model.init_hidden(1))
+            loss = criterion(model, features.view(-1, 8), targets)
+            optim.zero_grad()
+            loss.backward()
+            optim.step()
+            losses.append(float(loss.data))
+
+        self.assertLess(np.mean(losses[-5:]), np.mean(losses[:5]))
@@ -0,0 +1,73 @@
+import io
+
+import numpy as np
+from test.common import TestCase
+
+from runtime.score_combination import load_nbest_scores, segment_argmin, best_picks
+
+
+def score_file(entries):
+    return io.StringIO(''.join('{} {}\n'.format(key, score) for key, score in entries))
+
+
+class LoadNbestScoresTests(TestCase):
+    def setUp(self):
+        self.keys = ['a-1', 'a-2', 'b-x-1', 'b-x-2', 'b-x-3', 'c-1']
+
+    def test_alignment(self):
+        nbest = load_nbest_scores([
+            score_file(zip(self.keys, range(6))),
+            score_file(zip(self.keys, range(10, 16))),
+        ])
+        self.assertEqual(nbest.segments, ['a', 'b-x', 'c'])
+        self.assertEqual(nbest.trans_ids, ['1', '2', '1', '2', '3', '1'])
+        self.assertEqual(nbest.offsets.tolist(), [0, 2, 5, 6])
+        self.assertEqual(nbest.scores.tolist(), [list(range(6)), list(range(10, 16))])
+
+    def test_mismatch(self):
+        files = [score_file(zip(self.keys, range(6))), score_file(zip(self.keys[::-1], range(6)))]
+        self.assertRaises(ValueError, load_nbest_scores, files)
+
+    def test_different_lengths(self):
+        files = [score_file(zip(self.keys, range(6))), score_file(zip(self.keys[:4], range(4)))]
+        self.assertRaises(ValueError, load_nbest_scores, files)
+
+
+class SegmentArgminTests(TestCase):
+    def test_rows(self):
+        values = np.asarray([
+            [3.0, 1.0, 5.0, 4.0, 2.0],
+            [0.0, 1.0, 5.0, 6.0, 7.0],
+        ])
+        offsets = np.asarray([0, 2, 5])
+        self.assertEqual(segment_argmin(values, offsets).tolist(), [[1, 4], [0, 2]])
+
+    def test_ties_to_first(self):
+        values = np.asarray([[1.0, 1.0, 2.0, 2.0, 2.0]])
+        self.assertEqual(segment_argmin(values, np.asarray([0, 2, 5])).tolist(), [[0, 2]])
+
+
+class BestPicksTests(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        keys = ['s{}-{}'.format(s, t) for s in range(20) for t in range(1 + s % 7)]
+        self.sources = [rng.randint(0, 4, len(keys)).astype(float) for _ in range(3)]
+        self.nbest = load_nbest_scores([score_file(zip(keys, source)) for source in self.sources])
+
+    def reference(self, weights):
+        combined = sum(w * s for w, s in zip(weights, self.sources))
+        offsets = self.nbest.offsets
+        return [offsets[i] + int(np.argmin(combined[offsets[i]:offsets[i+1]])) for i in range(len(offsets) - 1)]
+
+    def test_grid(self):
+        weights = [[1.0, gr, lm] for gr in [0.5, 1.0] for lm in [0.1, 1.0, 3.0]]
+        picks = best_picks(self.nbest, weights)
+        for setting, setting_picks in zip(weights, picks):
+            self.assertEqual(setting_picks.tolist(), self.reference(setting))
+
+    def test_chunked(self):
+        weights = [[1.0, 1.0, lm] for lm in [0.1, 1.0, 3.0]]
+        self.assertEqual(best_picks(self.nbest, weights, max_elements=1).tolist(), best_picks(self.nbest, weights).tolist())
+
+    def test_weights_shape(self):
+        self.assertRaises(ValueError, best_picks, self.nbest, [[1.0, 1.0]])
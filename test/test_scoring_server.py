@@ -0,0 +1,193 @@
+import http.client
+import json
+import os
+import socket
+import tempfile
+import threading
+
+import torch
+from test.common import TestCase
+
+from language_models.lstm_model import LSTMLanguageModel
+from language_models.vocab import Vocabulary
+from runtime.rescoring import padded_seqs_logprob
+from runtime.scoring_server import DynamicBatcher, make_scoring_server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__('localhost')
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+class DynamicBatcherTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.model = LSTMLanguageModel(10, 4, 5, 1, dropout=0.0)
+        self.model.eval()
+
+    def test_scores(self):
+        batcher = DynamicBatcher(self.model, max_latency=0.0)
+        try:
+            seqs = [[0, 3, 4, 1], [0, 5, 1], [0]]
+            word_log_probs = batcher.score(seqs)
+        finally:
+            batcher.close()
+
+        self.assertEqual([len(w) for w in word_log_probs], [3, 2, 0])
+        for observed, expected in zip(word_log_probs, padded_seqs_logprob(self.model, seqs)):
+            self.assertAlmostEqual(sum(observed), expected, places=4)
+
+    def test_concurrent_requests_merged(self):
+        batcher = DynamicBatcher(self.model, max_batch_size=100, max_latency=0.5)
+        results = {}
+
+        def request(i):
+            results[i] = batcher.score([[0, i, 1]])
+
+        try:
+            threads = [threading.Thread(target=request, args=(i,)) for i in range(2, 8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            metrics = batcher.metrics()
+        finally:
+            batcher.close()
+
+        self.assertEqual(sorted(results), list(range(2, 8)))
+        self.assertEqual(metrics['requests'], 6)
+        self.assertLess(metrics['batches'], 6)
+
+    def test_batch_size_limit(self):
+        batcher = DynamicBatcher(self.model, max_batch_size=1, max_latency=1.0)
+        try:
+            batcher.score([[0, 2, 1]])
+            self.assertEqual(batcher.metrics()['max_batch_size'], 1)
+        finally:
+            batcher.close()
+
+    def test_error_propagated(self):
+        batcher = DynamicBatcher(self.model, max_latency=0.0)
+        try:
+            self.assertRaises(Exception, batcher.score, [[0, 42]])
+        finally:
+            batcher.close()
+
+    def test_positive_batch_size_required(self):
+        self.assertRaises(ValueError, DynamicBatcher, self.model, 0)
+
+
+class ScoringServerTests(TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.vocab = Vocabulary('<unk>', 0)
+        self.vocab.add_from_text("<s> </s> a b c")
+        self.model = LSTMLanguageModel(len(self.vocab), 4, 5, 1, dropout=0.0)
+        self.model.eval()
+        self.batcher = DynamicBatcher(self.model, max_latency=0.0)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.batcher.close()
+        self.tmp_dir.cleanup()
+
+    def serve(self, address):
+        server = make_scoring_server(address, self.batcher, self.vocab)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.addCleanup(stop)
+
+        return server
+
+    def request(self, connection, method, path, content=None):
+        body = None if content is None else json.dumps(content)
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+
+    def test_sentences(self):
+        server = self.serve(('127.0.0.1', 0))
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+        status, content = self.request(connection, 'POST', '/score', {'sentences': ["a b", "c"], 'per_word': True})
+
+        self.assertEqual(status, 200)
+        seqs = [[self.vocab[w] for w in s.split()] for s in ["<s> a b </s>", "<s> c </s>"]]
+        for observed, expected in zip(content['log_probs'], padded_seqs_logprob(self.model, seqs)):
+            self.assertAlmostEqual(observed, expected, places=4)
+        self.assertEqual([len(w) for w in content['word_log_probs']], [3, 2])
+
+    def test_unix_socket(self):
+        path = os.path.join(self.tmp_dir.name, 'lm.sock')
+        self.serve(path)
+        status, content = self.request(UnixHTTPConnection(path), 'POST', '/score', {'sequences': [[1, 3, 2]]})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(content['log_probs']), 1)
+        self.assertFalse('word_log_probs' in content)
+
+    def test_stale_socket_replaced(self):
+        path = os.path.join(self.tmp_dir.name, 'lm.sock')
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(path)
+        stale.close()
+        self.serve(path)
+        status, _ = self.request(UnixHTTPConnection(path), 'POST', '/score', {'sequences': [[1, 3, 2]]})
+        self.assertEqual(status, 200)
+
+    def test_other_files_kept(self):
+        path = os.path.join(self.tmp_dir.name, 'lm.sock')
+        with open(path, 'w') as f:
+            f.write('precious')
+        self.assertRaises(ValueError, make_scoring_server, path, self.batcher, self.vocab)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'precious')
+
+    def test_metrics(self):
+        server = self.serve(('127.0.0.1', 0))
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+        self.request(connection, 'POST', '/score', {'sequences': [[1, 3, 2], [1, 2]]})
+        status, content = self.request(connection, 'GET', '/metrics')
+        self.assertEqual(status, 200)
+        self.assertEqual(content['sequences'], 2)
+        self.assertEqual(content['queue_depth'], 0)
+
+    def test_bad_request(self):
+        server = self.serve(('127.0.0.1', 0))
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+        status, content = self.request(connection, 'POST', '/score', {'sequences': [[1, 99]]})
+        self.assertEqual(status, 400)
+        self.assertIn('error', content)
+
+    def test_malformed_requests(self):
+        server = self.serve(('127.0.0.1', 0))
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+        for content in [
+            {'sequences': 5}, {'sequences': [5]}, {'sequences': [[1, "a"]]}, {'sequences': [[1, True]]},
+            {'sentences': "a b"}, {'sentences': [["a", "b"]]}, [1, 2],
+        ]:
+            status, reply = self.request(connection, 'POST', '/score', content)
+            self.assertEqual(status, 400, content)
+            self.assertIn('error', reply)
+
+    def test_indices_checked_against_model(self):
+        # a sparse wordlist has fewer words than the model has outputs
+        self.batcher.close()
+        model = LSTMLanguageModel(len(self.vocab) + 3, 4, 5, 1, dropout=0.0)
+        model.eval()
+        self.batcher = DynamicBatcher(model, max_latency=0.0)
+        server = self.serve(('127.0.0.1', 0))
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+
+        status, _ = self.request(connection, 'POST', '/score', {'sequences': [[1, len(self.vocab) + 2]]})
+        self.assertEqual(status, 200)
+        status, _ = self.request(connection, 'POST', '/score', {'sequences': [[1, len(self.vocab) + 3]]})
+        self.assertEqual(status, 400)
@@ -86,3 +86,86 @@ class IvecExtractorTests(TestCase):
         lm_words = torch.LongTensor([[self.vocab[w] for w in seq.split()] for seq in words])
         cv_words = torch.from_numpy(self.cvect.transform(words).A.astype(np.float32)).squeeze()
         self.assertEqual(translator(lm_words), cv_words)
+
+    def test_build_translator_accumulates_into_bows(self):
+        self.build_neededs(self.documents_six)
+        translator = self.extractor.build_translator(self.vocab)
+        words = ["SIX words", "of text"]
+        lm_words = torch.LongTensor([[self.vocab[w] for w in seq.split()] for seq in words])
+        bows = self.extractor.zero_bows(2) + 1
+        cv_words = torch.from_numpy(self.cvect.transform(words).toarray().astype(np.float32))
+        self.assertEqual(translator(lm_words, bows), cv_words + 1)
+
+
+class SoftmaxSMM():
+    def __init__(self, ivec_dim, vocab_size):
+        self.cuda = False
+        self.T = Variable(torch.randn(ivec_dim, vocab_size).float())
+        self.W = Variable(torch.zeros(ivec_dim, 1).float(), requires_grad=True)
+
+    def reset_w(self, nb_docs):
+        self.W = Variable(torch.zeros(self.T.size(0), nb_docs).float(), requires_grad=True)
+
+    def loss(self, X):
+        log_probs = torch.nn.functional.log_softmax(self.T.t().mm(self.W), dim=0)
+        return -(X * log_probs).sum() + 0.1 * self.W.pow(2).sum()
+
+
+class BatchExtractionTests(TestCase):
+    def setUp(self):
+        self.documents = ["text consisting of six different words", "text", "", "words of words"]
+        self.cvect = CountVectorizer(strip_accents='ascii', analyzer='word')
+        self.cvect.fit(self.documents)
+        smm = SoftmaxSMM(ivec_dim=3, vocab_size=len(self.cvect.vocabulary_))
+        self.extractor = smm_ivec_extractor.IvecExtractor(smm, nb_iters=5, lr=0.1, tokenizer=self.cvect)
+
+    def assertClose(self, a, b):
+        self.assertTrue(np.allclose(a.numpy(), b.numpy(), atol=1e-5))
+
+    def test_matches_single_documents(self):
+        expectation = torch.stack([self.extractor(doc) for doc in self.documents])
+        self.assertClose(self.extractor.extract_batch(self.documents), expectation)
+
+    def test_chunking(self):
+        expectation = self.extractor.extract_batch(self.documents)
+        self.assertClose(self.extractor.extract_batch(self.documents, chunk_size=3), expectation)
+
+    def test_sparse_input(self):
+        expectation = self.extractor.extract_batch(self.documents)
+        bows = self.cvect.transform(self.documents)
+        self.assertClose(self.extractor.extract_batch(bows), expectation)
+
+    def test_shape(self):
+        ivecs = self.extractor.extract_batch(self.documents, chunk_size=2)
+        self.assertEqual(ivecs.size(), (len(self.documents), 3))
+
+    def test_chunk_size_from_budget(self):
+        self.assertEqual(smm_ivec_extractor.bow_chunk_size(100000, memory_budget=64 * 2**20), 167)
+        self.assertEqual(smm_ivec_extractor.bow_chunk_size(10**9), 1)
+
+
+class TranslationTableTests(TestCase):
+    def setUp(self):
+        documents = ["text consisting of SIX different words", "text"]
+        self.cvect = CountVectorizer(strip_accents='ascii', analyzer='word')
+        self.cvect.fit(documents)
+        smm = SoftmaxSMM(ivec_dim=3, vocab_size=len(self.cvect.vocabulary_))
+        self.extractor = smm_ivec_extractor.IvecExtractor(smm, nb_iters=5, lr=0.1, tokenizer=self.cvect)
+
+        self.vocab = Vocabulary(unk_word="<unk>", unk_index=0)
+        self.vocab.add_from_text("text consisting of SIX different words xyz")
+
+    def test_table(self):
+        table, mask = self.extractor.translation_table(self.vocab)
+        for w in ["text", "SIX", "words"]:
+            self.assertEqual(mask[self.vocab[w]], 0)
+            self.assertEqual(table[self.vocab[w]], self.cvect.vocabulary_[w.lower()])
+
+    def test_untranslatable(self):
+        table, mask = self.extractor.translation_table(self.vocab)
+        self.assertNotEqual(mask[self.vocab["xyz"]], 0)
+        self.assertNotEqual(mask[self.vocab["<unk>"]], 0)
+
+    def test_computed_once(self):
+        first = self.extractor.translation_table(self.vocab)
+        self.assertTrue(self.extractor.translation_table(self.vocab) is first)
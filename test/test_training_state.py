@@ -0,0 +1,147 @@
+import os
+import random
+import tempfile
+
+import torch
+from torch.autograd import Variable
+from test.common import TestCase
+
+from data_pipeline.multistream import batchify
+from data_pipeline.temporal_splitting import temporal_splits_from
+from language_models.lstm_model import LSTMLanguageModel
+from runtime.runtime_utils import BatchCounter
+from runtime.training_state import save_training_state, load_training_state, periodic_state_saver
+
+
+class TrainingStateTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fn = os.path.join(self.tmp_dir.name, 'training.state')
+
+        self.model = LSTMLanguageModel(5, 3, 4, 1)
+        self.optim = torch.optim.SGD(self.model.parameters(), lr=0.5, momentum=0.9)
+        self.model.decoder.bias.grad = Variable(torch.ones(5)).data
+        self.optim.step()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_progress(self):
+        save_training_state(self.fn, self.model, self.optim, 3, 1.25, 4.5, nb_batches_done=7, data_order=[1, 0, 2])
+        state = load_training_state(self.fn, LSTMLanguageModel(5, 3, 4, 1))
+        self.assertEqual(state.epoch, 3)
+        self.assertEqual(state.lr, 1.25)
+        self.assertEqual(state.best_val_loss, 4.5)
+        self.assertEqual(state.nb_batches_done, 7)
+        self.assertEqual(state.data_order, [1, 0, 2])
+
+    def test_no_best_val_loss(self):
+        save_training_state(self.fn, self.model, self.optim, 1, 20.0, None)
+        self.assertEqual(load_training_state(self.fn, LSTMLanguageModel(5, 3, 4, 1)).best_val_loss, None)
+
+    def test_model_restored(self):
+        save_training_state(self.fn, self.model, self.optim, 1, 20.0, None)
+        model = LSTMLanguageModel(5, 3, 4, 1)
+        load_training_state(self.fn, model)
+        for name, tensor in self.model.state_dict().items():
+            self.assertTrue(torch.equal(model.state_dict()[name], tensor), name)
+
+    def test_optimizer_restored(self):
+        save_training_state(self.fn, self.model, self.optim, 1, 20.0, None)
+        model = LSTMLanguageModel(5, 3, 4, 1)
+        state = load_training_state(self.fn, model)
+        optim = torch.optim.SGD(model.parameters(), lr=0.5, momentum=0.9)
+        state.restore_optimizer(optim)
+        self.assertEqual(optim.state_dict()['state'].keys(), self.optim.state_dict()['state'].keys())
+
+    def test_rng_restored(self):
+        save_training_state(self.fn, self.model, self.optim, 1, 20.0, None)
+        expectation = (random.random(), torch.rand(3))
+
+        random.random()
+        load_training_state(self.fn, LSTMLanguageModel(5, 3, 4, 1))
+        self.assertEqual(random.random(), expectation[0])
+        self.assertTrue(torch.equal(torch.rand(3), expectation[1]))
+
+    def test_hidden_restored(self):
+        hidden = (torch.rand(1, 2, 4), torch.rand(1, 2, 4))
+        save_training_state(self.fn, self.model, self.optim, 1, 20.0, None, hidden=hidden)
+        restored = load_training_state(self.fn, LSTMLanguageModel(5, 3, 4, 1)).hidden
+        self.assertEqual(len(restored), 2)
+        for h, expectation in zip(restored, hidden):
+            self.assertTrue(torch.equal(h.data, expectation))
+
+    def test_no_leftovers(self):
+        save_training_state(self.fn, self.model, self.optim, 1, 20.0, None)
+        save_training_state(self.fn, self.model, self.optim, 2, 20.0, None)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['training.state'])
+
+
+class PeriodicStateSaverTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fn = os.path.join(self.tmp_dir.name, 'training.state')
+        self.model = LSTMLanguageModel(5, 3, 4, 1)
+        self.optim = torch.optim.SGD(self.model.parameters(), lr=0.5)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_interval(self):
+        positions = iter(range(100, 200))
+        batch_callback = periodic_state_saver(
+            self.fn, 3, lambda: next(positions), self.model, self.optim,
+            epoch=2, lr=1.0, best_val_loss=None
+        )
+
+        batch_callback(None)
+        batch_callback(None)
+        self.assertFalse(os.path.exists(self.fn))
+
+        for _ in range(4):
+            batch_callback(None)
+        state = load_training_state(self.fn, self.model)
+        self.assertEqual(state.epoch, 2)
+        self.assertEqual(state.nb_batches_done, 101)  # position asked at the 3rd and 6th update
+
+    def test_positive_interval_required(self):
+        self.assertRaises(ValueError, periodic_state_saver, self.fn, 0, lambda: 0, self.model, self.optim)
+
+
+class MidEpochResumptionTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fn = os.path.join(self.tmp_dir.name, 'training.state')
+        self.model = LSTMLanguageModel(5, 3, 4, 1)
+        self.optim = torch.optim.SGD(self.model.parameters(), lr=0.5)
+        self.batched = batchify(torch.arange(0, 200).long(), 2, False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertResumesAfter(self, in_len, nb_updates, interval, nb_batches_done):
+        all_batches = list(temporal_splits_from(self.batched, 0, in_len, 5))
+
+        # as in train.py, the saver asks the stream how far it got
+        train_data = BatchCounter(temporal_splits_from(self.batched, 0, in_len, 5))
+        batch_callback = periodic_state_saver(
+            self.fn, interval, lambda: train_data.nb_batches_read(), self.model, self.optim,
+            epoch=1, lr=1.0, best_val_loss=None
+        )
+        for _, batch in zip(range(nb_updates), train_data):
+            batch_callback(None)
+
+        state = load_training_state(self.fn, self.model)
+        self.assertEqual(state.nb_batches_done, nb_batches_done)
+
+        resumed = list(temporal_splits_from(self.batched, state.nb_batches_done, in_len, 5))
+        self.assertEqual(len(resumed), len(all_batches) - nb_batches_done)
+        for (x, t), (expected_x, expected_t) in zip(resumed, all_batches[nb_batches_done:]):
+            self.assertTrue(torch.equal(x, expected_x))
+            self.assertTrue(torch.equal(t, expected_t))
+
+    def test_recurrent(self):
+        self.assertResumesAfter(in_len=1, nb_updates=8, interval=3, nb_batches_done=6)
+
+    def test_feedforward(self):
+        self.assertResumesAfter(in_len=3, nb_updates=5, interval=4, nb_batches_done=4)
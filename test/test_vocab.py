@@ -1,8 +1,12 @@
 import unittest
+import os
+import tempfile
+import torch
+
 import language_models.vocab as vocab
 from io import StringIO
 
-from collections import Mapping
+from collections.abc import Mapping
 
 
 class IndexGeneratorTest(unittest.TestCase):
@@ -128,3 +132,129 @@ class VocabFromKaldiTests(unittest.TestCase):
                                     b 2 """)
         with self.assertRaises(ValueError):
             vocab.vocab_from_kaldi_wordlist(kaldi_vocab, "<unk>")
+
+    def test_quoted(self):
+        kaldi_vocab = StringIO("""'<unk>' 0
+                                  'a b' 1
+                                  'c' 2 """)
+        vocabulary = vocab.quoted_vocab_from_kaldi_wordlist(kaldi_vocab, "<unk>")
+        self.assertEqual(vocabulary['a b'], 1)
+        self.assertEqual(vocabulary['c'], 2)
+
+
+class CompactVocabularyTests(unittest.TestCase):
+    def setUp(self):
+        self.words = ["<unk>", "a", "příliš", "b", "c"]
+        self.indices = [0, 3, 1, 7, 4]
+        self.vocab = vocab.CompactVocabulary.from_words(self.words, self.indices, "<unk>")
+
+    def test_is_mapping(self):
+        self.assertTrue(isinstance(self.vocab, Mapping))
+
+    def test_getitem(self):
+        for w, i in zip(self.words, self.indices):
+            self.assertEqual(self.vocab[w], i)
+
+    def test_unk(self):
+        self.assertEqual(self.vocab['nonexistent'], 0)
+        self.assertEqual(self.vocab['zzz'], 0)
+        self.assertEqual(self.vocab.w2i(''), 0)
+
+    def test_i2w(self):
+        for w, i in zip(self.words, self.indices):
+            self.assertEqual(self.vocab.i2w(i), w)
+
+    def test_i2w_gap(self):
+        self.assertRaises(KeyError, self.vocab.i2w, 2)
+        self.assertRaises(KeyError, self.vocab.i2w, 8)
+
+    def test_len(self):
+        self.assertEqual(len(self.vocab), len(self.words))
+
+    def test_iteration_by_index(self):
+        self.assertEqual(list(self.vocab), ["<unk>", "příliš", "a", "c", "b"])
+
+    def test_encode(self):
+        ids = self.vocab.encode(["a", "x", "b", "příliš"])
+        self.assertEqual(ids.tolist(), [3, 0, 7, 1])
+
+    def test_later_duplicate_wins(self):
+        vocabulary = vocab.CompactVocabulary.from_words(["<unk>", "a", "a"], [0, 1, 2], "<unk>")
+        self.assertEqual(vocabulary["a"], 2)
+        self.assertEqual(len(vocabulary), 2)
+
+    def test_missing_unk(self):
+        self.assertRaises(ValueError, vocab.CompactVocabulary.from_words, ["a"], [0], "<unk>")
+
+    def test_from_mapping(self):
+        original = vocab.Vocabulary("<unk>", 0)
+        original.add_from_text("hello world of vocabularies !")
+        compact = vocab.CompactVocabulary.from_mapping(original)
+        self.assertEqual(dict(compact), dict(original))
+        self.assertEqual(vocab.vocab_fingerprint(compact), vocab.vocab_fingerprint(original))
+
+    def test_fingerprint_shared_indices(self):
+        words, indices = ["<unk>", "b", "a", "c"], [0, 2, 2, 1]
+        compact = vocab.CompactVocabulary.from_words(words, indices, "<unk>")
+        self.assertEqual(vocab.vocab_fingerprint(compact), vocab._fingerprint(sorted(zip(indices, words))))
+        self.assertTrue(compact.fingerprint() is compact.fingerprint())
+
+    def test_max_index(self):
+        self.assertEqual(vocab.vocab_max_index(self.vocab), 7)
+        original = vocab.Vocabulary("<unk>", 5)
+        original.add_from_text("a b")
+        self.assertEqual(vocab.vocab_max_index(original), 5)
+
+    def test_save_load(self):
+        fd, fn = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            with open(fn, 'wb') as f:
+                self.vocab.save(f)
+            loaded = vocab.load_compact_vocabulary(fn)
+            self.assertEqual(dict(loaded), dict(self.vocab))
+            self.assertEqual(loaded.i2w(1), "příliš")
+            self.assertEqual(loaded['nonexistent'], 0)
+        finally:
+            os.remove(fn)
+
+
+class VocabularyRemappingTests(unittest.TestCase):
+    def setUp(self):
+        # index 2 is unused, as Kaldi wordlists may have gaps
+        self.vocab = vocab.CompactVocabulary.from_words(["<unk>", "a", "b", "c"], [0, 1, 3, 4], "<unk>")
+        self.counts = [2, 5, 0, 1, 5]
+
+    def test_by_frequency(self):
+        remapping = vocab.VocabularyRemapping.by_frequency(self.vocab, self.counts)
+        self.assertEqual(remapping.old2new.tolist(), [2, 0, -1, 3, 1])
+        self.assertEqual(remapping.new2old.tolist(), [1, 4, 0, 3])
+
+    def test_remap_vocab(self):
+        remapping = vocab.VocabularyRemapping.by_frequency(self.vocab, self.counts)
+        remapped = remapping.remap_vocab(self.vocab)
+        self.assertEqual(dict(remapped), {"a": 0, "c": 1, "<unk>": 2, "b": 3})
+        self.assertEqual(dict(remapping.inverse().remap_vocab(remapped)), dict(self.vocab))
+
+    def test_invertible(self):
+        remapping = vocab.VocabularyRemapping.by_frequency(self.vocab, self.counts)
+        ids = torch.LongTensor([0, 1, 3, 4, 1])
+        self.assertEqual(remapping.inverse()(remapping(ids)).tolist(), ids.tolist())
+
+    def test_one_to_one(self):
+        self.assertRaises(ValueError, vocab.VocabularyRemapping, [0, 1, 1])
+
+    def test_save_load(self):
+        remapping = vocab.VocabularyRemapping.by_frequency(self.vocab, self.counts)
+        f = StringIO()
+        remapping.save(f)
+        f.seek(0)
+        loaded = vocab.load_vocabulary_remapping(f)
+        self.assertEqual(loaded.old2new.tolist(), remapping.old2new.tolist())
+
+    def test_write_kaldi_wordlist(self):
+        f = StringIO()
+        vocab.write_kaldi_wordlist(self.vocab, f)
+        self.assertEqual(f.getvalue(), "<unk> 0\na 1\nb 3\nc 4\n")
+        f.seek(0)
+        self.assertEqual(dict(vocab.vocab_from_kaldi_wordlist(f)), dict(self.vocab))